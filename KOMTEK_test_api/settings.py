@@ -73,14 +73,106 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Максимальный размер страницы, который клиент может задать параметром page_size (api/pagination.py)
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+# Кеши Django. Бэкенд выбирается переменной CACHE_BACKEND:
+# locmem - в памяти процесса (по умолчанию, подходит для разработки и проверки),
+# file - файлы в каталоге CACHE_LOCATION, общий для процессов на одной машине,
+# redis - Redis или совместимый сервер по адресу CACHE_LOCATION (нужен пакет redis)
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[os.environ.get('CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', 3600)),
+    }
+}
+
+# Кеш снимков версий справочников в памяти процесса (api/cache.py):
+# MAX_VERSIONS - максимальное количество версий в кеше, 0 отключает кеш,
+# MAX_ITEMS - максимальное суммарное количество элементов в загруженных индексах валидации,
+# MAX_AGE - через сколько секунд запись кеша перепроверяется по базе, чтобы увидеть изменения,
+# сделанные другими процессами (командами управления, другими процессами сервера),
+# SHARED_CACHE - имя кеша из CACHES (например default), общего для всех процессов сервера,
+# в котором дополнительно хранятся версии справочников, индексы валидации и страницы элементов.
+# Не задано - общий кеш не используется,
+# SHARED_MAX_ITEMS - максимальное количество элементов в индексе, сохраняемом в общий кеш
+CATALOG_CACHE = {
+    'MAX_VERSIONS': int(os.environ.get('CATALOG_CACHE_MAX_VERSIONS', 64)),
+    'MAX_ITEMS': int(os.environ.get('CATALOG_CACHE_MAX_ITEMS', 1000000)),
+    'MAX_AGE': float(os.environ.get('CATALOG_CACHE_MAX_AGE', 5)),
+    'SHARED_CACHE': os.environ.get('CATALOG_SHARED_CACHE', '') or None,
+    'SHARED_MAX_ITEMS': int(os.environ.get('CATALOG_SHARED_CACHE_MAX_ITEMS', 200000)),
+}
+
+# Время в секундах, в течение которого клиенты могут не перепроверять ответы
+# с конкретной версией справочника (заголовок Cache-Control)
+CATALOG_HTTP_MAX_AGE = int(os.environ.get('CATALOG_HTTP_MAX_AGE', 60))
+
+# Каталог файлов индексов валидации версий справочников (api/index_file.py). Файл индекса строится
+# при первой валидации по версии или командой build_validation_indexes и затем открывается через mmap,
+# так что после перезапуска индекс не строится заново, а его память общая для всех процессов сервера.
+# Не задан - индексы строятся по базе в памяти каждого процесса
+VALIDATION_INDEX_DIR = os.environ.get('VALIDATION_INDEX_DIR', '') or None
+
+# Параллельная валидация больших запросов в пуле процессов (api/parallel.py):
+# WORKERS - количество процессов пула на каждый процесс сервера, 0 или 1 отключает параллельную валидацию,
+# THRESHOLD - минимальное количество объектов в запросе (или в группе пакетной валидации) для параллельной проверки.
+# Работает только с индексами в файлах (VALIDATION_INDEX_DIR), которые процессы пула открывают через mmap
+VALIDATION_PARALLEL = {
+    'WORKERS': int(os.environ.get('VALIDATION_PARALLEL_WORKERS', 0)),
+    'THRESHOLD': int(os.environ.get('VALIDATION_PARALLEL_THRESHOLD', 100000)),
+}
+
+# Способ хранения составов версий справочников (api/models.py):
+# m2m - каждая версия хранит ссылки на все свои элементы в таблице ManyToMany,
+# intervals - для элементов хранятся интервалы версий CatalogItemLink, новая версия не копирует элементы.
+# Для перехода между способами существующие данные переносятся командой convert_catalog_storage
+CATALOG_STORAGE = os.environ.get('CATALOG_STORAGE', 'm2m')
+
+# Максимальное количество объектов в одном запросе пакетной валидации
+# и максимальный размер тела запроса (пакет из 100 тысяч объектов занимает около 10 МБ)
+VALIDATION_BATCH_MAX_SIZE = int(os.environ.get('VALIDATION_BATCH_MAX_SIZE', 100000))
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('DATA_UPLOAD_MAX_MEMORY_SIZE', 32 * 1024 * 1024))
+
+# Сбор метрик запросов (api/metrics.py): ENABLED подключает RequestMetricsMiddleware и эндпоинт /api/_metrics,
+# SAMPLE_RATE - доля запросов, для которых собираются метрики
+REQUEST_METRICS = {
+    'ENABLED': os.environ.get('REQUEST_METRICS_ENABLED', '') in ('1', 'true', 'True'),
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 0.1)),
+}
+if REQUEST_METRICS['ENABLED']:
+    MIDDLEWARE.insert(0, 'api.middleware.RequestMetricsMiddleware')
+
 WSGI_APPLICATION = 'KOMTEK_test_api.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+# Подключения к базе:
+# DATABASE_CONN_MAX_AGE - время жизни подключения в секундах, 0 (по умолчанию) - новое подключение
+# на каждый запрос, none - без ограничения. Подходит для WSGI, где у каждого потока свое подключение.
+# При запуске через ASGI синхронный код выполняется в разных потоках и постоянные подключения не переиспользуются,
+# поэтому для PostgreSQL лучше включить пул подключений DATABASE_POOL (пакет psycopg[pool], нужен Django 5.1 и новее),
+# с которым DATABASE_CONN_MAX_AGE не учитывается.
+# DATABASE_CONN_HEALTH_CHECKS - проверка подключения перед повторным использованием (по умолчанию включена)
+CONN_MAX_AGE = os.environ.get('DATABASE_CONN_MAX_AGE', '0')
+CONN_MAX_AGE = None if CONN_MAX_AGE.lower() == 'none' else int(CONN_MAX_AGE)
+CONN_HEALTH_CHECKS = os.environ.get('DATABASE_CONN_HEALTH_CHECKS', '1') in ('1', 'true', 'True')
+DATABASE_POOL = os.environ.get('DATABASE_POOL', '') in ('1', 'true', 'True')
+
 if os.environ.get('DATABASE', False) == 'POSTGRES':
     DATABASES = {
         'default': {
@@ -88,7 +180,17 @@ if os.environ.get('DATABASE', False) == 'POSTGRES':
             'HOST': 'postgres',
             'NAME': os.environ.get('POSTGRES_DB'),
             'USER': os.environ.get('POSTGRES_USER'),
-            'PASSWORD': os.environ.get('POSTGRES_PASSWORD')
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': CONN_HEALTH_CHECKS,
+            'OPTIONS': {
+                # размеры пула на каждый процесс сервера и время ожидания свободного подключения в секундах
+                'pool': {
+                    'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+                    'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+                },
+            } if DATABASE_POOL else {},
         }
     }
 else:
@@ -96,11 +198,32 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': CONN_HEALTH_CHECKS,
+            # журнал WAL, чтобы чтение не блокировалось записью, synchronous=NORMAL в режиме WAL не теряет
+            # целостность базы, временные таблицы в памяти и отображение файла базы в память.
+            # Транзакции сразу берут блокировку на запись, иначе одновременные транзакции, начавшие с чтения,
+            # не могут перейти к записи и сразу получают ошибку database is locked.
+            # Параметры init_command и transaction_mode поддерживаются с Django 5.1 (см. Pipfile).
+            # Отключается переменной SQLITE_TUNING=0
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+                    'PRAGMA temp_store=MEMORY; PRAGMA mmap_size=268435456'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                # время ожидания блокировки в секундах
+                'timeout': 20,
+            } if os.environ.get('SQLITE_TUNING', '1') in ('1', 'true', 'True') else {},
         }
     }
 
 
 
+# SQLite не поддерживает покрывающие индексы (INCLUDE), на нем эти столбцы индекса просто игнорируются
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
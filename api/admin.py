@@ -1,23 +1,21 @@
 from django.contrib import admin
-from api.models import Catalog, CatalogItem
+from api.models import Catalog, CatalogItem, interval_storage
 
 
 class CatalogAdmin(admin.ModelAdmin):
     """
     Класс, перегружающий поведение админки при действиях с моделью Catalog
     """
-    def save_related(self, request, form, formsets, change):
-        """
-        При сохранении через админку, если производится изменение
-        поля ManyToMany в перегруженном методе save(...) модели, то эти изменения аннулируются.
-        Данный метод перегружен, чтобы избежать этого.
-        """
-        # добавляем сохраненные в методе save(...) объекты в форму, которая пришла с админки
-        form.cleaned_data['items'] = form.cleaned_data['items'].union(form.instance.items.all())
-        # сохраняем
-        form.save_m2m()
-        for formset in formsets:
-            self.save_formset(request, form, formset, change=change)
+    list_display = ['identifier', 'version', 'date', 'item_count']
+    readonly_fields = ['item_count', 'digest']
+
+    def get_exclude(self, request, obj=None):
+        # при хранении составов интервалами поле items не используется,
+        # а при создании версии ее состав копируется из текущей версии обработчиками сигналов (api/signals.py),
+        # и поле формы заменило бы его
+        if interval_storage() or obj is None:
+            return ['items']
+        return super().get_exclude(request, obj)
 
 
 admin.site.register(Catalog, CatalogAdmin)
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # подключаем обработчики сигналов для сброса кеша справочников
+        from api import signals  # noqa: F401
+        # при включенном сборе метрик каждое подключение к базе получает обертку, учитывающую SQL запросы
+        if settings.REQUEST_METRICS['ENABLED']:
+            from api.metrics import instrument_connection
+            connection_created.connect(instrument_connection)
@@ -0,0 +1,152 @@
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.utils import json
+
+from api.cache import catalog_cache
+from api.filters import RelevantDateFilterBackend, ExactCatalogFilterBackend, get_catalog_date
+from api.models import Catalog, CatalogItem
+from api.pagination import PageNumberPagination
+from api.parallel import avalidate_items
+from api.renderers import FastJSONRenderer
+from api.serializers import CatalogFastSerializer, CatalogItemFastSerializer
+
+
+class AsyncAPIView(View):
+    """
+    Базовое асинхронное представление для работы через ASGI.
+    DRF не поддерживает асинхронные представления, поэтому используются обычные представления Django,
+    а ответы рендерятся тем же FastJSONRenderer, что и в синхронных представлениях,
+    так что содержимое ответов совпадает.
+    """
+    fast_json = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # как и в DRF, проверка CSRF не производится
+        view.csrf_exempt = True
+        return view
+
+    def render(self, data, status: int = 200) -> HttpResponse:
+        content = FastJSONRenderer().render(data, renderer_context={'view': self})
+        return HttpResponse(content, status=status, content_type='application/json')
+
+
+class AsyncListView(AsyncAPIView):
+    """
+    Асинхронный список объектов с фильтрами и постраничным выводом по номеру страницы,
+    аналог generics.ListAPIView. Запросы к базе выполняются асинхронными методами ORM.
+    Фильтры с методом afilter_queryset вызываются асинхронно, остальные только строят queryset.
+    """
+    queryset = None
+    serializer_class = None
+    filter_backends = []
+    ordering_fields = []
+    ordering = []
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request)
+        queryset = self.queryset.values(*self.serializer_class.get_fields())
+        for backend in self.filter_backends:
+            backend = backend()
+            if hasattr(backend, 'afilter_queryset'):
+                queryset = await backend.afilter_queryset(request, queryset, self)
+            else:
+                queryset = backend.filter_queryset(request, queryset, self)
+
+        paginator = PageNumberPagination()
+        paginator.request = request
+        django_paginator = paginator.django_paginator_class(queryset, paginator.get_page_size(request))
+        # количество объектов считается асинхронно заранее, чтобы Paginator не обращался к базе
+        django_paginator.count = await queryset.acount()
+        try:
+            page = django_paginator.page(paginator.get_page_number(request, django_paginator))
+        except InvalidPage:
+            return self.render({'detail': 'Invalid page.'}, status=404)
+        page.object_list = [row async for row in page.object_list]
+        paginator.page = page
+        data = self.serializer_class(page.object_list, many=True).data
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+class AsyncDetailView(AsyncAPIView):
+    """
+    Асинхронный конкретный объект, аналог generics.RetrieveAPIView
+    """
+    queryset = None
+    serializer_class = None
+
+    async def get(self, request, pk: int, *args, **kwargs):
+        model = self.queryset.model
+        try:
+            obj = await self.queryset.values(*self.serializer_class.get_fields()).aget(pk=pk)
+        except model.DoesNotExist:
+            return self.render({'detail': f'No {model._meta.object_name} matches the given query.'}, status=404)
+        return self.render(self.serializer_class(obj).data)
+
+
+class AsyncCatalogList(AsyncListView):
+    """
+    Асинхронный вариант списка справочников /api/catalogs/ с теми же параметрами
+    """
+    queryset = Catalog.objects.all()
+    serializer_class = CatalogFastSerializer
+    filter_backends = [RelevantDateFilterBackend, filters.OrderingFilter]
+    ordering_fields = ['date', 'identifier', 'version']
+    ordering = ['-date']
+
+
+class AsyncCatalogDetail(AsyncDetailView):
+    queryset = Catalog.objects.all()
+    serializer_class = CatalogFastSerializer
+
+
+class AsyncCatalogItemList(AsyncListView):
+    """
+    Асинхронный вариант списка элементов справочников /api/catalog-items/ с теми же параметрами
+    """
+    queryset = CatalogItem.objects.all()
+    serializer_class = CatalogItemFastSerializer
+    filter_backends = [ExactCatalogFilterBackend, filters.OrderingFilter]
+    ordering_fields = ['parent_identifier']
+    ordering = ['parent_identifier']
+
+
+class AsyncCatalogItemDetail(AsyncDetailView):
+    queryset = CatalogItem.objects.all()
+    serializer_class = CatalogItemFastSerializer
+
+
+class AsyncCatalogItemsValidation(AsyncAPIView):
+    """
+    Асинхронный вариант валидации элементов справочника /api/catalog-items/validation/ с теми же параметрами.
+    Тело запроса принимается только в формате JSON.
+    """
+    # в ответе повторяются объекты из запроса, поэтому используется обычный JSONRenderer
+    fast_json = False
+
+    async def post(self, request, *args, **kwargs):
+        identifier = request.GET.get('catalog_identifier', None)
+        if not identifier:
+            return self.render({'error': 'parameter "catalog_identifier" is required'})
+        version = request.GET.get('catalog_version', None)
+        try:
+            on_date = get_catalog_date(request.GET)
+        except ValueError:
+            return self.render({'error': 'parameter "date" must be in YYYY-MM-DD format'})
+        index = await catalog_cache.aget_index(identifier, version=version, on_date=on_date)
+        try:
+            # как и JSONParser в DRF, константы NaN и Infinity не принимаются, а пустое тело - пустой объект
+            data = json.loads(request.body) if request.body else {}
+        except ValueError as exc:
+            return self.render({'detail': f'JSON parse error - {exc}'}, status=400)
+        if not isinstance(data, list):
+            return self.render({'error': 'invalid data'})
+        validation_short_data = await avalidate_items(index, data)
+        return self.render({
+            'short_results': validation_short_data,
+            'results': zip(data, validation_short_data)
+        })
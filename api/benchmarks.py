@@ -0,0 +1,129 @@
+"""
+Общие функции для замеров производительности: генерация синтетических справочников,
+замер времени, количества запросов и пикового расхода памяти, воспроизведение записанных запросов.
+Используются командами generate_data и benchmark.
+"""
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Iterator, List
+
+from django.db import connection
+from django.test import Client
+
+from api.models import Catalog, CatalogItem
+
+
+def generate_catalogs(catalogs: int, versions: int, items: int, churn: int = 0, prefix: str = 'gen') -> List[str]:
+    """
+    Генерация catalogs справочников по versions версий с items элементами в каждом.
+    Версии идут с интервалом в один день и заканчиваются сегодняшней, так что последняя версия текущая.
+    Каждая следующая версия копирует элементы предыдущей и получает churn новых элементов.
+    :return: идентификаторы созданных справочников
+    """
+    identifiers = []
+    first_date = date.today() - timedelta(days=versions - 1)
+    for number in range(catalogs):
+        identifier = f'{prefix}-{number}'
+        identifiers.append(identifier)
+        catalog = Catalog(identifier=identifier, short_name=identifier, version='1', date=first_date)
+        catalog.save()
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(item), parent_identifier=identifier, code=f'c{item}', value=f'value {item}')
+            for item in range(items)
+        )
+        for version in range(1, versions):
+            catalog = catalog.clone(str(version + 1), on_date=first_date + timedelta(days=version))
+            CatalogItem.bulk_create_linked(
+                CatalogItem(identifier=str(item), parent_identifier=identifier, code=f'c{item}', value=f'value {item}')
+                for item in range(items + (version - 1) * churn, items + version * churn)
+            )
+    return identifiers
+
+
+class Measurement:
+    """
+    Результаты замера: время каждого повтора, количество запросов к базе за один повтор
+    и пиковый расход памяти в байтах
+    """
+    def __init__(self, timings: List[float], queries: int, peak_memory: int):
+        self.timings = sorted(timings)
+        self.queries = queries
+        self.peak_memory = peak_memory
+
+    def percentile(self, percent: int) -> float:
+        if len(self.timings) == 1:
+            return self.timings[0]
+        return statistics.quantiles(self.timings, n=100, method='inclusive')[percent - 1]
+
+    def __str__(self):
+        return (f'repeat={len(self.timings)} queries={self.queries} '
+                f'p50={self.percentile(50) * 1000:.1f}ms p99={self.percentile(99) * 1000:.1f}ms '
+                f'peak_memory={self.peak_memory / 1024 / 1024:.2f}MB')
+
+
+def measure(func: Callable[[int], object], repeat: int) -> Measurement:
+    """
+    Замер функции func, которой передается номер повтора.
+    Количество запросов и пиковый расход памяти считаются по отдельному первому вызову,
+    так как отслеживание памяти через tracemalloc замедляет выполнение, а время - по остальным повторам.
+    """
+    # запросы считаются через execute_wrapper, так как connection.queries ограничен по длине
+    # и очищается в начале каждого запроса к тестовому клиенту
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    tracemalloc.start()
+    try:
+        with connection.execute_wrapper(count_query):
+            func(0)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings = []
+    for number in range(1, repeat + 1):
+        start = time.perf_counter()
+        func(number)
+        timings.append(time.perf_counter() - start)
+    return Measurement(timings, len(queries), peak_memory)
+
+
+def read_replay(path: str) -> Iterator[dict]:
+    """
+    Чтение записанных запросов из файла JSON Lines. Каждая строка - объект с полями
+    method (по умолчанию GET), path (путь с параметрами), body (тело запроса для POST)
+    и content_type (по умолчанию application/json). Строки без поля path пропускаются.
+    """
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and isinstance(record.get('path'), str):
+                yield record
+
+
+def replay_request(client: Client, record: dict) -> int:
+    """
+    Выполнение одного записанного запроса через тестовый клиент
+    :return: код ответа
+    """
+    method = record.get('method', 'GET').lower()
+    body = record.get('body', None)
+    content_type = record.get('content_type', 'application/json')
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body)
+    if method == 'get':
+        response = client.get(record['path'])
+    else:
+        response = getattr(client, method)(record['path'], body or '', content_type=content_type)
+    if response.streaming:
+        # потоковый ответ нужно прочитать, чтобы учесть время его формирования
+        for _ in response.streaming_content:
+            pass
+    return response.status_code
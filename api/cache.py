@@ -0,0 +1,458 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from api.index_file import MappedItemsIndex
+from api.metrics import registry as metrics_registry
+from api.models import Catalog, CatalogItem
+from api.validation import CatalogItemsIndex
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок одной версии справочника.
+    Хранит основные поля справочника и, после первого обращения, хешированный индекс его элементов.
+    """
+    __slots__ = ('id', 'identifier', 'version', 'date', 'modified', 'digest', 'stamp', '_index')
+
+    def __init__(self, id: int, identifier: str, version: str, date: date, modified: datetime, digest: str,
+                 stamp: Optional[str] = None):
+        self.id = id
+        self.identifier = identifier
+        self.version = version
+        self.date = date
+        self.modified = modified
+        # хеш содержимого версии, хранящийся в справочнике (api/digest.py)
+        self.digest = digest
+        # метка версии общего кеша, с которой был получен снимок, None если общий кеш не используется
+        self.stamp = stamp
+        self._index = None
+
+    @property
+    def fields(self) -> tuple:
+        """
+        Поля снимка без индекса для сохранения в общий кеш
+        """
+        return self.id, self.identifier, self.version, self.date, self.modified, self.digest
+
+    @property
+    def index(self) -> CatalogItemsIndex:
+        """
+        Индекс элементов справочника, загружается из базы при первом обращении.
+        Если задана настройка VALIDATION_INDEX_DIR, то индекс открывается из файла, а при его отсутствии
+        файл сначала строится по базе (api/index_file.py)
+        """
+        if self._index is None:
+            queryset = CatalogItem.objects.filter(CatalogItem.in_catalog(self))
+            if settings.VALIDATION_INDEX_DIR:
+                self._index = MappedItemsIndex.load_or_build(settings.VALIDATION_INDEX_DIR, self.digest, queryset)
+            else:
+                self._index = CatalogItemsIndex.from_queryset(queryset)
+        return self._index
+
+    async def aload_index(self) -> CatalogItemsIndex:
+        """
+        Асинхронная загрузка индекса элементов справочника
+        """
+        if self._index is None:
+            queryset = CatalogItem.objects.filter(CatalogItem.in_catalog(self))
+            if settings.VALIDATION_INDEX_DIR:
+                self._index = await sync_to_async(MappedItemsIndex.load_or_build)(
+                    settings.VALIDATION_INDEX_DIR, self.digest, queryset
+                )
+            else:
+                self._index = await CatalogItemsIndex.afrom_queryset(queryset)
+        return self._index
+
+    @property
+    def size(self) -> int:
+        """
+        Условный размер снимка для вытеснения: сам справочник плюс загруженные элементы.
+        Индекс из файла не занимает память процесса, страницы файла общие для всех процессов
+        """
+        if self._index is None or isinstance(self._index, MappedItemsIndex):
+            return 1
+        return 1 + len(self._index)
+
+
+def new_stamp() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class SharedCache:
+    """
+    Общий для всех процессов сервера кеш поверх кеша Django (настройка CACHES).
+    Каждому идентификатору справочника соответствует метка версии, которая меняется при каждом сбросе,
+    есть также общая метка для сброса всего кеша. Метки входят в ключи всех данных,
+    поэтому сброс в одном процессе делает недоступными сохраненные до него данные для всех процессов,
+    а сами устаревшие записи удаляются бэкендом кеша по истечении времени жизни.
+    """
+    prefix = 'catalog'
+
+    def __init__(self, alias: str, max_items: int = 200000):
+        self.alias = alias
+        self.max_items = max_items
+
+    @property
+    def backend(self):
+        # caches возвращает отдельный объект бэкенда для каждого потока
+        return caches[self.alias]
+
+    def stamp_keys(self, identifier: str) -> Tuple[str, str]:
+        return f'{self.prefix}:stamp', f'{self.prefix}:stamp:{self.hash(identifier)}'
+
+    def stamp(self, identifier: str) -> str:
+        """
+        Текущая метка версии для идентификатора справочника: общая метка и метка идентификатора.
+        Отсутствующие метки создаются, add не перезаписывает метку, одновременно созданную другим процессом.
+        """
+        keys = self.stamp_keys(identifier)
+        stamps = self.backend.get_many(keys)
+        if len(stamps) < len(keys):
+            for key in keys:
+                if key not in stamps:
+                    self.backend.add(key, new_stamp(), timeout=None)
+            stamps = self.backend.get_many(keys)
+        return '.'.join(stamps.get(key, '') for key in keys)
+
+    async def astamp(self, identifier: str) -> str:
+        """
+        Асинхронный вариант метода stamp
+        """
+        keys = self.stamp_keys(identifier)
+        stamps = await self.backend.aget_many(keys)
+        if len(stamps) < len(keys):
+            for key in keys:
+                if key not in stamps:
+                    await self.backend.aadd(key, new_stamp(), timeout=None)
+            stamps = await self.backend.aget_many(keys)
+        return '.'.join(stamps.get(key, '') for key in keys)
+
+    def bump(self, identifier: Optional[str] = None) -> None:
+        """
+        Смена метки версии идентификатора справочника, либо общей метки, если он не указан
+        """
+        key = self.stamp_keys(identifier or '')[0 if identifier is None else 1]
+        self.backend.set(key, new_stamp(), timeout=None)
+
+    def key(self, kind: str, stamp: str, *parts) -> str:
+        # части ключа хешируются, так как идентификаторы и адреса могут содержать любые символы
+        return f'{self.prefix}:{kind}:{self.hash(repr((stamp, *parts)))}'
+
+    @staticmethod
+    def hash(value: str) -> str:
+        return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+    def get(self, kind: str, stamp: str, *parts):
+        return self.backend.get(self.key(kind, stamp, *parts))
+
+    async def aget(self, kind: str, stamp: str, *parts):
+        return await self.backend.aget(self.key(kind, stamp, *parts))
+
+    def set(self, kind: str, stamp: str, *parts, value) -> None:
+        self.backend.set(self.key(kind, stamp, *parts), value)
+
+    async def aset(self, kind: str, stamp: str, *parts, value) -> None:
+        await self.backend.aset(self.key(kind, stamp, *parts), value)
+
+
+# значение в общем кеше для версии справочника, которой нет
+MISSING = 'missing'
+
+
+class CatalogSnapshotCache:
+    """
+    Кеш снимков версий справочников в памяти процесса.
+    Ключами служат пары (identifier, version) для конкретных версий и
+    (identifier, date) для разрешения текущей на дату версии.
+    Вытеснение производится по принципу LRU при превышении количества версий
+    или суммарного количества элементов в загруженных индексах.
+    Кеш сбрасывается сигналами из api/signals.py при изменении справочников и их элементов.
+    Сигналы приходят только в процесс, выполнивший изменение, поэтому записи старше max_age секунд
+    перепроверяются одним запросом к базе: если версия, ее время изменения и хеш содержимого не изменились,
+    то снимок вместе с загруженным индексом используется дальше. Так изменения из других процессов
+    (команды, другие процессы сервера) становятся видны не позже, чем через max_age секунд.
+    Если задан общий кеш (shared_cache), то при промахе версии справочников и индексы ищутся в нем,
+    а перед каждым поиском проверяется метка версии идентификатора в общем кеше: если ее сменил
+    сброс в другом процессе, то снимки этого идентификатора удаляются и из памяти процесса.
+    В общем кеше также хранятся страницы списка элементов справочника (get_page, set_page).
+    """
+    def __init__(self, max_versions: int = 64, max_items: int = 1000000, max_age: float = 5,
+                 shared_cache: Optional[str] = None, shared_max_items: int = 200000):
+        self.max_versions = max_versions
+        self.max_items = max_items
+        self.max_age = max_age
+        self.shared = SharedCache(shared_cache, shared_max_items) if shared_cache else None
+        # identifier -> метка версии общего кеша, с которой согласованы снимки в памяти процесса
+        self._stamps = {}
+        self._lock = threading.RLock()
+        # (identifier, version) -> (CatalogSnapshot или None, если такой версии нет; время проверки)
+        self._snapshots = OrderedDict()
+        # (identifier, date) -> (version или None, если на эту дату справочника нет; время проверки)
+        self._current = OrderedDict()
+        # номер поколения кеша, увеличивается при каждом сбросе, чтобы не сохранить
+        # в кеш данные, загруженные одновременно с изменением справочника
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_versions > 0
+
+    def resolve(self, identifier: str, version: Optional[str] = None,
+                on_date: Optional[date] = None) -> Optional[CatalogSnapshot]:
+        """
+        Метод для поиска снимка указанной версии справочника, аналог Catalog.get_by_version.
+        Если версия не указана, то возвращается версия, актуальная на дату on_date (по умолчанию сегодня).
+        :param identifier: идентификатор справочника
+        :param version: версия
+        :param on_date: дата, на которую ищется актуальная версия
+        :return: объект CatalogSnapshot либо None
+        """
+        if version is None and on_date is None:
+            on_date = date.today()
+        stamp = self._sync_stamp(identifier, self.shared.stamp(identifier)) if self.shared else None
+        found, cached, stale, generation = self._lookup(identifier, version, on_date)
+        if found:
+            return cached
+        # устаревшая запись проверяется по базе, а не по общему кешу, который мог устареть так же
+        fields = None
+        if stamp is not None and not stale:
+            fields = self.shared.get('snapshot', stamp, identifier, version, on_date)
+            metrics_registry.observe_cache('snapshot', 'shared', fields is not None)
+        if fields is None:
+            snapshot = self._make_snapshot(Catalog.get_by_version(identifier, version=version, on_date=on_date),
+                                           stamp)
+            if stamp is not None:
+                self.shared.set('snapshot', stamp, identifier, version, on_date,
+                                value=snapshot.fields if snapshot else MISSING)
+        else:
+            snapshot = None if fields == MISSING else CatalogSnapshot(*fields, stamp=stamp)
+        snapshot = self._revalidated(snapshot, cached)
+        self._store(identifier, version, on_date, snapshot, generation)
+        return snapshot
+
+    async def aresolve(self, identifier: str, version: Optional[str] = None,
+                       on_date: Optional[date] = None) -> Optional[CatalogSnapshot]:
+        """
+        Асинхронный вариант метода resolve
+        """
+        if version is None and on_date is None:
+            on_date = date.today()
+        stamp = self._sync_stamp(identifier, await self.shared.astamp(identifier)) if self.shared else None
+        found, cached, stale, generation = self._lookup(identifier, version, on_date)
+        if found:
+            return cached
+        fields = None
+        if stamp is not None and not stale:
+            fields = await self.shared.aget('snapshot', stamp, identifier, version, on_date)
+            metrics_registry.observe_cache('snapshot', 'shared', fields is not None)
+        if fields is None:
+            catalog = await Catalog.aget_by_version(identifier, version=version, on_date=on_date)
+            snapshot = self._make_snapshot(catalog, stamp)
+            if stamp is not None:
+                await self.shared.aset('snapshot', stamp, identifier, version, on_date,
+                                       value=snapshot.fields if snapshot else MISSING)
+        else:
+            snapshot = None if fields == MISSING else CatalogSnapshot(*fields, stamp=stamp)
+        snapshot = self._revalidated(snapshot, cached)
+        self._store(identifier, version, on_date, snapshot, generation)
+        return snapshot
+
+    def get_index(self, identifier: str, version: Optional[str] = None,
+                  on_date: Optional[date] = None) -> CatalogItemsIndex:
+        """
+        Метод для получения индекса элементов указанной версии справочника.
+        Если справочник не найден, возвращается пустой индекс.
+        """
+        with self._lock:
+            generation = self._generation
+        snapshot = self.resolve(identifier, version=version, on_date=on_date)
+        if snapshot is None:
+            return CatalogItemsIndex(())
+        metrics_registry.observe_cache('index', 'local', snapshot._index is not None)
+        # индексы из файлов и так общие для всех процессов, поэтому в общий кеш не сохраняются
+        if snapshot._index is None and snapshot.stamp is not None and not settings.VALIDATION_INDEX_DIR:
+            keys = self.shared.get('index', snapshot.stamp, snapshot.id)
+            metrics_registry.observe_cache('index', 'shared', keys is not None)
+            if keys is not None:
+                snapshot._index = CatalogItemsIndex(keys)
+            elif len(snapshot.index) <= self.shared.max_items:
+                self.shared.set('index', snapshot.stamp, snapshot.id, value=snapshot.index.keys)
+        return self._store_index(snapshot, snapshot.index, generation)
+
+    async def aget_index(self, identifier: str, version: Optional[str] = None,
+                         on_date: Optional[date] = None) -> CatalogItemsIndex:
+        """
+        Асинхронный вариант метода get_index
+        """
+        with self._lock:
+            generation = self._generation
+        snapshot = await self.aresolve(identifier, version=version, on_date=on_date)
+        if snapshot is None:
+            return CatalogItemsIndex(())
+        metrics_registry.observe_cache('index', 'local', snapshot._index is not None)
+        # индексы из файлов и так общие для всех процессов, поэтому в общий кеш не сохраняются
+        if snapshot._index is None and snapshot.stamp is not None and not settings.VALIDATION_INDEX_DIR:
+            keys = await self.shared.aget('index', snapshot.stamp, snapshot.id)
+            metrics_registry.observe_cache('index', 'shared', keys is not None)
+            if keys is not None:
+                snapshot._index = CatalogItemsIndex(keys)
+            elif len(await snapshot.aload_index()) <= self.shared.max_items:
+                await self.shared.aset('index', snapshot.stamp, snapshot.id, value=snapshot._index.keys)
+        return self._store_index(snapshot, await snapshot.aload_index(), generation)
+
+    def get_page(self, snapshot: CatalogSnapshot, key: str):
+        """
+        Получение из общего кеша сохраненной страницы списка элементов версии справочника.
+        :param snapshot: снимок версии справочника
+        :param key: ключ страницы, например полный адрес запроса
+        :return: данные страницы или None, если их нет или общий кеш не используется
+        """
+        if snapshot.stamp is None:
+            return None
+        data = self.shared.get('page', snapshot.stamp, snapshot.id, key)
+        metrics_registry.observe_cache('page', 'shared', data is not None)
+        return data
+
+    def set_page(self, snapshot: CatalogSnapshot, key: str, data) -> None:
+        """
+        Сохранение страницы списка элементов версии справочника в общий кеш
+        """
+        if snapshot.stamp is not None:
+            self.shared.set('page', snapshot.stamp, snapshot.id, key, value=data)
+
+    def _sync_stamp(self, identifier: str, stamp: str) -> str:
+        """
+        Согласование снимков идентификатора в памяти процесса с меткой версии из общего кеша
+        """
+        with self._lock:
+            if self._stamps.get(identifier) != stamp:
+                self._invalidate_local(identifier)
+                self._stamps[identifier] = stamp
+        return stamp
+
+    def _lookup(self, identifier: str, version: Optional[str], on_date: Optional[date]):
+        """
+        Поиск в кеше. Возвращает признак попадания, снимок, признак того, что найденная запись устарела
+        и должна быть перепроверена по базе, и номер поколения кеша на момент поиска.
+        Для устаревшей записи возвращается ее снимок, чтобы после проверки использовать его индекс.
+        """
+        now = time.monotonic()
+        stale = False
+        with self._lock:
+            if version is None:
+                key = (identifier, on_date)
+                if key in self._current:
+                    self._current.move_to_end(key)
+                    version, checked = self._current[key]
+                    stale = self._expired(checked, now)
+                    if version is None and not stale:
+                        metrics_registry.observe_cache('snapshot', 'local', True)
+                        return True, None, False, self._generation
+            key = (identifier, version)
+            if version is not None and key in self._snapshots:
+                self._snapshots.move_to_end(key)
+                snapshot, checked = self._snapshots[key]
+                stale = stale or self._expired(checked, now)
+                metrics_registry.observe_cache('snapshot', 'local', not stale)
+                return not stale, snapshot, stale, self._generation
+            metrics_registry.observe_cache('snapshot', 'local', False)
+            return False, None, stale, self._generation
+
+    def _expired(self, checked: float, now: float) -> bool:
+        return now - checked >= self.max_age
+
+    @staticmethod
+    def _revalidated(snapshot: Optional[CatalogSnapshot],
+                     previous: Optional[CatalogSnapshot]) -> Optional[CatalogSnapshot]:
+        """
+        Снимок, полученный при перепроверке устаревшей записи: если версия не изменилась,
+        то используется прежний снимок вместе с его загруженным индексом
+        """
+        if previous is not None and snapshot is not None and previous.fields == snapshot.fields:
+            return previous
+        return snapshot
+
+    def _store(self, identifier: str, version: Optional[str], on_date: Optional[date],
+               snapshot: Optional[CatalogSnapshot], generation: int) -> None:
+        """
+        Сохранение результата поиска в кеше, если за время поиска кеш не сбрасывался
+        """
+        with self._lock:
+            if generation != self._generation or not self.enabled:
+                return
+            now = time.monotonic()
+            if version is None:
+                self._current[(identifier, on_date)] = (snapshot.version if snapshot else None, now)
+                if snapshot is not None:
+                    self._snapshots[(identifier, snapshot.version)] = (snapshot, now)
+            else:
+                self._snapshots[(identifier, version)] = (snapshot, now)
+            self._evict()
+
+    def _store_index(self, snapshot: CatalogSnapshot, index: CatalogItemsIndex, generation: int) -> CatalogItemsIndex:
+        with self._lock:
+            if generation == self._generation:
+                self._evict()
+            else:
+                # снимок мог устареть, пока загружался индекс
+                snapshot._index = None
+        return index
+
+    def invalidate(self, identifier: Optional[str] = None) -> None:
+        """
+        Сброс кеша для указанного идентификатора справочника, либо полностью, если он не указан.
+        В общем кеше меняется метка версии, что сбрасывает кеш и во всех остальных процессах.
+        """
+        if self.shared is not None:
+            self.shared.bump(identifier)
+        self._invalidate_local(identifier)
+
+    def _invalidate_local(self, identifier: Optional[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            if identifier is None:
+                self._snapshots.clear()
+                self._current.clear()
+                self._stamps.clear()
+                return
+            for cache in (self._snapshots, self._current):
+                for key in [key for key in cache if key[0] == identifier]:
+                    del cache[key]
+            self._stamps.pop(identifier, None)
+
+    def clear(self) -> None:
+        self.invalidate()
+
+    @staticmethod
+    def _make_snapshot(catalog: Optional[Catalog], stamp: Optional[str] = None) -> Optional[CatalogSnapshot]:
+        if catalog is None:
+            return None
+        return CatalogSnapshot(catalog.id, catalog.identifier, catalog.version, catalog.date, catalog.modified,
+                               catalog.digest, stamp)
+
+    def _evict(self) -> None:
+        # вытесняем давно не использованные версии, пока не уложимся в ограничения
+        while len(self._snapshots) > self.max_versions:
+            self._snapshots.popitem(last=False)
+        while len(self._current) > self.max_versions:
+            self._current.popitem(last=False)
+        total = sum(snapshot.size for snapshot, _ in self._snapshots.values() if snapshot is not None)
+        while total > self.max_items and self._snapshots:
+            _, (snapshot, _) = self._snapshots.popitem(last=False)
+            if snapshot is not None:
+                total -= snapshot.size
+
+
+# кеш общий для всего процесса
+catalog_cache = CatalogSnapshotCache(**{
+    key.lower(): value for key, value in getattr(settings, 'CATALOG_CACHE', {}).items()
+})
@@ -0,0 +1,44 @@
+"""
+Хеш содержимого версии справочника.
+Хеш версии - это сумма по модулю 2^256 хешей SHA-256 всех ее элементов (мультимножественный хеш).
+Он не зависит от порядка элементов и обновляется за O(количество измененных элементов):
+при добавлении элемента его хеш прибавляется, при удалении - вычитается,
+а новая версия, скопированная из предыдущей, получает ее хеш без пересчета.
+"""
+import hashlib
+from typing import Iterable
+
+from django.db.models import QuerySet
+
+# поля элемента, входящие в хеш
+DIGEST_FIELDS = ('id', 'identifier', 'parent_identifier', 'code', 'value')
+MODULUS = 2 ** 256
+EMPTY_DIGEST = '0' * 64
+
+
+def item_hash(row: Iterable) -> int:
+    """
+    Хеш одного элемента по значениям полей DIGEST_FIELDS
+    """
+    return int.from_bytes(hashlib.sha256('\x1e'.join(map(str, row)).encode()).digest(), 'big')
+
+
+def to_hex(value: int) -> str:
+    return format(value % MODULUS, '064x')
+
+
+def combine(digest: str, added: int = 0, removed: int = 0) -> str:
+    """
+    Изменение хеша версии на сумму хешей добавленных и удаленных элементов
+    """
+    return to_hex(int(digest or EMPTY_DIGEST, 16) + added - removed)
+
+
+def items_hash(queryset: QuerySet) -> int:
+    """
+    Сумма хешей элементов queryset, строки читаются из базы по частям
+    """
+    total = 0
+    for row in queryset.values_list(*DIGEST_FIELDS).iterator(chunk_size=2000):
+        total += item_hash(row)
+    return total % MODULUS
@@ -1,8 +1,11 @@
 import datetime
-from django.db.models import QuerySet, Count
+from typing import Optional
+
+from django.db.models import QuerySet, OuterRef, Subquery
 from rest_framework import filters
 
-from api.models import Catalog
+from api.cache import catalog_cache
+from api.models import CatalogItem
 
 
 class RelevantDateFilterBackend(filters.BaseFilterBackend):
@@ -15,27 +18,36 @@ class RelevantDateFilterBackend(filters.BaseFilterBackend):
         if date:
             # конвертируем дату
             date = datetime.date.fromisoformat(date)
-            # находим список уникальных идентификаторов
-            distinct_identifiers = [dictionary['identifier'] for dictionary in
-                                    queryset.values('identifier').annotate(Count('identifier'))]
-            # убираем из queryset справочники, которые точно не подходят (составлены позже)
-            queryset = queryset.filter(date__lte=date)
-
-            # находим актуальный справочник и убираем из queryset
-            # все справочники с таким же идентификатором, кроме найденного
-            for identifier in distinct_identifiers:
-                try:
-                    relevant_catalog = queryset.filter(identifier=identifier).latest('date')
-                    queryset = queryset.exclude(identifier=identifier, date__lt=relevant_catalog.date)
-                except queryset.model.DoesNotExist:
-                    queryset = queryset.exclude(identifier=identifier)
+            # для каждого справочника находим самую позднюю дату, не превышающую указанную,
+            # коррелированным подзапросом, чтобы вся выборка выполнялась одним запросом
+            latest_date = queryset.filter(
+                identifier=OuterRef('identifier'),
+                date__lte=date,
+            ).order_by('-date').values('date')[:1]
+            # оставляем только справочники с этой датой
+            queryset = queryset.filter(date__lte=date, date=Subquery(latest_date))
 
         return queryset
 
 
+def get_catalog_date(query_params) -> Optional[datetime.date]:
+    """
+    Функция для получения даты, на которую выбирается версия справочника, из параметра date.
+    Дата учитывается только без параметра catalog_version, так как конкретная версия важнее.
+    :param query_params: параметры запроса
+    :return: дата или None, если она не указана
+    :raises ValueError: если дата указана в неверном формате
+    """
+    on_date = query_params.get('date', None)
+    if not on_date or query_params.get('catalog_version', None):
+        return None
+    return datetime.date.fromisoformat(on_date)
+
+
 class ExactCatalogFilterBackend(filters.BaseFilterBackend):
     """
-    Фильтр для получения элементов заданного справочника текущей или указанной версии
+    Фильтр для получения элементов заданного справочника текущей, указанной версии
+    или версии, актуальной на указанную дату
     """
     def filter_queryset(self, request, queryset, view):
         # определяем есть ли нужный параметр
@@ -43,11 +55,34 @@ class ExactCatalogFilterBackend(filters.BaseFilterBackend):
         if identifier:
             # получаем второй параметр если есть
             version = request.query_params.get('catalog_version', None)
-            # получаем соответствующий справочник с помощью метода в модели Catalog
-            catalog = Catalog.get_by_version(identifier, version=version)
+            try:
+                on_date = get_catalog_date(request.query_params)
+            except ValueError:
+                return queryset.none()
+            # получаем снимок соответствующего справочника из кеша, при промахе он будет найден
+            # методом get_by_version в модели Catalog, для даты - одним запросом по индексу (identifier, -date)
+            catalog = catalog_cache.resolve(identifier, version=version, on_date=on_date)
             # возвращаем элементы справочника, если он нашелся
             if catalog:
-                return catalog.items.all()
+                return queryset.filter(CatalogItem.in_catalog(catalog))
+            else:
+                return queryset.none()
+        return queryset
+
+    async def afilter_queryset(self, request, queryset, view):
+        """
+        Асинхронный вариант метода filter_queryset для асинхронных представлений
+        """
+        identifier = request.query_params.get('catalog_identifier', None)
+        if identifier:
+            version = request.query_params.get('catalog_version', None)
+            try:
+                on_date = get_catalog_date(request.query_params)
+            except ValueError:
+                return queryset.none()
+            catalog = await catalog_cache.aresolve(identifier, version=version, on_date=on_date)
+            if catalog:
+                return queryset.filter(CatalogItem.in_catalog(catalog))
             else:
                 return queryset.none()
         return queryset
@@ -0,0 +1,163 @@
+"""
+Индекс валидации версии справочника, сохраняемый в файл и загружаемый через mmap.
+Файл содержит отсортированный массив 64-битных отпечатков (blake2b) ключей элементов KEY_FIELDS
+и фильтр Блума перед ним для быстрого отсева отсутствующих объектов.
+Файлы называются по хешу содержимого версии (api/digest.py), который вычисляется по тем же строкам,
+из которых строится индекс, так что содержимое файла всегда соответствует его имени,
+а версии с одинаковым составом элементов (например, только что созданная копия) используют один файл.
+Загрузка файла не читает его целиком, страницы отображаются в память по мере обращения
+и общие для всех процессов сервера.
+Совпадение отпечатков разных ключей возможно с вероятностью порядка N / 2^64 на проверку
+(около 5e-14 для справочника из миллиона элементов).
+"""
+import array
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterable, List, Optional
+
+from django.db.models import QuerySet
+
+from api.digest import DIGEST_FIELDS, item_hash, to_hex
+from api.validation import KEY_FIELDS, ItemKey, item_key
+
+MAGIC = b'KCIX'
+FORMAT_VERSION = 1
+# магическая строка, версия формата, количество отпечатков, размер фильтра Блума в байтах, хеш содержимого
+HEADER = struct.Struct('<4sIQQ64s')
+# бит фильтра Блума на один элемент, при двух проверках доля ложных срабатываний около 1.5%
+BLOOM_BITS_PER_ITEM = 16
+
+
+def fingerprint(key: ItemKey) -> int:
+    # поля корректного объекта не содержат нулевых символов, поэтому разделитель однозначен
+    return int.from_bytes(hashlib.blake2b('\x00'.join(key).encode(), digest_size=8).digest(), 'little')
+
+
+def bloom_size(count: int) -> int:
+    """
+    Размер фильтра Блума в битах: степень двойки, чтобы номер бита брался маской
+    """
+    bits = 64
+    while bits < count * BLOOM_BITS_PER_ITEM:
+        bits *= 2
+    return bits
+
+
+def index_path(directory: str, digest: str) -> str:
+    return os.path.join(directory, f'{digest}.idx')
+
+
+class MappedItemsIndex:
+    """
+    Индекс элементов версии справочника из файла, с тем же интерфейсом проверки, что и CatalogItemsIndex
+    """
+    __slots__ = ('path', 'digest', '_mmap', '_bloom', '_mask', '_fingerprints')
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f'{path} is not a validation index file')
+            magic, version, count, bloom_bytes, digest = HEADER.unpack(header)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f'{path} is not a validation index file')
+            if os.fstat(file.fileno()).st_size != HEADER.size + bloom_bytes + count * 8:
+                raise ValueError(f'{path} is truncated')
+            # отображение в память остается доступным и после закрытия файла
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.digest = digest.decode()
+        view = memoryview(self._mmap)
+        self._bloom = view[HEADER.size:HEADER.size + bloom_bytes]
+        self._mask = bloom_bytes * 8 - 1
+        # массив отпечатков просматривается двоичным поиском прямо в отображенной памяти
+        self._fingerprints = view[HEADER.size + bloom_bytes:].cast('Q')
+
+    @classmethod
+    def load(cls, directory: str, digest: str) -> Optional['MappedItemsIndex']:
+        """
+        Открытие файла индекса версии с хешем содержимого digest
+        :return: объект MappedItemsIndex или None, если файла нет
+        """
+        try:
+            return cls(index_path(directory, digest))
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def build(cls, directory: str, queryset: QuerySet) -> str:
+        """
+        Построение файла индекса по queryset элементов версии справочника.
+        Файл записывается во временный и затем переименовывается, так что одновременная сборка
+        в нескольких процессах не приводит к чтению недописанного файла.
+        :return: хеш содержимого, по которому назван файл
+        """
+        fingerprints = array.array('Q')
+        total = 0
+        # ключевые поля идут в DIGEST_FIELDS после id
+        key_start = DIGEST_FIELDS.index(KEY_FIELDS[0])
+        for row in queryset.values_list(*DIGEST_FIELDS).iterator(chunk_size=2000):
+            total += item_hash(row)
+            fingerprints.append(fingerprint(row[key_start:]))
+        digest = to_hex(total)
+        fingerprints = array.array('Q', sorted(set(fingerprints)))
+        bits = bloom_size(len(fingerprints))
+        bloom = bytearray(bits // 8)
+        for value in fingerprints:
+            for position in (value & (bits - 1), (value >> 32) & (bits - 1)):
+                bloom[position >> 3] |= 1 << (position & 7)
+
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(fingerprints), len(bloom), digest.encode()))
+                file.write(bloom)
+                file.write(fingerprints.tobytes())
+            os.replace(temp_path, index_path(directory, digest))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest
+
+    @classmethod
+    def load_or_build(cls, directory: str, digest: str, queryset: QuerySet) -> 'MappedItemsIndex':
+        """
+        Открытие файла индекса версии, при его отсутствии файл строится по queryset.
+        Если состав версии изменился после получения digest, то построенный файл относится
+        к новому содержимому и открывается он, а не файл с устаревшим хешем.
+        """
+        index = cls.load(directory, digest)
+        if index is None:
+            index = cls(index_path(directory, cls.build(directory, queryset)))
+        return index
+
+    def __contains__(self, key) -> bool:
+        value = fingerprint(key)
+        bloom, mask = self._bloom, self._mask
+        # позиции битов фильтра Блума берутся из независимых частей отпечатка
+        first, second = value & mask, (value >> 32) & mask
+        if not (bloom[first >> 3] >> (first & 7)) & 1 or not (bloom[second >> 3] >> (second & 7)) & 1:
+            return False
+        position = bisect.bisect_left(self._fingerprints, value)
+        return position < len(self._fingerprints) and self._fingerprints[position] == value
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def validate(self, items: Iterable) -> List[bool]:
+        return [self.check(item) for item in items]
+
+    def check(self, item) -> bool:
+        key = item_key(item)
+        return key is not None and key in self
+
+    def close(self) -> None:
+        # memoryview на отображенную память нужно освободить до закрытия mmap
+        self._bloom.release()
+        self._fingerprints.release()
+        self._mmap.close()
@@ -0,0 +1,237 @@
+import json
+import tempfile
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from api.benchmarks import generate_catalogs, measure, read_replay, replay_request
+from api.index_file import MappedItemsIndex
+from api.models import Catalog, CatalogItem
+from api.parallel import reset_executor, validate_items
+from api.renderers import FastJSONRenderer
+from api.serializers import CatalogItemSerializer, CatalogItemFastSerializer
+from api.validation import compile_item_key, serializer_item_key
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеры производительности на синтетических данных разного объема. '
+        'Данные создаются внутри транзакции и откатываются. Сценарии:\n'
+        'relevant_date - количество запросов и время ответа /api/catalogs/?date=..., '
+        'размер - количество идентификаторов справочников;\n'
+        'serialization - сериализация и рендеринг списка элементов через ModelSerializer и '
+        'через быстрый сериализатор, размер - количество элементов;\n'
+        'validation - проверка объектов запроса валидации через CatalogItemSerializer и через '
+        'функцию из compile_item_key, размер - количество объектов;\n'
+        'endpoints - время (p50, p99), количество запросов и пиковый расход памяти основных эндпоинтов '
+        '(список справочников на дату, элементы справочника, валидация, создание версии) на данных '
+        'из --catalogs справочников по --versions версий, размер - количество элементов в справочнике;\n'
+        'replay - воспроизведение записанных запросов из файла --replay через тестовый клиент '
+        'на тех же данных, формат файла описан в api/benchmarks.py;\n'
+        'parallel_validation - проверка объектов по индексу из файла в основном процессе и в пуле '
+        'из --workers процессов, размер - количество объектов и элементов справочника.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', default='relevant_date',
+                            choices=['relevant_date', 'serialization', 'validation', 'endpoints', 'replay',
+                                     'parallel_validation'], help='сценарий')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                            help='объемы данных')
+        parser.add_argument('--versions', type=int, default=3, help='количество версий каждого справочника')
+        parser.add_argument('--repeat', type=int, default=5, help='количество повторов замера')
+        parser.add_argument('--catalogs', type=int, default=10,
+                            help='количество справочников для сценариев endpoints и replay')
+        parser.add_argument('--churn', type=int, default=0,
+                            help='количество новых элементов в каждой следующей версии справочника')
+        parser.add_argument('--replay', default=None, help='файл с записанными запросами для сценария replay')
+        parser.add_argument('--workers', type=int, nargs='+', default=[2, 4],
+                            help='количество процессов пула для сценария parallel_validation')
+
+    def handle(self, *args, **options):
+        if options['scenario'] == 'replay' and not options['replay']:
+            raise CommandError('--replay is required for the replay scenario')
+        for size in options['sizes']:
+            with transaction.atomic():
+                getattr(self, f'bench_{options["scenario"]}')(size, options)
+                transaction.set_rollback(True)
+
+    def bench_relevant_date(self, size: int, options: dict) -> None:
+        client = Client()
+        self.create_catalogs(size, options['versions'])
+        # дата, на которую актуальна предпоследняя версия каждого справочника
+        on_date = date(2020, 1, 1) + timedelta(days=options['versions'] - 2)
+        url = f'/api/catalogs/?date={on_date.isoformat()}'
+        timings = []
+        for _ in range(options['repeat']):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            f'identifiers={size} versions={options["versions"]} '
+            f'count={response.json()["count"]} queries={len(queries)} '
+            f'best={min(timings) * 1000:.1f}ms'
+        )
+
+    def bench_serialization(self, size: int, options: dict) -> None:
+        CatalogItem.objects.bulk_create([
+            CatalogItem(identifier=str(number), parent_identifier='bench', code=f'c{number}', value=f'v{number}')
+            for number in range(size)
+        ])
+        queryset = CatalogItem.objects.filter(parent_identifier='bench').order_by('id')
+        fields = CatalogItemFastSerializer.get_fields()
+        renderer_context = {'view': type('View', (), {'fast_json': True})()}
+
+        def model_serializer():
+            data = CatalogItemSerializer(list(queryset), many=True).data
+            return JSONRenderer().render(data)
+
+        def fast_serializer():
+            data = CatalogItemFastSerializer(list(queryset.values(*fields)), many=True).data
+            return FastJSONRenderer().render(data, renderer_context=renderer_context)
+
+        results = {}
+        for name, func in (('model_serializer', model_serializer), ('fast_serializer', fast_serializer)):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                results[name] = func()
+                timings.append(time.perf_counter() - start)
+            results[name + '_time'] = min(timings)
+        self.stdout.write(
+            f'items={size} model_serializer={results["model_serializer_time"] * 1000:.1f}ms '
+            f'fast_serializer={results["fast_serializer_time"] * 1000:.1f}ms '
+            f'speedup={results["model_serializer_time"] / results["fast_serializer_time"]:.1f}x '
+            f'identical={results["model_serializer"] == results["fast_serializer"]}'
+        )
+
+    def bench_validation(self, size: int, options: dict) -> None:
+        # каждый десятый объект некорректен: пустое значение, слишком длинное значение или число вместо строки
+        items = []
+        for number in range(size):
+            item = {
+                'identifier': str(number), 'parent_identifier': 'bench', 'code': f' c{number} ', 'value': f'v{number}',
+            }
+            if number % 10 == 3:
+                item['code'] = ''
+            elif number % 10 == 6:
+                item['value'] = 'v' * 201
+            elif number % 10 == 9:
+                item['identifier'] = number
+            items.append(item)
+        compiled_item_key = compile_item_key()
+
+        results = {}
+        for name, func in (('serializer', serializer_item_key), ('compiled', compiled_item_key)):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                results[name] = [func(item) for item in items]
+                timings.append(time.perf_counter() - start)
+            results[name + '_time'] = min(timings)
+        self.stdout.write(
+            f'objects={size} serializer={size / results["serializer_time"]:.0f}/s '
+            f'compiled={size / results["compiled_time"]:.0f}/s '
+            f'speedup={results["serializer_time"] / results["compiled_time"]:.1f}x '
+            f'identical={results["serializer"] == results["compiled"]}'
+        )
+
+    def bench_endpoints(self, size: int, options: dict) -> None:
+        identifiers = generate_catalogs(options['catalogs'], options['versions'], size, churn=options['churn'])
+        identifier = identifiers[-1]
+        client = Client()
+        # дата, на которую актуальна первая версия каждого справочника
+        on_date = date.today() - timedelta(days=options['versions'] - 1)
+        # половина объектов совпадает с элементами справочника
+        validation_data = json.dumps([
+            {'identifier': str(item), 'parent_identifier': identifier, 'code': f'c{item}',
+             'value': f'value {item}' if item % 2 else 'other'}
+            for item in range(min(size, 1000))
+        ])
+        scenarios = (
+            ('catalog_list_date', lambda _: client.get(f'/api/catalogs/?date={on_date.isoformat()}')),
+            ('catalog_items', lambda _: client.get(f'/api/catalog-items/?catalog_identifier={identifier}')),
+            ('catalog_items_cursor', lambda _: client.get(
+                f'/api/catalog-items/?catalog_identifier={identifier}&pagination=cursor')),
+            ('validation', lambda _: client.post(f'/api/catalog-items/validation/?catalog_identifier={identifier}',
+                                                 validation_data, content_type='application/json')),
+            # создание версии сбрасывает кеш справочников, поэтому замеряется последним
+            ('version_creation', lambda number: Catalog.get_by_version(identifier).clone(f'bench-{number}')),
+        )
+        for name, func in scenarios:
+            self.stdout.write(f'items={size} catalogs={options["catalogs"]} versions={options["versions"]} '
+                              f'{name} {measure(func, options["repeat"])}')
+
+    def bench_replay(self, size: int, options: dict) -> None:
+        generate_catalogs(options['catalogs'], options['versions'], size, churn=options['churn'])
+        client = Client()
+        records = list(read_replay(options['replay']))
+        if not records:
+            self.stdout.write(f'no requests with "path" found in {options["replay"]}')
+        for record in records:
+            statuses = set()
+
+            def func(_, record=record):
+                statuses.add(replay_request(client, record))
+
+            measurement = measure(func, options['repeat'])
+            self.stdout.write(f'items={size} {record.get("method", "GET").upper()} {record["path"]} '
+                              f'status={",".join(map(str, sorted(statuses)))} {measurement}')
+
+    def bench_parallel_validation(self, size: int, options: dict) -> None:
+        CatalogItem.objects.bulk_create([
+            CatalogItem(identifier=str(number), parent_identifier='bench', code=f'c{number}', value=f'v{number}')
+            for number in range(size)
+        ])
+        # половина объектов совпадает с элементами справочника
+        items = [
+            {'identifier': str(number), 'parent_identifier': 'bench', 'code': f'c{number}',
+             'value': f'v{number}' if number % 2 else 'other'}
+            for number in range(size)
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            digest = MappedItemsIndex.build(directory, CatalogItem.objects.filter(parent_identifier='bench'))
+            index = MappedItemsIndex.load(directory, digest)
+            expected = index.validate(items)
+            serial = min(self.timed(lambda: index.validate(items)) for _ in range(options['repeat']))
+            self.stdout.write(f'objects={size} workers=1 time={serial * 1000:.1f}ms')
+            for workers in options['workers']:
+                with override_settings(VALIDATION_PARALLEL={'WORKERS': workers, 'THRESHOLD': 0}):
+                    reset_executor()
+                    try:
+                        # первый вызов запускает процессы пула и не учитывается
+                        identical = validate_items(index, items) == expected
+                        parallel = min(self.timed(lambda: validate_items(index, items))
+                                       for _ in range(options['repeat']))
+                    finally:
+                        reset_executor()
+                self.stdout.write(f'objects={size} workers={workers} time={parallel * 1000:.1f}ms '
+                                  f'speedup={serial / parallel:.2f}x identical={identical}')
+            index.close()
+
+    @staticmethod
+    def timed(func) -> float:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    @staticmethod
+    def create_catalogs(size: int, versions: int) -> None:
+        """
+        Создание справочников без элементов, версии идут с интервалом в один день
+        """
+        Catalog.objects.bulk_create([
+            Catalog(
+                identifier=f'bench-{number}',
+                version=f'1.{version}',
+                date=date(2020, 1, 1) + timedelta(days=version),
+            )
+            for number in range(size)
+            for version in range(versions)
+        ])
@@ -0,0 +1,56 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.index_file import MappedItemsIndex, index_path
+from api.models import Catalog, CurrentCatalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Построение файлов индексов валидации (api/index_file.py) в каталоге VALIDATION_INDEX_DIR, '
+        'чтобы первая валидация после запуска сервера не строила индекс по базе. '
+        'По умолчанию строятся индексы текущих версий справочников, у которых еще нет файла. '
+        'Версии с одинаковым составом элементов используют один файл.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('identifiers', nargs='*', help='идентификаторы справочников, по умолчанию все')
+        parser.add_argument('--all', action='store_true', help='построить индексы всех версий, а не только текущих')
+        parser.add_argument('--prune', action='store_true',
+                            help='удалить файлы, которые не соответствуют ни одной версии справочников')
+
+    def handle(self, *args, **options):
+        directory = settings.VALIDATION_INDEX_DIR
+        if not directory:
+            raise CommandError('VALIDATION_INDEX_DIR is not set')
+        if options['all']:
+            catalogs = Catalog.objects.order_by('identifier', 'date')
+        else:
+            catalogs = Catalog.objects.filter(
+                id__in=CurrentCatalog.objects.filter(catalog__isnull=False).values('catalog_id')
+            ).order_by('identifier')
+        if options['identifiers']:
+            catalogs = catalogs.filter(identifier__in=options['identifiers'])
+
+        built = 0
+        for catalog in catalogs.iterator():
+            if os.path.exists(index_path(directory, catalog.digest)):
+                continue
+            digest = MappedItemsIndex.build(directory, catalog.get_items())
+            built += 1
+            self.stdout.write(f'{catalog.identifier} {catalog.version}: {digest}')
+            if digest != catalog.digest:
+                self.stdout.write(self.style.WARNING(
+                    f'{catalog.identifier} {catalog.version}: stored digest {catalog.digest} is out of date, '
+                    f'run refresh_digests'
+                ))
+
+        if options['prune'] and os.path.isdir(directory):
+            digests = set(Catalog.objects.values_list('digest', flat=True))
+            for name in os.listdir(directory):
+                if name.endswith('.idx') and name[:-len('.idx')] not in digests:
+                    os.unlink(os.path.join(directory, name))
+                    self.stdout.write(f'removed {name}')
+        self.stdout.write(self.style.SUCCESS(f'{built} validation indexes built'))
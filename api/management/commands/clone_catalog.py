@@ -0,0 +1,35 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Создание новой версии справочника на основе указанной версии. '
+        'Элементы копируются запросом INSERT ... SELECT без загрузки в память.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('identifier', help='идентификатор справочника')
+        parser.add_argument('version', help='версия, из которой копируются элементы')
+        parser.add_argument('new_version', help='новая версия')
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='дата начала действия новой версии в формате YYYY-MM-DD, по умолчанию сегодня')
+
+    def handle(self, *args, **options):
+        source = Catalog.get_by_version(options['identifier'], version=options['version'])
+        if source is None:
+            raise CommandError(f'catalog "{options["identifier"]}" version "{options["version"]}" does not exist')
+        if Catalog.get_by_version(options['identifier'], version=options['new_version']) is not None:
+            raise CommandError(f'catalog "{options["identifier"]}" version "{options["new_version"]}" already exists')
+
+        start = time.perf_counter()
+        catalog = source.clone(options['new_version'], on_date=options['date'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'created catalog "{catalog.identifier}" version "{catalog.version}" (id={catalog.id}) '
+            f'with {catalog.get_items().count()} items in {elapsed:.2f}s'
+        ))
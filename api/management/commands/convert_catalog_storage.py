@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Catalog, CatalogItemLink
+
+
+class Command(BaseCommand):
+    help = (
+        'Перенос составов версий справочников между способами хранения: '
+        'intervals - из таблицы ManyToMany в интервалы CatalogItemLink, m2m - обратно. '
+        'После переноса нужно запустить сервер с соответствующей настройкой CATALOG_STORAGE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=['intervals', 'm2m'], help='новый способ хранения')
+        parser.add_argument('--batch-size', type=int, default=1000, help='размер пачки при вставке интервалов')
+
+    def handle(self, *args, **options):
+        identifiers = Catalog.objects.order_by('identifier').values_list('identifier', flat=True).distinct()
+        with transaction.atomic():
+            for identifier in identifiers:
+                if options['storage'] == 'intervals':
+                    links = self.to_intervals(identifier, options['batch_size'])
+                    self.stdout.write(f'{identifier}: {links} intervals')
+                else:
+                    rows = self.to_m2m(identifier)
+                    self.stdout.write(f'{identifier}: {rows} links')
+            if options['storage'] == 'm2m':
+                CatalogItemLink.objects.all().delete()
+        if settings.CATALOG_STORAGE != options['storage']:
+            self.stdout.write(self.style.WARNING(f'set CATALOG_STORAGE={options["storage"]} before starting the server'))
+        self.stdout.write(self.style.SUCCESS('done'))
+
+    @staticmethod
+    def to_intervals(identifier: str, batch_size: int) -> int:
+        """
+        Построение интервалов по составам версий в порядке их создания.
+        В памяти находится только состав одной версии и начала открытых интервалов.
+        """
+        through = Catalog.items.through
+        CatalogItemLink.objects.filter(identifier=identifier).delete()
+        links = []
+        # элемент -> id версии, с которой он непрерывно входит в справочник
+        opened = {}
+        for catalog_id in Catalog.objects.filter(identifier=identifier).order_by('id').values_list('id', flat=True):
+            members = set(through.objects.filter(catalog_id=catalog_id).values_list('catalogitem_id', flat=True))
+            for item_id in [item_id for item_id in opened if item_id not in members]:
+                links.append(CatalogItemLink(identifier=identifier, item_id=item_id,
+                                             valid_from=opened.pop(item_id), valid_to=catalog_id))
+            for item_id in members:
+                opened.setdefault(item_id, catalog_id)
+        links += [CatalogItemLink(identifier=identifier, item_id=item_id, valid_from=valid_from)
+                  for item_id, valid_from in opened.items()]
+        CatalogItemLink.objects.bulk_create(links, batch_size=batch_size)
+        through.objects.filter(catalog__identifier=identifier).delete()
+        return len(links)
+
+    @staticmethod
+    def to_m2m(identifier: str) -> int:
+        """
+        Заполнение таблицы ManyToMany по интервалам, для каждой версии одним запросом INSERT ... SELECT
+        """
+        rows = 0
+        for catalog in Catalog.objects.filter(identifier=identifier).order_by('id'):
+            Catalog.items.through.objects.filter(catalog_id=catalog.id).delete()
+            rows += catalog.link_items(
+                CatalogItemLink.objects.filter(CatalogItemLink.covering(catalog)).values('item_id')
+            )
+        return rows
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.benchmarks import generate_catalogs
+from api.models import Catalog, CatalogItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация синтетических данных: N справочников по V версий с M элементами в каждом. '
+        'Справочники получают идентификаторы <prefix>-0, <prefix>-1, ..., последняя версия каждого текущая.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalogs', type=int, default=10, help='количество справочников (N)')
+        parser.add_argument('--versions', type=int, default=3, help='количество версий каждого справочника (V)')
+        parser.add_argument('--items', type=int, default=1000, help='количество элементов в справочнике (M)')
+        parser.add_argument('--churn', type=int, default=0, help='количество новых элементов в каждой следующей версии')
+        parser.add_argument('--prefix', default='gen', help='префикс идентификаторов справочников')
+        parser.add_argument('--clear', action='store_true', help='удалить ранее созданные справочники с этим префиксом и их элементы')
+
+    def handle(self, *args, **options):
+        catalogs = Catalog.objects.filter(identifier__startswith=f'{options["prefix"]}-')
+        items = CatalogItem.objects.filter(parent_identifier__startswith=f'{options["prefix"]}-')
+        with transaction.atomic():
+            if options['clear']:
+                catalogs.delete()
+                items.delete()
+            elif catalogs.exists() or items.exists():
+                raise CommandError(f'catalogs with prefix "{options["prefix"]}" already exist, use --clear')
+            identifiers = generate_catalogs(
+                options['catalogs'], options['versions'], options['items'],
+                churn=options['churn'], prefix=options['prefix'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(identifiers)} catalogs x {options["versions"]} versions x {options["items"]} items created'
+        ))
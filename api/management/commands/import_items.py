@@ -0,0 +1,56 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import CatalogItem
+from api.serializers import CatalogItemSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Массовая загрузка элементов справочников из файла CSV (с заголовком) или JSONL. '
+        'Элементы добавляются в текущие версии справочников по родительскому идентификатору.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path, help='путь к файлу')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='формат файла, по умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000, help='размер пачки для вставки')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError(f'unknown file format "{file_format}", use --format')
+
+        start = time.perf_counter()
+        with path.open(encoding='utf-8', newline='') as file:
+            rows = csv.DictReader(file) if file_format == 'csv' else self.read_jsonl(file)
+            # при ошибке в любой строке транзакция откатывается
+            created = CatalogItem.bulk_create_linked(self.validate(rows), batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'imported {created} items in {elapsed:.2f}s '
+            f'({created / elapsed if elapsed else created:.0f} rows/sec)'
+        ))
+
+    @staticmethod
+    def read_jsonl(file):
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+    @staticmethod
+    def validate(rows):
+        """
+        Проверка строк файла сериализатором элементов справочника
+        """
+        for number, row in enumerate(rows, start=1):
+            serializer = CatalogItemSerializer(data=row)
+            if not serializer.is_valid():
+                raise CommandError(f'row {number}: {serializer.errors}')
+            yield CatalogItem(**serializer.validated_data)
@@ -0,0 +1,151 @@
+import asyncio
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.error import HTTPError
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест эндпоинтов с заданным количеством одновременных запросов. '
+        'Без --base-url запросы выполняются внутри процесса: пути /api/async/... через ASGI обработчик '
+        '(AsyncClient), остальные через WSGI обработчик (Client) в пуле потоков. '
+        'С --base-url запросы отправляются по HTTP на запущенный сервер (например, gunicorn и uvicorn). '
+        'Для сравнения передайте синхронный и асинхронный варианты одного эндпоинта: '
+        '/api/catalogs/ /api/async/catalogs/\n'
+        'Параметр --connections повторяет тест внутри процесса с разными режимами подключений к базе: '
+        'configured - как в настройках (например, с пулом DATABASE_POOL), close - новое подключение на каждый '
+        'запрос, persistent - постоянные подключения. В отчете выводится количество открытых подключений.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='пути эндпоинтов с параметрами')
+        parser.add_argument('--base-url', default=None, help='адрес запущенного сервера, например http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=20, help='количество одновременных запросов')
+        parser.add_argument('--requests', type=int, default=500, help='общее количество запросов на путь')
+        parser.add_argument('--connections', nargs='+', default=None,
+                            choices=['configured', 'close', 'persistent'], help='режимы подключений к базе')
+
+    def handle(self, *args, **options):
+        if options['connections'] and options['base_url']:
+            raise CommandError('--connections can be used only without --base-url')
+        for mode in options['connections'] or [None]:
+            with self.connection_mode(mode) as opened:
+                for path in options['paths']:
+                    opened.clear()
+                    if options['base_url']:
+                        handler = 'http'
+                        timings, errors, elapsed = self.run_threads(self.http_get(options['base_url'] + path), options)
+                    elif path.startswith('/api/async/'):
+                        handler = 'asgi'
+                        timings, errors, elapsed = asyncio.run(self.run_async(path, options, mode is not None))
+                    else:
+                        handler = 'wsgi'
+                        client = Client()
+                        get = self.closing(lambda: client.get(path).status_code) if mode is not None else (
+                            lambda: client.get(path).status_code
+                        )
+                        timings, errors, elapsed = self.run_threads(get, options)
+                    if mode is not None:
+                        handler = f'{handler} connections={mode} opened={len(opened)}'
+                    self.report(path, handler, timings, errors, elapsed)
+
+    @staticmethod
+    @contextmanager
+    def connection_mode(mode):
+        """
+        Временная смена режима подключений к базе по умолчанию и подсчет открытых за это время подключений.
+        Настройки подключения общие для всех потоков, так что режим действует и в потоках теста.
+        """
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        conn_max_age = settings_dict['CONN_MAX_AGE']
+        if mode == 'close':
+            settings_dict['CONN_MAX_AGE'] = 0
+        elif mode == 'persistent':
+            if settings_dict.get('OPTIONS', {}).get('pool'):
+                raise CommandError('persistent connections can not be used with DATABASE_POOL')
+            settings_dict['CONN_MAX_AGE'] = None
+        connections.close_all()
+        connection_created.connect(count)
+        try:
+            yield opened
+        finally:
+            connection_created.disconnect(count)
+            settings_dict['CONN_MAX_AGE'] = conn_max_age
+            connections.close_all()
+
+    @staticmethod
+    def closing(get):
+        """
+        Тестовый клиент не закрывает подключения к базе в конце запроса, в отличие от обработчиков
+        WSGI и ASGI сервера, поэтому для сравнения режимов подключений это делается после каждого запроса
+        """
+        def closing_get() -> int:
+            status = get()
+            close_old_connections()
+            return status
+        return closing_get
+
+    @staticmethod
+    def http_get(url: str):
+        def get() -> int:
+            try:
+                with urllib.request.urlopen(url) as response:
+                    response.read()
+                    return response.status
+            except HTTPError as exc:
+                return exc.code
+        return get
+
+    @staticmethod
+    def run_threads(get, options: dict):
+        def timed(_):
+            start = time.perf_counter()
+            status = get()
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(timed, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+        return [timing for timing, _ in results], sum(status >= 400 for _, status in results), elapsed
+
+    @staticmethod
+    async def run_async(path: str, options: dict, close_connections: bool = False):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def timed():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                if close_connections:
+                    # запросы к базе из асинхронных представлений выполняются в общем потоке sync_to_async
+                    await sync_to_async(close_old_connections)()
+                return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - start
+        return [timing for timing, _ in results], sum(status >= 400 for _, status in results), elapsed
+
+    def report(self, path: str, handler: str, timings: list, errors: int, elapsed: float) -> None:
+        timings = sorted(timings)
+        percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        self.stdout.write(
+            f'{handler} {path} requests={len(timings)} errors={errors} '
+            f'rps={len(timings) / elapsed:.0f} p50={percentiles[49] * 1000:.1f}ms p99={percentiles[98] * 1000:.1f}ms'
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Catalog, CurrentCatalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет указателей на текущие версии справочников. '
+        'По умолчанию пересчитываются только указатели справочников, у которых вступила в силу '
+        'следующая версия, с датой начала действия в будущем на момент создания. '
+        'Команду нужно запускать по расписанию сразу после полуночи, например из cron: '
+        '5 0 * * * python manage.py refresh_current_catalogs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='пересчитать указатели всех справочников, например после изменения '
+                                 'справочников в обход моделей')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            identifiers = set(Catalog.objects.values_list('identifier', flat=True).distinct())
+            # указатели справочников, у которых не осталось версий, удаляются
+            identifiers |= set(CurrentCatalog.objects.values_list('identifier', flat=True))
+            for identifier in sorted(identifiers):
+                CurrentCatalog.refresh(identifier)
+            refreshed = len(identifiers)
+        else:
+            refreshed = CurrentCatalog.refresh_stale()
+        self.stdout.write(self.style.SUCCESS(f'{refreshed} current catalog pointers refreshed'))
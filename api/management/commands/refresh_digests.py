@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.digest import items_hash, to_hex
+from api.models import Catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет хешей содержимого и количества элементов версий справочников по их элементам. '
+        'Нужен, если элементы изменялись в обход моделей, например запросами напрямую в базу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('identifiers', nargs='*', help='идентификаторы справочников, по умолчанию все')
+        parser.add_argument('--check', action='store_true',
+                            help='только проверить хеши и количество элементов и завершиться с ошибкой при расхождении')
+
+    def handle(self, *args, **options):
+        catalogs = Catalog.objects.order_by('identifier', 'date')
+        if options['identifiers']:
+            catalogs = catalogs.filter(identifier__in=options['identifiers'])
+        mismatched = 0
+        for catalog in catalogs.iterator():
+            digest = to_hex(items_hash(catalog.get_items()))
+            item_count = catalog.get_items().count()
+            if digest == catalog.digest and item_count == catalog.item_count:
+                continue
+            mismatched += 1
+            self.stdout.write(f'{catalog.identifier} {catalog.version}: {catalog.digest} -> {digest}, '
+                              f'{catalog.item_count} -> {item_count} items')
+            if not options['check']:
+                # сохранение через save сбросит кеш справочников
+                catalog.digest, catalog.item_count = digest, item_count
+                catalog.save(update_fields=['digest', 'item_count'])
+        if options['check'] and mismatched:
+            raise CommandError(f'{mismatched} catalog digests are out of date')
+        self.stdout.write(self.style.SUCCESS(f'{mismatched} catalog digests updated' if not options['check']
+                                             else 'all catalog digests are up to date'))
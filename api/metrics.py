@@ -0,0 +1,200 @@
+"""
+Сбор метрик запросов: количество и время SQL запросов, время сериализации, размер ответа.
+Метрики собираются только для выбранных запросов (REQUEST_METRICS['SAMPLE_RATE']) middleware
+api.middleware.RequestMetricsMiddleware и накапливаются в памяти процесса вместе со счетчиками
+попаданий в кеши справочников,
+откуда отдаются эндпоинтом /api/_metrics в текстовом формате Prometheus.
+При нескольких процессах сервера у каждого процесса свои метрики.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# границы корзин гистограмм
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class RequestMetrics:
+    """
+    Метрики одного запроса. Обновляются обертками выполнения SQL запросов и хуком profile.
+    """
+    __slots__ = ('start', 'queries', 'db_time', 'timings')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        # время по этапам, добавленным через profile, например serialization
+        self.timings = {}
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.start
+
+
+# метрики текущего запроса, None если запрос не выбран для сбора метрик.
+# ContextVar передается и в потоки sync_to_async, так что запросы к базе из асинхронных
+# представлений тоже учитываются
+current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar('current_metrics', default=None)
+
+
+@contextmanager
+def profile(name: str):
+    """
+    Хук для замера времени этапа обработки запроса, например:
+    with profile('serialization'): ...
+    Если для запроса метрики не собираются, ничего не делает.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL запросов (connection.execute_wrapper), учитывающая их количество и время
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    Обработчик сигнала connection_created, добавляющий обертку record_query к каждому новому подключению
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Накопленные метрики по представлениям, методам и кодам ответов
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str, str], dict] = {}
+        # (cache, layer, result) -> количество обращений к кешам справочников
+        self._cache: Dict[Tuple[str, str, str], int] = {}
+
+    def observe(self, view: str, method: str, status: int, metrics: RequestMetrics, duration: float,
+                response_size: Optional[int]) -> None:
+        with self._lock:
+            key = (view, method, str(status))
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'duration': Histogram(DURATION_BUCKETS),
+                    'queries': Histogram(QUERIES_BUCKETS),
+                    'db_seconds': 0.0,
+                    'serialization_seconds': 0.0,
+                    'response_bytes': 0,
+                }
+            series['duration'].observe(duration)
+            series['queries'].observe(metrics.queries)
+            series['db_seconds'] += metrics.db_time
+            series['serialization_seconds'] += metrics.timings.get('serialization', 0.0)
+            # размер потоковых ответов заранее неизвестен и не учитывается
+            series['response_bytes'] += response_size or 0
+
+    def observe_cache(self, cache: str, layer: str, hit: bool) -> None:
+        """
+        Учет обращения к кешу справочников (api/cache.py), по этим счетчикам считается доля попаданий.
+        В отличие от метрик запросов учитываются все обращения, а не только выбранных запросов.
+        :param cache: что искалось в кеше: snapshot, index или page
+        :param layer: уровень кеша: local (память процесса) или shared (общий кеш)
+        :param hit: найдено ли значение
+        """
+        key = (cache, layer, 'hit' if hit else 'miss')
+        with self._lock:
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._cache.clear()
+
+    def render_prometheus(self) -> str:
+        """
+        Вывод метрик в текстовом формате Prometheus
+        """
+        lines = [
+            '# HELP api_request_duration_seconds Request processing time of sampled requests.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for (view, method, status), values in series:
+                labels = f'view="{escape(view)}",method="{method}",status="{status}"'
+                lines.extend(render_histogram('api_request_duration_seconds', labels, values['duration']))
+            lines += [
+                '# HELP api_request_db_queries SQL queries per sampled request.',
+                '# TYPE api_request_db_queries histogram',
+            ]
+            for (view, method, status), values in series:
+                labels = f'view="{escape(view)}",method="{method}",status="{status}"'
+                lines.extend(render_histogram('api_request_db_queries', labels, values['queries']))
+            for name, help_text in (
+                ('db_seconds', 'Total SQL execution time of sampled requests.'),
+                ('serialization_seconds', 'Total response rendering time of sampled requests.'),
+                ('response_bytes', 'Total response size of sampled requests.'),
+            ):
+                lines += [f'# HELP api_request_{name}_total {help_text}', f'# TYPE api_request_{name}_total counter']
+                for (view, method, status), values in series:
+                    labels = f'view="{escape(view)}",method="{method}",status="{status}"'
+                    lines.append(f'api_request_{name}_total{{{labels}}} {values[name]}')
+            lines += [
+                '# HELP api_cache_requests_total Catalog cache lookups by cache, layer and result.',
+                '# TYPE api_cache_requests_total counter',
+            ]
+            for (cache, layer, result), count in sorted(self._cache.items()):
+                lines.append(f'api_cache_requests_total{{cache="{cache}",layer="{layer}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_histogram(name: str, labels: str, histogram: Histogram):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+# метрики общие для всего процесса
+registry = MetricsRegistry()
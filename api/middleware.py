@@ -0,0 +1,74 @@
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from api.metrics import RequestMetrics, current_metrics, registry
+
+
+class RequestMetricsMiddleware:
+    """
+    Middleware для сбора метрик запросов: количества и времени SQL запросов, времени сериализации
+    и размера ответа. Подключается настройкой REQUEST_METRICS['ENABLED'].
+    Метрики собираются для доли запросов REQUEST_METRICS['SAMPLE_RATE'], для остальных
+    запросов накладные расходы сводятся к проверке ContextVar в обертке SQL запросов.
+    Метрики выбранных запросов добавляются в заголовок Server-Timing
+    и накапливаются для эндпоинта /api/_metrics.
+    Работает как с синхронными, так и с асинхронными представлениями.
+    Для потоковых ответов учитывается только время до начала передачи, размер ответа не учитывается.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_METRICS['SAMPLE_RATE']
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled(request):
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not self.sampled(request):
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def sampled(self, request) -> bool:
+        # сам эндпоинт метрик не учитывается
+        if request.path.endswith('/_metrics'):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @staticmethod
+    def finish(request, response, metrics: RequestMetrics):
+        duration = metrics.duration
+        serialization = metrics.timings.get('serialization', 0.0)
+        response_size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"',
+            f'serialization;dur={serialization * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ))
+        match = request.resolver_match
+        registry.observe(
+            match.view_name if match is not None else 'unresolved',
+            request.method, response.status_code, metrics, duration, response_size,
+        )
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_auto_20210625_1426'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalog',
+            index=models.Index(fields=['identifier', '-date'], name='catalog_identifier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalog',
+            index=models.Index(fields=['-date', 'id'], name='catalog_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['parent_identifier', 'id'], include=('identifier', 'code', 'value'), name='item_parent_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:41
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def compute_digests(apps, schema_editor):
+    """
+    Вычисление хешей содержимого для уже существующих справочников, так же как в api/digest.py
+    """
+    Catalog = apps.get_model('api', 'Catalog')
+    for catalog in Catalog.objects.all().iterator():
+        total = 0
+        rows = catalog.items.values_list('id', 'identifier', 'parent_identifier', 'code', 'value')
+        for row in rows.iterator(chunk_size=2000):
+            total += int.from_bytes(hashlib.sha256('\x1e'.join(map(str, row)).encode()).digest(), 'big')
+        catalog.digest = format(total % 2 ** 256, '064x')
+        catalog.save(update_fields=['digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_catalog_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalog',
+            name='digest',
+            field=models.CharField(default='0000000000000000000000000000000000000000000000000000000000000000', editable=False, max_length=64, verbose_name='хеш содержимого'),
+        ),
+        migrations.RunPython(compute_digests, migrations.RunPython.noop),
+    ]
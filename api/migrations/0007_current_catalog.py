@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:45
+
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_current_catalogs(apps, schema_editor):
+    """
+    Заполнение указателей на текущие версии для уже существующих справочников, так же как в CurrentCatalog.refresh
+    """
+    Catalog = apps.get_model('api', 'Catalog')
+    CurrentCatalog = apps.get_model('api', 'CurrentCatalog')
+    today = date.today()
+    for identifier in Catalog.objects.values_list('identifier', flat=True).distinct():
+        versions = Catalog.objects.filter(identifier=identifier)
+        CurrentCatalog.objects.create(
+            identifier=identifier,
+            catalog=versions.filter(date__lte=today).order_by('-date').first(),
+            valid_until=versions.filter(date__gt=today).order_by('date').values_list('date', flat=True).first(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_catalog_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentCatalog',
+            fields=[
+                ('identifier', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='идентификатор')),
+                ('valid_until', models.DateField(null=True, verbose_name='действует до')),
+                ('catalog', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.catalog', verbose_name='текущая версия')),
+            ],
+            options={
+                'verbose_name': 'Текущая версия справочника',
+                'verbose_name_plural': 'Текущие версии справочников',
+            },
+        ),
+        migrations.RunPython(fill_current_catalogs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_current_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogItemLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=50, verbose_name='идентификатор справочника')),
+                ('valid_from', models.IntegerField(verbose_name='первая версия')),
+                ('valid_to', models.IntegerField(null=True, verbose_name='версия, в которую элемент уже не входит')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links', to='api.catalogitem', verbose_name='элемент справочника')),
+            ],
+            options={
+                'verbose_name': 'Интервал версий элемента справочника',
+                'verbose_name_plural': 'Интервалы версий элементов справочников',
+                'indexes': [models.Index(fields=['identifier', 'valid_from'], name='link_identifier_from_idx'), models.Index(fields=['identifier', 'valid_to'], name='link_identifier_to_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def count_items(apps, schema_editor):
+    """
+    Подсчет количества элементов уже существующих версий справочников при любом способе хранения составов
+    """
+    Catalog = apps.get_model('api', 'Catalog')
+    CatalogItemLink = apps.get_model('api', 'CatalogItemLink')
+    for catalog in Catalog.objects.all().iterator():
+        if settings.CATALOG_STORAGE == 'intervals':
+            item_count = CatalogItemLink.objects.filter(
+                Q(identifier=catalog.identifier, valid_from__lte=catalog.id)
+                & (Q(valid_to__isnull=True) | Q(valid_to__gt=catalog.id))
+            ).count()
+        else:
+            item_count = catalog.items.count()
+        Catalog.objects.filter(pk=catalog.pk).update(item_count=item_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_catalog_item_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalog',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество элементов'),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
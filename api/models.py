@@ -1,10 +1,134 @@
-from typing import Optional
+from itertools import islice
+from typing import Iterable, Optional
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction, connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.fields.related_descriptors import ManyToManyDescriptor
+from django.db.models.signals import m2m_changed
+from django.dispatch import Signal
 from datetime import date
 
+from api.digest import EMPTY_DIGEST
 
-class Catalog(models.Model):
+# сигналы массовых операций QuerySet.bulk_create и QuerySet.update, для которых Django не отправляет
+# pre_save и post_save, см. MaintainedQuerySet. Аргументы сигналов:
+# pre_bulk_create, post_bulk_create - objs (список объектов) и using;
+# pre_update - queryset (изменяемые объекты), fields (изменяемые поля), context и using;
+# post_update - fields, context и using.
+# context - словарь, через который обработчики pre_update передают данные обработчикам post_update
+pre_bulk_create = Signal()
+post_bulk_create = Signal()
+pre_update = Signal()
+post_update = Signal()
+
+
+def interval_storage() -> bool:
+    """
+    Хранятся ли составы версий справочников интервалами CatalogItemLink вместо таблицы ManyToMany
+    (настройка CATALOG_STORAGE)
+    """
+    return settings.CATALOG_STORAGE == 'intervals'
+
+
+class StorageCheckedDescriptor(ManyToManyDescriptor):
+    """
+    Доступ к связи ManyToMany справочников и элементов (Catalog.items и CatalogItem.catalog_set).
+    При хранении составов интервалами таблица ManyToMany не используется, поэтому чтение через связь,
+    как и запись (см. check_catalog_storage в api/signals.py), вызывает ошибку, а не возвращает пустой набор.
+    Обращение через класс (Catalog.items.through) разрешено при любом способе хранения.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is not None and interval_storage():
+            raise RuntimeError('catalog items are stored as intervals, use Catalog.get_items and Catalog.containing')
+        return super().__get__(instance, cls)
+
+
+def insert_from_select(model, values: dict, item_ids: models.QuerySet, item_field: str,
+                       using: Optional[str] = None) -> int:
+    """
+    Вставка строк в таблицу модели запросом INSERT ... SELECT, без загрузки элементов в память.
+    :param model: модель, в таблицу которой вставляются строки
+    :param values: значения полей, одинаковые для всех строк
+    :param item_ids: queryset с единственным полем item_id - идентификаторами элементов
+    :param item_field: поле модели, в которое записываются идентификаторы элементов
+    :return: количество вставленных строк
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    quote_name = connection.ops.quote_name
+    select_sql, params = item_ids.query.sql_with_params()
+    columns = [model._meta.get_field(field).column for field in (*values, item_field)]
+    sql = 'INSERT INTO {table} ({columns}) SELECT {values}source.item_id FROM ({select}) source'.format(
+        table=quote_name(model._meta.db_table),
+        columns=', '.join(map(quote_name, columns)),
+        values='%s, ' * len(values),
+        select=select_sql,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*values.values(), *params))
+        return cursor.rowcount
+
+
+class MaintainedQuerySet(models.QuerySet):
+    """
+    QuerySet, массовые операции которого отправляют сигналы pre_bulk_create/post_bulk_create
+    и pre_update/post_update, чтобы обработчики в api/signals.py поддерживали производные данные
+    справочников (указатели на текущие версии, количество элементов, хеши содержимого, кеш)
+    так же, как при сохранении отдельных объектов.
+    Изменение только полей из derived_fields модели (их и поддерживают обработчики) выполняется без сигналов.
+    """
+
+    def bulk_create(self, objs, *args, context: Optional[dict] = None, **kwargs):
+        """
+        :param context: данные обработчиков сигналов, общие для нескольких вызовов, например для пачек
+        одной загрузки в bulk_create_linked. По умолчанию у каждого вызова свои данные
+        """
+        objs = list(objs)
+        context = {} if context is None else context
+        with transaction.atomic(using=self.db):
+            pre_bulk_create.send(sender=self.model, objs=objs, context=context, using=self.db)
+            objs = super().bulk_create(objs, *args, **kwargs)
+            # при ignore_conflicts первичные ключи вставленных объектов неизвестны
+            post_bulk_create.send(sender=self.model, objs=[obj for obj in objs if obj.pk is not None],
+                                  context=context, using=self.db)
+        return objs
+
+    def update(self, **kwargs):
+        fields = set(kwargs)
+        if fields <= set(self.model.derived_fields):
+            return super().update(**kwargs)
+        context = {}
+        with transaction.atomic(using=self.db):
+            pre_update.send(sender=self.model, queryset=self, fields=fields, context=context, using=self.db)
+            rows = super().update(**kwargs)
+            post_update.send(sender=self.model, fields=fields, context=context, using=self.db)
+        return rows
+
+
+class MaintainedModel(models.Model):
+    """
+    Базовая модель, производные данные которой поддерживаются обработчиками сигналов в api/signals.py
+    """
+    objects = MaintainedQuerySet.as_manager()
+
+    # поля, которые изменяются только обработчиками сигналов
+    derived_fields = ()
+
+    def save(self, *args, **kwargs) -> None:
+        """
+        Сохранение в одной транзакции с обработчиками pre_save и post_save,
+        чтобы объект и его производные данные были видны другим запросам одновременно
+        """
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class Catalog(MaintainedModel):
     id = models.AutoField(primary_key=True)
 
     identifier = models.CharField(max_length=50, verbose_name="идентификатор")
@@ -24,16 +148,30 @@ class Catalog(models.Model):
         verbose_name="дата начала действия справочника этой версии"
     )
 
+    # время последнего изменения справочника или его состава элементов,
+    # при изменении элементов обновляется обработчиками сигналов в api/signals.py
+    modified = models.DateTimeField(auto_now=True, verbose_name="дата изменения")
+
+    # хеш содержимого версии (api/digest.py), обновляется при изменении состава элементов
+    digest = models.CharField(max_length=64, default=EMPTY_DIGEST, editable=False, verbose_name="хеш содержимого")
+
+    # количество элементов версии, обновляется вместе с хешем содержимого
+    item_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="количество элементов")
+
+    derived_fields = ('modified', 'digest', 'item_count')
+
     def __str__(self):
         return f'{self.identifier} - {self.short_name}'
 
     @classmethod
-    def get_by_version(cls, identifier: str, version: Optional[str] = None):
+    def get_by_version(cls, identifier: str, version: Optional[str] = None, on_date: Optional[date] = None):
         """
         Метод для поиска указанной версии справочника.
-        Если версия не указана или None, то возвращается текущая версия.
+        Если версия не указана или None, то возвращается текущая версия,
+        либо версия, актуальная на дату on_date, если она указана.
         :param identifier: идентификатор справочника
         :param version: версия
+        :param on_date: дата, на которую ищется актуальная версия
         :return: Объект Catalog
         """
         try:
@@ -41,37 +179,138 @@ class Catalog(models.Model):
             # больше сегодняшней (не знаю возможно ли такое, сделал на всякий случай),
             # затем из этого берется самая поздняя дата
             if version is None:
-                return cls.objects.filter(identifier=identifier, date__lte=date.today()).latest('date')
+                # текущая версия берется из таблицы указателей CurrentCatalog одним запросом по ключу
+                if on_date is None or on_date == date.today():
+                    return CurrentCatalog.get_current(identifier)
+                return cls.objects.filter(identifier=identifier, date__lte=on_date).latest('date')
             else:
                 return cls.objects.get(identifier=identifier, version=version)
         except cls.DoesNotExist:
             return None
 
-    def save(self, *args, **kwargs) -> None:
+    @classmethod
+    async def aget_by_version(cls, identifier: str, version: Optional[str] = None, on_date: Optional[date] = None):
         """
-        Перегрузка метода сохранения.
-        При создании нового справочника, если существует предыдущая версия,
-        то она находится методом get_by_version и все элементы справочника копируются в только что созданный.
-        Если предыдущей версии нет, то ищутся элементы справочника с
-        родительским идентификатором, соответствующим данному справочнику.
-        При сохранении из админки, изменения полей ManyToMany, произведенные в методах, аннулируются,
-        так что приходится перегрузить еще один метод в файле admin.py
-        """
-        # если объект еще не сохранен в бд (то есть происходит создание)
-        if not self.id:
-            # текущий справочник, либо None
-            latest = self.get_by_version(self.identifier)
-            # сначала нужно сохранить
-            super().save(*args, **kwargs)
-            # добавляем элементы, у которых соответствует родительский
-            # идентификатор, если нет предыдущей версии справочника
-            if latest is None:
-                self.items.add(*CatalogItem.objects.filter(parent_identifier=self.identifier))
-            # добавляем элементы из предыдушей версии справочника
+        Асинхронный вариант метода get_by_version
+        """
+        try:
+            if version is None:
+                if on_date is None or on_date == date.today():
+                    return await CurrentCatalog.aget_current(identifier)
+                return await cls.objects.filter(identifier=identifier, date__lte=on_date).alatest('date')
             else:
-                self.items.add(*latest.items.all())
-        else:
-            super().save(*args, **kwargs)
+                return await cls.objects.aget(identifier=identifier, version=version)
+        except cls.DoesNotExist:
+            return None
+
+    def link_items(self, item_ids: models.QuerySet) -> int:
+        """
+        Метод для добавления элементов в справочник без загрузки их в память при хранении составов в ManyToMany.
+        Записи в промежуточную таблицу ManyToMany вставляются запросом INSERT ... SELECT.
+        Сигнал m2m_changed при этом не отправляется.
+        :param item_ids: queryset с единственным полем item_id - идентификаторами элементов
+        :return: количество добавленных элементов
+        """
+        return insert_from_select(Catalog.items.through, {'catalog': self.id}, item_ids, 'catalogitem',
+                                  using=self._state.db)
+
+    def get_items(self) -> models.QuerySet:
+        """
+        Элементы этой версии справочника при любом способе хранения составов
+        """
+        return CatalogItem.objects.filter(CatalogItem.in_catalog(self))
+
+    def add_items(self, item_ids: Iterable[int]) -> None:
+        """
+        Добавление элементов в эту версию справочника при любом способе хранения составов.
+        Как и при items.add, отправляется сигнал m2m_changed.
+        :param item_ids: идентификаторы элементов
+        """
+        if not interval_storage():
+            self.items.add(*item_ids)
+            return
+        pk_set = CatalogItemLink.add(self, item_ids)
+        if pk_set:
+            m2m_changed.send(sender=Catalog.items.through, instance=self, action='post_add', reverse=False,
+                             model=CatalogItem, pk_set=pk_set, using=self._state.db)
+
+    def remove_items(self, item_ids: Iterable[int]) -> None:
+        """
+        Удаление элементов из этой версии справочника при любом способе хранения составов.
+        Как и при items.remove, отправляется сигнал m2m_changed.
+        :param item_ids: идентификаторы элементов
+        """
+        if not interval_storage():
+            self.items.remove(*item_ids)
+            return
+        pk_set = CatalogItemLink.remove(self, item_ids)
+        if pk_set:
+            m2m_changed.send(sender=Catalog.items.through, instance=self, action='post_remove', reverse=False,
+                             model=CatalogItem, pk_set=pk_set, using=self._state.db)
+
+    @classmethod
+    def memberships(cls, item_ids: Iterable[int]) -> dict:
+        """
+        Версии справочников, в которые входят элементы, при любом способе хранения составов
+        :param item_ids: идентификаторы элементов
+        :return: словарь id версии справочника -> множество идентификаторов ее элементов из item_ids
+        """
+        result = {}
+        item_ids = list(item_ids)
+        for start in range(0, len(item_ids), 1000):
+            chunk = item_ids[start:start + 1000]
+            if not interval_storage():
+                rows = cls.items.through.objects.filter(catalogitem_id__in=chunk).values_list('catalog_id',
+                                                                                             'catalogitem_id')
+                for catalog_id, item_id in rows:
+                    result.setdefault(catalog_id, set()).add(item_id)
+                continue
+            links = list(CatalogItemLink.objects.filter(item_id__in=chunk).values_list(
+                'identifier', 'valid_from', 'valid_to', 'item_id'))
+            versions = {}
+            for catalog_id, identifier in cls.objects.filter(
+                    identifier__in={link[0] for link in links}).values_list('id', 'identifier'):
+                versions.setdefault(identifier, []).append(catalog_id)
+            for identifier, valid_from, valid_to, item_id in links:
+                for catalog_id in versions.get(identifier, ()):
+                    if valid_from <= catalog_id and (valid_to is None or catalog_id < valid_to):
+                        result.setdefault(catalog_id, set()).add(item_id)
+        return result
+
+    @classmethod
+    def containing(cls, item: 'CatalogItem') -> models.QuerySet:
+        """
+        Версии справочников, в которые входит элемент, при любом способе хранения составов
+        """
+        if not interval_storage():
+            return cls.objects.filter(items=item)
+        condition = Q(pk__in=[])
+        for identifier, valid_from, valid_to in item.links.values_list('identifier', 'valid_from', 'valid_to'):
+            link = Q(identifier=identifier, id__gte=valid_from)
+            if valid_to is not None:
+                link &= Q(id__lt=valid_to)
+            condition |= link
+        return cls.objects.filter(condition)
+
+    def clone(self, version: str, on_date: Optional[date] = None) -> 'Catalog':
+        """
+        Метод для создания новой версии справочника на основе этой версии.
+        :param version: новая версия
+        :param on_date: дата начала действия новой версии, по умолчанию сегодня
+        :return: созданный объект Catalog
+        """
+        catalog = Catalog(
+            identifier=self.identifier,
+            name=self.name,
+            short_name=self.short_name,
+            description=self.description,
+            version=version,
+            date=on_date or date.today(),
+        )
+        # версия, из которой копируются элементы, см. api/signals.py
+        catalog._source = self
+        catalog.save()
+        return catalog
 
     class Meta:
         verbose_name = "Справочник"
@@ -83,9 +322,98 @@ class Catalog(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['identifier', 'version'], name='unique_version'),
         ]
+        indexes = [
+            # поиск текущей или актуальной на дату версии справочника: identifier = X AND date <= D ORDER BY date DESC
+            models.Index(fields=['identifier', '-date'], name='catalog_identifier_date_idx'),
+            # список справочников с сортировкой по умолчанию и выводом по курсору
+            models.Index(fields=['-date', 'id'], name='catalog_date_id_idx'),
+        ]
+
 
+class CurrentCatalog(models.Model):
+    """
+    Указатель на текущую версию справочника, чтобы не искать ее по всем версиям при каждом обращении.
+    Указатель действует до даты начала действия следующей версии (valid_until),
+    после этой даты он считается устаревшим и пересчитывается при первом обращении
+    либо командой refresh_current_catalogs, которую нужно запускать по расписанию раз в сутки.
+    Обновляется обработчиками сигналов в api/signals.py при создании, изменении и удалении справочников.
+    """
+    identifier = models.CharField(max_length=50, primary_key=True, verbose_name="идентификатор")
+    # None, если у справочника есть только будущие версии
+    catalog = models.ForeignKey(Catalog, null=True, on_delete=models.SET_NULL, related_name='+',
+                                verbose_name="текущая версия")
+    # дата начала действия ближайшей будущей версии, None если будущих версий нет
+    valid_until = models.DateField(null=True, verbose_name="действует до")
 
-class CatalogItem(models.Model):
+    def is_valid(self, on_date: Optional[date] = None) -> bool:
+        return self.valid_until is None or (on_date or date.today()) < self.valid_until
+
+    @classmethod
+    def get_current(cls, identifier: str) -> Optional[Catalog]:
+        """
+        Метод для получения текущей версии справочника по указателю.
+        Если указателя нет или он устарел, он пересчитывается.
+        :param identifier: идентификатор справочника
+        :return: Объект Catalog либо None
+        """
+        pointer = cls.objects.select_related('catalog').filter(identifier=identifier).first()
+        if pointer is None or not pointer.is_valid():
+            pointer = cls.refresh(identifier)
+        return pointer.catalog if pointer is not None else None
+
+    @classmethod
+    async def aget_current(cls, identifier: str) -> Optional[Catalog]:
+        """
+        Асинхронный вариант метода get_current
+        """
+        pointer = await cls.objects.select_related('catalog').filter(identifier=identifier).afirst()
+        if pointer is None or not pointer.is_valid():
+            pointer = await sync_to_async(cls.refresh)(identifier)
+        return pointer.catalog if pointer is not None else None
+
+    @classmethod
+    def refresh(cls, identifier: str) -> Optional['CurrentCatalog']:
+        """
+        Пересчет указателя на текущую версию справочника по таблице справочников.
+        :param identifier: идентификатор справочника
+        :return: объект CurrentCatalog либо None, если версий справочника нет
+        """
+        today = date.today()
+        versions = Catalog.objects.filter(identifier=identifier)
+        with transaction.atomic():
+            try:
+                catalog = versions.filter(date__lte=today).latest('date')
+            except Catalog.DoesNotExist:
+                catalog = None
+            valid_until = versions.filter(date__gt=today).order_by('date').values_list('date', flat=True).first()
+            if catalog is None and valid_until is None:
+                cls.objects.filter(identifier=identifier).delete()
+                return None
+            pointer, _ = cls.objects.update_or_create(
+                identifier=identifier,
+                defaults={'catalog': catalog, 'valid_until': valid_until},
+            )
+        return pointer
+
+    @classmethod
+    def refresh_stale(cls, on_date: Optional[date] = None) -> int:
+        """
+        Пересчет указателей, срок действия которых истек, то есть справочников, у которых
+        к дате on_date (по умолчанию сегодня) вступила в силу следующая версия.
+        :return: количество пересчитанных указателей
+        """
+        identifiers = cls.objects.filter(valid_until__lte=on_date or date.today()).values_list('identifier', flat=True)
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            cls.refresh(identifier)
+        return len(identifiers)
+
+    class Meta:
+        verbose_name = "Текущая версия справочника"
+        verbose_name_plural = "Текущие версии справочников"
+
+
+class CatalogItem(MaintainedModel):
     id = models.AutoField(primary_key=True, verbose_name="идентификатор")
 
     identifier = models.CharField(max_length=50, verbose_name="идентификатор")
@@ -97,27 +425,206 @@ class CatalogItem(models.Model):
     def __str__(self):
         return f'{self.identifier} - {self.parent_identifier}'
 
-    def save(self, *args, **kwargs) -> None:
+    @staticmethod
+    def in_catalog(catalog) -> Q:
         """
-        Перегрузка метода сохранения для того,
-        чтобы созданные элементы соединялись с текущим справочником.
-        """
-        # если объект еще не сохранен в бд (то есть происходит создание)
-        if not self.id:
-            # находим текущий справочник либо None
-            latest_catalog = Catalog.get_by_version(identifier=self.parent_identifier)
-            super().save(*args, kwargs)
-            # добавляем к справочнику
-            if latest_catalog is not None:
-                latest_catalog.items.add(self)
-        else:
-            super().save(*args, kwargs)
+        Условие для отбора элементов версии справочника при любом способе хранения составов.
+        Условие нужно передавать в filter одним вызовом, чтобы все его части относились к одному интервалу.
+        :param catalog: объект Catalog или CatalogSnapshot
+        """
+        if not interval_storage():
+            return Q(catalog=catalog.id)
+        return (
+            Q(links__identifier=catalog.identifier, links__valid_from__lte=catalog.id)
+            & (Q(links__valid_to__isnull=True) | Q(links__valid_to__gt=catalog.id))
+        )
+
+    @classmethod
+    def bulk_create_linked(cls, items: Iterable['CatalogItem'], batch_size: int = 1000) -> int:
+        """
+        Массовое создание элементов справочников из генератора, аналог save для большого количества объектов.
+        Элементы вставляются пачками через bulk_create в одной транзакции, в справочники они добавляются
+        обработчиком сигнала post_bulk_create (api/signals.py). Пачки передают обработчику общий context,
+        так что текущая версия каждого справочника ищется один раз на всю загрузку.
+        :param items: несохраненные объекты CatalogItem, может быть генератором
+        :param batch_size: размер пачки
+        :return: количество созданных элементов
+        """
+        items = iter(items)
+        created = 0
+        context = {}
+        with transaction.atomic():
+            for batch in iter(lambda: list(islice(items, batch_size)), []):
+                cls.objects.bulk_create(batch, batch_size=batch_size, context=context)
+                created += len(batch)
+        return created
 
     class Meta:
         verbose_name = "Элемент справочника"
         verbose_name_plural = "Элементы справочников"
+        indexes = [
+            # поиск по родительскому идентификатору и список элементов с сортировкой по умолчанию,
+            # на Postgres индекс покрывающий, так что список может читаться только из индекса
+            models.Index(
+                fields=['parent_identifier', 'id'],
+                include=['identifier', 'code', 'value'],
+                name='item_parent_id_idx',
+            ),
+        ]
+
+
+# связь ManyToMany в обе стороны проверяет способ хранения составов
+Catalog.items = StorageCheckedDescriptor(Catalog.items.rel, reverse=False)
+CatalogItem.catalog_set = StorageCheckedDescriptor(Catalog.items.rel, reverse=True)
 
 
+class CatalogItemLink(models.Model):
+    """
+    Интервал версий справочника, в которые входит элемент, для хранения составов версий
+    без копирования (настройка CATALOG_STORAGE = 'intervals').
+    Версии упорядочены по id, то есть по порядку создания. Элемент входит в версию справочника
+    identifier с id, если valid_from <= id < valid_to (valid_to = None - во все последующие версии).
+    Интервалы одного элемента в одном справочнике не пересекаются.
+    Новая версия, созданная из последней созданной версии, получает ее состав без изменения интервалов,
+    так что размер хранилища и время создания версии зависят от количества изменений, а не от размера справочника.
+    """
+    identifier = models.CharField(max_length=50, verbose_name="идентификатор справочника")
+    item = models.ForeignKey(CatalogItem, on_delete=models.CASCADE, related_name='links',
+                             verbose_name="элемент справочника")
+    # id версий справочника, а не внешние ключи, так как границы остаются и после удаления версий
+    valid_from = models.IntegerField(verbose_name="первая версия")
+    valid_to = models.IntegerField(null=True, verbose_name="версия, в которую элемент уже не входит")
 
+    @staticmethod
+    def covering(catalog) -> Q:
+        """
+        Условие для отбора интервалов, содержащих версию справочника
+        """
+        return (
+            Q(identifier=catalog.identifier, valid_from__lte=catalog.id)
+            & (Q(valid_to__isnull=True) | Q(valid_to__gt=catalog.id))
+        )
+
+    @staticmethod
+    def next_version_id(catalog: Catalog) -> Optional[int]:
+        """
+        id следующей созданной версии того же справочника, либо None
+        """
+        return Catalog.objects.filter(identifier=catalog.identifier, id__gt=catalog.id).aggregate(
+            next_id=models.Min('id'))['next_id']
+
+    @classmethod
+    def for_new_item(cls, catalog: Catalog, item_id: int, next_id: Optional[int] = None) -> 'CatalogItemLink':
+        """
+        Интервал для нового элемента, добавленного в версию справочника
+        """
+        if next_id is None:
+            next_id = cls.next_version_id(catalog)
+        return cls(identifier=catalog.identifier, item_id=item_id, valid_from=catalog.id, valid_to=next_id)
+
+    @classmethod
+    def start_version(cls, catalog: Catalog, source: Optional[Catalog]) -> None:
+        """
+        Заполнение состава только что созданной версии справочника составом версии source,
+        либо элементами с соответствующим родительским идентификатором, если source нет.
+        Открытые интервалы (valid_to = None) задают состав последней созданной версии,
+        поэтому, если source и есть последняя созданная версия, ничего записывать не нужно.
+        Иначе открытые интервалы элементов, которых нет в source, закрываются на новой версии,
+        а для недостающих элементов открываются новые интервалы.
+        """
+        last_id = Catalog.objects.filter(identifier=catalog.identifier).exclude(pk=catalog.pk).aggregate(
+            last_id=models.Max('id'))['last_id']
+        if source is not None and source.id == last_id:
+            return
+        if source is not None:
+            target = cls.objects.filter(cls.covering(source)).values('item_id')
+        else:
+            target = CatalogItem.objects.filter(parent_identifier=catalog.identifier).values(item_id=models.F('id'))
+        opened = cls.objects.filter(identifier=catalog.identifier, valid_to__isnull=True)
+        opened.exclude(item_id__in=target).update(valid_to=catalog.id)
+        insert_from_select(
+            cls, {'identifier': catalog.identifier, 'valid_from': catalog.id, 'valid_to': None},
+            target.exclude(item_id__in=opened.values('item_id')), 'item', using=catalog._state.db,
+        )
+
+    @classmethod
+    def add(cls, catalog: Catalog, item_ids: Iterable[int]) -> set:
+        """
+        Добавление элементов в версию справочника. Элемент добавляется только в эту версию.
+        :return: идентификаторы элементов, которых раньше не было в версии
+        """
+        item_ids = set(item_ids)
+        existing = cls.objects.filter(cls.covering(catalog), item_id__in=item_ids).values_list('item_id', flat=True)
+        added = item_ids - set(existing)
+        next_id = cls.next_version_id(catalog)
+        cls.objects.bulk_create([cls.for_new_item(catalog, item_id, next_id) for item_id in added])
+        return added
+
+    @classmethod
+    def remove(cls, catalog: Catalog, item_ids: Iterable[int]) -> set:
+        """
+        Удаление элементов из версии справочника. Интервал, содержащий версию,
+        делится на части до и после нее, остальные версии не затрагиваются.
+        :return: идентификаторы элементов, которые были в версии
+        """
+        next_id = cls.next_version_id(catalog)
+        removed = set()
+        with transaction.atomic():
+            for link in cls.objects.filter(cls.covering(catalog), item_id__in=set(item_ids)).select_for_update():
+                removed.add(link.item_id)
+                # продолжается ли интервал после этой версии
+                after = next_id is not None and (link.valid_to is None or link.valid_to > next_id)
+                if link.valid_from < catalog.id:
+                    if after:
+                        cls.objects.create(identifier=link.identifier, item_id=link.item_id,
+                                           valid_from=next_id, valid_to=link.valid_to)
+                    link.valid_to = catalog.id
+                    link.save(update_fields=['valid_to'])
+                elif after:
+                    link.valid_from = next_id
+                    link.save(update_fields=['valid_from'])
+                else:
+                    link.delete()
+        return removed
+
+    @classmethod
+    def forget_version(cls, identifier: str, version_id: int) -> None:
+        """
+        Исключение удаленной или переименованной версии из интервалов справочника:
+        границы интервалов, совпадающие с ней, переносятся на следующую версию,
+        так что состав остальных версий не меняется, а границы остаются id существующих версий.
+        """
+        next_id = Catalog.objects.filter(identifier=identifier, id__gt=version_id).aggregate(
+            next_id=models.Min('id'))['next_id']
+        links = cls.objects.filter(identifier=identifier)
+        starting = links.filter(valid_from=version_id)
+        if next_id is None:
+            starting.delete()
+        else:
+            # интервал, состоявший только из этой версии, больше не нужен
+            starting.filter(valid_to__lte=next_id).delete()
+            starting.update(valid_from=next_id)
+        links.filter(valid_to=version_id).update(valid_to=next_id)
 
+    @classmethod
+    def move_version(cls, catalog: Catalog, old_identifier: str) -> None:
+        """
+        Перенос состава версии справочника в интервалы нового идентификатора при его изменении
+        """
+        old_catalog = Catalog(id=catalog.id, identifier=old_identifier)
+        item_ids = set(cls.objects.filter(cls.covering(old_catalog)).values_list('item_id', flat=True))
+        cls.forget_version(old_identifier, catalog.id)
+        # интервалы нового справочника, проходящие через эту версию, разрываются для элементов, которых в ней нет
+        covered = cls.objects.filter(cls.covering(catalog)).exclude(item_id__in=item_ids)
+        cls.remove(catalog, covered.values_list('item_id', flat=True))
+        cls.add(catalog, item_ids)
 
+    class Meta:
+        verbose_name = "Интервал версий элемента справочника"
+        verbose_name_plural = "Интервалы версий элементов справочников"
+        indexes = [
+            # элементы версии справочника: identifier = X AND valid_from <= id AND (valid_to IS NULL OR valid_to > id)
+            models.Index(fields=['identifier', 'valid_from'], name='link_identifier_from_idx'),
+            # открытые интервалы последней версии при создании новой версии
+            models.Index(fields=['identifier', 'valid_to'], name='link_identifier_to_idx'),
+        ]
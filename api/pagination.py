@@ -0,0 +1,180 @@
+import base64
+import json
+from functools import partial
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """
+    Постраничный вывод по номеру страницы с возможностью выбора размера страницы параметром page_size
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Постраничный вывод по ключу (keyset pagination).
+    Вместо номера страницы в ссылках next и previous передается курсор - значения полей сортировки
+    последнего (или первого) объекта страницы, а следующая страница выбирается условием
+    "после этих значений" без OFFSET и без подсчета общего количества объектов.
+    Поэтому любая страница выбирается так же быстро, как и первая.
+    Сортировка берется из queryset (то есть из OrderingFilter представления)
+    и для однозначности дополняется полем id.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+    tiebreaker = 'id'
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> Optional[list]:
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        values, self.reverse = self.decode_cursor(request)
+
+        # для предыдущей страницы выбираем объекты в обратном порядке, а затем разворачиваем
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        # выбираем на один объект больше, чтобы узнать, есть ли еще страница
+        try:
+            if values is not None:
+                queryset = queryset.filter(self.build_condition(ordering, values))
+            results = list(queryset[:self.page_size + 1])
+        except (ValidationError, ValueError, TypeError):
+            # значения в курсоре не подходят к типам полей сортировки
+            raise NotFound('Invalid cursor')
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_previous, self.has_next = has_more, values is not None
+        else:
+            self.has_previous, self.has_next = values is not None, has_more
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return api_settings.PAGE_SIZE
+
+    def get_ordering(self, queryset: QuerySet, view) -> List[str]:
+        """
+        Сортировка, уже примененная к queryset, либо сортировка представления по умолчанию,
+        дополненная полем id для однозначности
+        """
+        ordering = list(queryset.query.order_by) or list(getattr(view, 'ordering', None) or [])
+        if not any(field.lstrip('-') in (self.tiebreaker, 'pk') for field in ordering):
+            ordering.append(self.tiebreaker)
+        return ordering
+
+    @staticmethod
+    def invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def build_condition(ordering: List[str], values: list) -> Q:
+        """
+        Условие "строго после указанных значений" для составного ключа сортировки:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ..., для полей с обратной сортировкой используется "<"
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, obj, reverse: bool) -> str:
+        # объекты могут быть как объектами моделей, так и словарями из queryset.values
+        get = obj.get if isinstance(obj, dict) else partial(getattr, obj)
+        values = [get(field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'v': values, 'r': reverse}, default=str, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request) -> Tuple[Optional[list], bool]:
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = payload['v'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return values, reverse
+
+
+class CatalogPagination(pagination.BasePagination):
+    """
+    Постраничный вывод для списков справочников и элементов.
+    По умолчанию используется вывод по номеру страницы (параметр page),
+    а с параметром pagination=cursor - вывод по ключу (KeysetPagination).
+    """
+    pagination_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.pagination_query_param) == 'cursor':
+            self.paginator = KeysetPagination()
+        else:
+            self.paginator = PageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return PageNumberPagination().get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
@@ -0,0 +1,150 @@
+"""
+Параллельная валидация больших запросов в пуле процессов.
+Объекты запроса делятся на части, которые проверяются в процессах пула, а результаты собираются
+в исходном порядке. Процессы пула открывают тот же файл индекса валидации (api/index_file.py),
+что и основной процесс, так что индекс находится в общей памяти и не передается между процессами.
+Поэтому параллельная проверка используется, только если индексы хранятся в файлах (VALIDATION_INDEX_DIR).
+Части передаются в процессы пула в виде JSON (orjson), что быстрее pickle для списков словарей,
+а если orjson не установлен или часть не представима в JSON без искажений - через pickle.
+"""
+import asyncio
+import math
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import List, Optional, Sequence
+
+import django
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from api.index_file import MappedItemsIndex
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# индексы, открытые в процессе пула, по пути к файлу
+_worker_indexes = OrderedDict()
+WORKER_MAX_INDEXES = 8
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Пул процессов, общий для всего процесса сервера, создается при первом использовании.
+    Процессы запускаются через spawn, так как fork многопоточного процесса сервера небезопасен.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.VALIDATION_PARALLEL['WORKERS'],
+                mp_context=get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _executor
+
+
+def reset_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def is_parallel(index, count: int) -> bool:
+    """
+    Нужно ли проверять count объектов по индексу index в пуле процессов
+    """
+    workers = settings.VALIDATION_PARALLEL['WORKERS']
+    return workers > 1 and count >= settings.VALIDATION_PARALLEL['THRESHOLD'] and isinstance(index, MappedItemsIndex)
+
+
+def split(items: Sequence) -> List[bytes]:
+    """
+    Деление объектов на части, по несколько на каждый процесс пула, чтобы выровнять нагрузку
+    """
+    parts = settings.VALIDATION_PARALLEL['WORKERS'] * 4
+    size = max(math.ceil(len(items) / parts), 1000)
+    chunks = []
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        if orjson is not None:
+            try:
+                data = orjson.dumps(chunk)
+            except TypeError:
+                # orjson не поддерживает целые числа больше 64 бит
+                data = None
+            # orjson записывает NaN и бесконечности (например, 1e400 из тела запроса) как null,
+            # поэтому при наличии null часть передается через pickle, чтобы не проверять искаженные данные
+            if data is not None and b'null' not in data:
+                chunks.append(data)
+                continue
+        chunks.append(pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL))
+    return chunks
+
+
+def validate_chunk(path: str, chunk: bytes) -> bytes:
+    """
+    Проверка части объектов в процессе пула
+    :param path: путь к файлу индекса
+    :param chunk: объекты в формате JSON или pickle
+    :return: результаты в виде байтов 0 и 1
+    """
+    index = _worker_indexes.get(path)
+    if index is None:
+        index = _worker_indexes[path] = MappedItemsIndex(path)
+        if len(_worker_indexes) > WORKER_MAX_INDEXES:
+            _worker_indexes.popitem(last=False)[1].close()
+    else:
+        _worker_indexes.move_to_end(path)
+    items = pickle.loads(chunk) if chunk[:1] == b'\x80' else orjson.loads(chunk)
+    return bytes(index.validate(items))
+
+
+def validate_items(index, items: Sequence) -> List[bool]:
+    """
+    Валидация объектов по индексу, для больших запросов - в пуле процессов
+    :param index: индекс версии справочника
+    :param items: объекты, поданные на валидацию
+    :return: список булевых значений на местах, соответствующих объектам
+    """
+    if not is_parallel(index, len(items)):
+        return index.validate(items)
+    try:
+        executor = get_executor()
+        futures = [executor.submit(validate_chunk, index.path, chunk) for chunk in split(items)]
+        results = []
+        for future in futures:
+            results.extend(map(bool, future.result()))
+        return results
+    except BrokenProcessPool:
+        # процесс пула завершился аварийно, пул пересоздается при следующем запросе
+        reset_executor()
+        return index.validate(items)
+
+
+async def avalidate_items(index, items: Sequence) -> List[bool]:
+    """
+    Асинхронный вариант функции validate_items, цикл событий не блокируется на время проверки в пуле
+    """
+    if not is_parallel(index, len(items)):
+        return index.validate(items)
+    try:
+        executor = get_executor()
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, split, items)
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(executor, validate_chunk, index.path, chunk) for chunk in chunks
+        ))
+        return [bool(result) for part in parts for result in part]
+    except BrokenProcessPool:
+        reset_executor()
+        return index.validate(items)
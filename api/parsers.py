@@ -0,0 +1,26 @@
+from rest_framework.parsers import BaseParser
+from rest_framework.utils import json
+
+
+class NDJSONParser(BaseParser):
+    """
+    Парсер тела запроса в формате NDJSON (один JSON объект на строку).
+    Тело запроса не читается целиком: возвращается итератор, который разбирает строки
+    по мере чтения, поэтому расход памяти не зависит от размера запроса.
+    Пустые строки пропускаются, вместо строк с некорректным JSON возвращается None.
+    Как и в JSONParser из DRF, константы NaN и Infinity считаются некорректным JSON.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return self.iter_objects(stream)
+
+    @staticmethod
+    def iter_objects(stream):
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
@@ -0,0 +1,39 @@
+from rest_framework.renderers import JSONRenderer
+
+from api.metrics import profile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON рендерер, использующий orjson, если он установлен, для представлений с атрибутом fast_json = True.
+    Вывод совпадает побайтово с JSONRenderer для данных из строк, целых чисел, булевых значений и дат,
+    поэтому быстрый путь включается только для представлений, которые отдают данные из базы.
+    Для остальных представлений, при запросе с отступами и без orjson используется обычный JSONRenderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # время рендеринга учитывается в метриках запроса как время сериализации
+        with profile('serialization'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        view = renderer_context.get('view')
+        if (orjson is None or data is None or not getattr(view, 'fast_json', False)
+                or self.get_indent(accepted_media_type, renderer_context) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                # даты и остальные типы приводятся так же, как в JSONRenderer
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # как и JSONRenderer, экранируем \u2028 и \u2029
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from operator import attrgetter
+
 from rest_framework import serializers
 
 from api.models import Catalog, CatalogItem
@@ -6,10 +9,55 @@ from api.models import Catalog, CatalogItem
 class CatalogSerializer(serializers.ModelSerializer):
     class Meta:
         model = Catalog
-        exclude = ['items']
+        exclude = ['items', 'modified', 'digest', 'item_count']
 
 
 class CatalogItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CatalogItem
         fields = '__all__'
+
+
+class FastReadSerializer:
+    """
+    Быстрый сериализатор только для чтения, повторяющий вывод ModelSerializer из model_serializer.
+    Список полей вычисляется один раз, а объекты обрабатываются без механизма полей DRF:
+    словари из queryset.values(...) отдаются как есть, у объектов моделей поля берутся через attrgetter.
+    Даты остаются объектами date и приводятся к ISO формату рендерером, как и в ModelSerializer.
+    Подходит только для моделей с простыми полями (строки, числа, даты), как у справочников.
+    """
+    model_serializer = None
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = kwargs.get('context', {})
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def get_fields(cls) -> tuple:
+        """
+        Поля в том же порядке, что и в выводе model_serializer
+        """
+        return tuple(cls.model_serializer().fields)
+
+    @classmethod
+    def to_representation(cls, obj) -> dict:
+        if isinstance(obj, dict):
+            return obj
+        fields = cls.get_fields()
+        return dict(zip(fields, attrgetter(*fields)(obj)))
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(obj) for obj in self.instance]
+        return self.to_representation(self.instance)
+
+
+class CatalogFastSerializer(FastReadSerializer):
+    model_serializer = CatalogSerializer
+
+
+class CatalogItemFastSerializer(FastReadSerializer):
+    model_serializer = CatalogItemSerializer
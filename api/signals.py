@@ -0,0 +1,367 @@
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import catalog_cache
+from api.digest import DIGEST_FIELDS, EMPTY_DIGEST, combine, item_hash, items_hash, to_hex
+from api.models import (
+    Catalog, CatalogItem, CatalogItemLink, CurrentCatalog, interval_storage,
+    pre_bulk_create, post_bulk_create, pre_update, post_update,
+)
+
+
+def invalidate(identifier: Optional[str] = None) -> None:
+    """
+    Сброс кеша справочников сразу и повторно после фиксации транзакции,
+    чтобы в кеш не попали данные, прочитанные другими запросами до ее фиксации
+    """
+    catalog_cache.invalidate(identifier)
+    transaction.on_commit(lambda: catalog_cache.invalidate(identifier))
+
+
+def touch(catalogs: QuerySet) -> None:
+    """
+    Обновление времени изменения справочников, состав элементов которых изменился
+    """
+    catalogs.update(modified=timezone.now())
+
+
+def update_contents(catalogs: QuerySet, added: int = 0, removed: int = 0, count: int = 0) -> None:
+    """
+    Изменение хешей содержимого справочников на сумму хешей добавленных и удаленных элементов
+    и количества элементов на count
+    """
+    with transaction.atomic():
+        for catalog_id, digest in catalogs.select_for_update().values_list('id', 'digest'):
+            Catalog.objects.filter(pk=catalog_id).update(digest=combine(digest, added, removed),
+                                                         item_count=F('item_count') + count)
+
+
+def prepare_catalog(catalog: Catalog) -> None:
+    """
+    Выбор версии, из которой новая версия справочника получит элементы: переданной в clone,
+    либо текущей. Хеш содержимого и количество элементов берутся из нее, а если версий справочника нет,
+    то вычисляются по элементам с родительским идентификатором, соответствующим справочнику.
+    Вызывается до сохранения, пока текущей версией остается предыдущая.
+    """
+    source = getattr(catalog, '_source', None) or Catalog.get_by_version(catalog.identifier)
+    catalog._source = source
+    if source is None:
+        items = CatalogItem.objects.filter(parent_identifier=catalog.identifier)
+        catalog.digest, catalog.item_count = to_hex(items_hash(items)), items.count()
+    else:
+        catalog.digest, catalog.item_count = Catalog.objects.filter(pk=source.pk).values_list(
+            'digest', 'item_count').get()
+
+
+def fill_catalog(catalog: Catalog) -> None:
+    """
+    Заполнение только что созданной версии справочника элементами версии, выбранной в prepare_catalog.
+    Копирование выполняется одним запросом INSERT ... SELECT на стороне базы,
+    так что объем памяти не зависит от размера справочника.
+    При хранении составов интервалами (CATALOG_STORAGE = 'intervals') элементы не копируются,
+    а записываются только отличия от последней созданной версии, см. CatalogItemLink.
+    """
+    source = catalog.__dict__.pop('_source', None)
+    if interval_storage():
+        CatalogItemLink.start_version(catalog, source)
+    elif source is None:
+        catalog.link_items(CatalogItem.objects.filter(parent_identifier=catalog.identifier).values(item_id=F('id')))
+    else:
+        catalog.link_items(Catalog.items.through.objects.filter(catalog_id=source.id)
+                           .values(item_id=F('catalogitem_id')))
+
+
+def link_new_items(items: Iterable[CatalogItem], catalogs: Optional[dict] = None) -> None:
+    """
+    Добавление новых элементов в текущие версии справочников по родительскому идентификатору.
+    Текущая версия ищется один раз для каждого родительского идентификатора,
+    для каждой версии отправляется один сигнал m2m_changed.
+    :param catalogs: найденные текущие версии по родительским идентификаторам, которые дополняются
+    и используются повторно при следующих вызовах, например для следующих пачек той же загрузки
+    """
+    catalogs = {} if catalogs is None else catalogs
+    links = {}
+    for item in items:
+        if item.parent_identifier not in catalogs:
+            catalogs[item.parent_identifier] = Catalog.get_by_version(item.parent_identifier)
+        catalog = catalogs[item.parent_identifier]
+        if catalog is not None:
+            links.setdefault(catalog, set()).add(item.pk)
+    through = Catalog.items.through
+    for catalog, pk_set in links.items():
+        if interval_storage():
+            next_id = CatalogItemLink.next_version_id(catalog)
+            CatalogItemLink.objects.bulk_create([CatalogItemLink.for_new_item(catalog, pk, next_id) for pk in pk_set])
+        else:
+            through.objects.bulk_create([through(catalog_id=catalog.id, catalogitem_id=pk) for pk in pk_set])
+        m2m_changed.send(sender=through, instance=catalog, action='post_add', reverse=False,
+                         model=CatalogItem, pk_set=pk_set, using=catalog._state.db)
+
+
+# обработчики, поддерживающие состав новых версий, указатели на текущие версии, время изменения,
+# хеш содержимого и количество элементов справочников, подключаются раньше обработчиков сброса кеша,
+# чтобы кеш сбрасывался уже после их обновления.
+# Производные данные изменяются на величину изменений, без пересчета по всем элементам справочников.
+# Массовые операции через QuerySet.bulk_create и QuerySet.update обрабатываются по сигналам MaintainedQuerySet.
+
+@receiver(pre_save, sender=Catalog)
+def prepare_new_catalog(sender, instance: Catalog, raw: bool = False, **kwargs):
+    # при загрузке фикстур состав и хеш берутся из самих фикстур
+    if instance._state.adding and not raw:
+        prepare_catalog(instance)
+
+
+@receiver(post_save, sender=Catalog)
+def fill_new_catalog(sender, instance: Catalog, created: bool, raw: bool = False, **kwargs):
+    if created and not raw:
+        fill_catalog(instance)
+
+
+@receiver(pre_bulk_create, sender=Catalog)
+def prepare_new_catalogs(sender, objs, **kwargs):
+    for catalog in objs:
+        prepare_catalog(catalog)
+
+
+@receiver(post_bulk_create, sender=Catalog)
+def fill_new_catalogs(sender, objs, **kwargs):
+    """
+    Заполнение созданных через bulk_create версий, пересчет указателей и сброс кеша их справочников
+    """
+    for catalog in objs:
+        fill_catalog(catalog)
+    for identifier in {catalog.identifier for catalog in objs}:
+        CurrentCatalog.refresh(identifier)
+        invalidate(identifier)
+
+
+@receiver(pre_update, sender=Catalog)
+def remember_updated_catalogs(sender, queryset: QuerySet, fields: set, context: dict, **kwargs):
+    """
+    Запоминаем идентификаторы изменяемых через QuerySet.update справочников
+    """
+    if fields & {'identifier', 'date'}:
+        context['identifiers'] = dict(queryset.values_list('id', 'identifier'))
+
+
+@receiver(post_update, sender=Catalog)
+def update_updated_catalogs(sender, fields: set, context: dict, **kwargs):
+    """
+    Перенос интервалов версий, пересчет указателей и сброс кеша после изменения справочников через QuerySet.update
+    """
+    old_identifiers = context.get('identifiers', {})
+    new_identifiers = dict(Catalog.objects.filter(pk__in=list(old_identifiers)).values_list('id', 'identifier'))
+    if interval_storage() and 'identifier' in fields:
+        for catalog_id, identifier in new_identifiers.items():
+            if identifier != old_identifiers[catalog_id]:
+                CatalogItemLink.move_version(Catalog(id=catalog_id, identifier=identifier), old_identifiers[catalog_id])
+    for identifier in set(old_identifiers.values()) | set(new_identifiers.values()):
+        CurrentCatalog.refresh(identifier)
+    invalidate()
+
+@receiver(pre_save, sender=Catalog)
+def remember_catalog_identifier(sender, instance: Catalog, **kwargs):
+    """
+    Запоминаем идентификатор справочника до изменения, чтобы пересчитать указатель и для него
+    """
+    if instance.pk is not None:
+        instance._old_identifier = Catalog.objects.filter(pk=instance.pk).values_list('identifier', flat=True).first()
+
+
+@receiver(post_save, sender=Catalog)
+def move_catalog_links(sender, instance: Catalog, created: bool, **kwargs):
+    """
+    Перенос состава версии в интервалы нового идентификатора справочника при его изменении
+    """
+    old_identifier = getattr(instance, '_old_identifier', None)
+    if interval_storage() and not created and old_identifier is not None and old_identifier != instance.identifier:
+        CatalogItemLink.move_version(instance, old_identifier)
+
+
+@receiver(post_delete, sender=Catalog)
+def forget_catalog_links(sender, instance: Catalog, **kwargs):
+    """
+    Исключение удаленной версии из интервалов справочника
+    """
+    if interval_storage():
+        CatalogItemLink.forget_version(instance.identifier, instance.id)
+
+
+@receiver(m2m_changed, sender=Catalog.items.through)
+def check_catalog_storage(sender, action: str, **kwargs):
+    """
+    При хранении составов интервалами таблица ManyToMany не используется,
+    изменять состав нужно методами Catalog.add_items и Catalog.remove_items
+    """
+    if interval_storage() and action in ('pre_add', 'pre_remove', 'pre_clear'):
+        raise RuntimeError('catalog items are stored as intervals, use Catalog.add_items and Catalog.remove_items')
+
+
+@receiver(post_save, sender=Catalog)
+@receiver(post_delete, sender=Catalog)
+def refresh_current_catalog(sender, instance: Catalog, **kwargs):
+    """
+    Пересчет указателя на текущую версию справочника при создании, изменении или удалении любой его версии
+    """
+    with transaction.atomic():
+        CurrentCatalog.refresh(instance.identifier)
+        old_identifier = getattr(instance, '_old_identifier', None)
+        if old_identifier is not None and old_identifier != instance.identifier:
+            CurrentCatalog.refresh(old_identifier)
+
+
+@receiver(pre_save, sender=CatalogItem)
+def remember_catalog_item_hash(sender, instance: CatalogItem, **kwargs):
+    """
+    Запоминаем хеш элемента до изменения, чтобы потом вычесть его из хешей справочников
+    """
+    if instance.pk is not None:
+        row = CatalogItem.objects.filter(pk=instance.pk).values_list(*DIGEST_FIELDS).first()
+        instance._old_hash = item_hash(row) if row is not None else None
+
+
+@receiver(post_save, sender=CatalogItem)
+def link_new_catalog_item(sender, instance: CatalogItem, created: bool, raw: bool = False, **kwargs):
+    """
+    Добавление созданного элемента в текущую версию справочника
+    """
+    if created and not raw:
+        link_new_items([instance])
+
+
+@receiver(post_bulk_create, sender=CatalogItem)
+def link_new_catalog_items(sender, objs, context: dict, **kwargs):
+    link_new_items(objs, context.setdefault('catalogs', {}))
+
+
+@receiver(pre_update, sender=CatalogItem)
+def remember_updated_catalog_items(sender, queryset: QuerySet, context: dict, **kwargs):
+    """
+    Запоминаем хеши изменяемых через QuerySet.update элементов
+    """
+    context['hashes'] = {row[0]: item_hash(row) for row in queryset.values_list(*DIGEST_FIELDS).iterator()}
+
+
+@receiver(post_update, sender=CatalogItem)
+def update_updated_catalog_items_catalogs(sender, context: dict, **kwargs):
+    """
+    Обновление справочников, содержащих элементы, измененные через QuerySet.update
+    """
+    old_hashes = context['hashes']
+    if not old_hashes:
+        return
+    new_hashes = {}
+    pks = list(old_hashes)
+    for start in range(0, len(pks), 1000):
+        rows = CatalogItem.objects.filter(pk__in=pks[start:start + 1000]).values_list(*DIGEST_FIELDS)
+        new_hashes.update((row[0], item_hash(row)) for row in rows)
+    for catalog_id, item_ids in Catalog.memberships(pks).items():
+        catalogs = Catalog.objects.filter(pk=catalog_id)
+        touch(catalogs)
+        update_contents(catalogs, added=sum(new_hashes[pk] for pk in item_ids),
+                        removed=sum(old_hashes[pk] for pk in item_ids))
+    invalidate()
+
+
+@receiver(post_save, sender=CatalogItem)
+def update_catalog_item_catalogs(sender, instance: CatalogItem, created: bool, **kwargs):
+    """
+    Обновление справочников, содержащих измененный элемент.
+    Новый элемент попадает в справочник через ManyToMany, что обрабатывается отдельно.
+    """
+    old_hash = getattr(instance, '_old_hash', None)
+    if created or old_hash is None:
+        return
+    catalogs = Catalog.containing(instance)
+    touch(catalogs)
+    update_contents(catalogs, added=item_hash(getattr(instance, field) for field in DIGEST_FIELDS), removed=old_hash)
+
+
+@receiver(pre_delete, sender=CatalogItem)
+def update_deleted_catalog_item_catalogs(sender, instance: CatalogItem, **kwargs):
+    """
+    Обновление справочников, содержащих удаляемый элемент.
+    Связи ManyToMany удаляются каскадно без сигнала m2m_changed, поэтому справочники находятся до удаления.
+    """
+    catalogs = Catalog.containing(instance)
+    touch(catalogs)
+    update_contents(catalogs, removed=items_hash(CatalogItem.objects.filter(pk=instance.pk)), count=-1)
+
+
+@receiver(m2m_changed, sender=Catalog.items.through)
+def update_catalog_items_catalogs(sender, instance, action: str, reverse: bool, pk_set=None, **kwargs):
+    """
+    Обновление времени изменения, хешей и количества элементов справочников при изменении состава их элементов
+    """
+    # при удалении pk_set содержит все переданные объекты, в том числе не связанные,
+    # поэтому до удаления запоминаем только действительно связанные
+    if action == 'pre_remove':
+        links = sender.objects.filter(**{
+            'catalogitem_id' if reverse else 'catalog_id': instance.pk,
+            'catalog_id__in' if reverse else 'catalogitem_id__in': pk_set,
+        })
+        instance._removed_pks = set(links.values_list('catalog_id' if reverse else 'catalogitem_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        if action == 'post_remove':
+            pk_set = instance.__dict__.pop('_removed_pks', pk_set)
+        if not reverse:
+            catalogs = Catalog.objects.filter(pk=instance.pk)
+            delta, count = items_hash(CatalogItem.objects.filter(pk__in=pk_set)), len(pk_set)
+        else:
+            catalogs = Catalog.objects.filter(pk__in=pk_set)
+            delta, count = items_hash(CatalogItem.objects.filter(pk=instance.pk)), 1
+        touch(catalogs)
+        if action == 'post_add':
+            update_contents(catalogs, added=delta, count=count)
+        else:
+            update_contents(catalogs, removed=delta, count=-count)
+    elif action == 'post_clear' and not reverse:
+        Catalog.objects.filter(pk=instance.pk).update(modified=timezone.now(), digest=EMPTY_DIGEST, item_count=0)
+    # при очистке со стороны элемента справочники нужно найти до удаления связей
+    elif action == 'pre_clear' and reverse:
+        catalogs = Catalog.containing(instance)
+        touch(catalogs)
+        update_contents(catalogs, removed=items_hash(CatalogItem.objects.filter(pk=instance.pk)), count=-1)
+
+
+@receiver(post_save, sender=Catalog)
+@receiver(post_delete, sender=Catalog)
+def invalidate_catalog(sender, instance: Catalog, **kwargs):
+    """
+    Сброс кеша справочников при создании, изменении или удалении справочника.
+    При изменении существующего справочника мог измениться идентификатор, поэтому кеш сбрасывается полностью.
+    """
+    if kwargs.get('created', False):
+        invalidate(instance.identifier)
+    else:
+        invalidate()
+
+
+@receiver(post_save, sender=CatalogItem)
+@receiver(post_delete, sender=CatalogItem)
+def invalidate_catalog_item(sender, instance: CatalogItem, **kwargs):
+    """
+    Сброс кеша при изменении или удалении элемента справочника.
+    Новый элемент попадает в справочник через ManyToMany, что обрабатывается отдельно.
+    """
+    if not kwargs.get('created', False):
+        invalidate()
+
+
+@receiver(m2m_changed, sender=Catalog.items.through)
+def invalidate_catalog_items(sender, instance, action: str, reverse: bool, **kwargs):
+    """
+    Сброс кеша при изменении состава элементов справочника
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # при изменении со стороны справочника известно, какой именно справочник изменился
+    if not reverse:
+        invalidate(instance.identifier)
+    else:
+        invalidate()
@@ -1,3 +1,1427 @@
-from django.test import TestCase
+import base64
+import bisect
+import csv
+import io
+import json
+import os
+import random
+import re
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api import parallel, views
+from api.cache import CatalogSnapshotCache, SharedCache, catalog_cache
+from api.digest import items_hash, to_hex
+from api.index_file import MappedItemsIndex, index_path
+from api.metrics import instrument_connection, record_query, registry as metrics_registry
+from api.models import Catalog, CatalogItem, CurrentCatalog, interval_storage
+from api.serializers import CatalogItemSerializer, CatalogSerializer
+from api.validation import KEY_FIELDS, CatalogItemsIndex, compile_item_key, serializer_item_key
+
+
+class CatalogTestCase(TestCase):
+    """
+    Базовый класс тестов. Кеш справочников общий для процесса и не откатывается вместе с транзакцией теста,
+    поэтому сбрасывается перед каждым тестом.
+    """
+    def setUp(self):
+        catalog_cache.clear()
+
+
+class EndpointQueryPlanTests(CatalogTestCase):
+    """
+    Проверка планов выполнения запросов эндпоинтов API через EXPLAIN:
+    ни один запрос не должен читать таблицу полным сканированием без индекса
+    """
+    # эндпоинты, запросы которых проверяются: метод, url и тело запроса
+    endpoints = [
+        ('get', '/api/catalogs/', None),
+        ('get', '/api/catalogs/?date={date}', None),
+        ('get', '/api/catalogs/?pagination=cursor', None),
+        ('get', '/api/catalogs/{catalog_id}/', None),
+        ('get', '/api/catalog-items/', None),
+        ('get', '/api/catalog-items/?pagination=cursor', None),
+        ('get', '/api/catalog-items/?catalog_identifier=explain-0', None),
+        ('get', '/api/catalog-items/?catalog_identifier=explain-0&catalog_version=1.0', None),
+        ('get', '/api/catalog-items/{item_id}/', None),
+        ('post', '/api/catalog-items/validation/?catalog_identifier=explain-0', []),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        # три справочника по две версии, по 50 элементов в каждом
+        for number in range(3):
+            identifier = f'explain-{number}'
+            Catalog(identifier=identifier, version='1.0', date=date(2020, 1, 1)).save()
+            CatalogItem.bulk_create_linked(
+                CatalogItem(identifier=str(item), parent_identifier=identifier, code=f'c{item}', value=f'v{item}')
+                for item in range(50)
+            )
+            Catalog(identifier=identifier, version='1.1', date=date(2020, 6, 1)).save()
+        self.context = {
+            'date': (date(2020, 6, 1) - timedelta(days=1)).isoformat(),
+            'catalog_id': Catalog.objects.values_list('id', flat=True).first(),
+            'item_id': CatalogItem.objects.values_list('id', flat=True).first(),
+        }
+        if connection.vendor == 'postgresql':
+            # на маленьких таблицах планировщик предпочитает последовательное чтение,
+            # поэтому отключаем его, чтобы увидеть, может ли запрос использовать индекс
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_endpoints_use_indexes(self):
+        for method, url, body in self.endpoints:
+            url = url.format(**self.context)
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'post':
+                    response = self.client.post(url, json.dumps(body), content_type='application/json')
+                else:
+                    response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            for query in queries.captured_queries:
+                if not query['sql'].lstrip().upper().startswith('SELECT'):
+                    continue
+                plan = self.explain(query['sql'])
+                with self.subTest(method=method, url=url, sql=query['sql']):
+                    self.assertEqual([line for line in plan if self.is_full_scan(line)], [], '\n'.join(plan))
+
+    @staticmethod
+    def explain(sql: str) -> list:
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            # в sqlite описание шага находится в последнем столбце, в postgres строка плана единственная
+            return [row[-1] for row in cursor.fetchall()]
+
+    @staticmethod
+    def is_full_scan(line: str) -> bool:
+        if connection.vendor == 'sqlite':
+            return line.startswith('SCAN ') and 'USING' not in line
+        return 'Seq Scan' in line
+
+
+class CompiledItemKeyTests(SimpleTestCase):
+    """
+    Быстрая проверка объектов (compile_item_key) должна принимать те же решения, что и сериализатор
+    """
+    valid = {'identifier': '1', 'parent_identifier': 'catalog', 'code': 'c', 'value': 'v'}
+    # граничные значения полей: типы, пробелы, длина, запрещенные символы
+    edge_values = [
+        0, -1, 2 ** 70, 1.5, -0.0, 1e20, float('nan'), float('inf'), True, False, None,
+        '', ' ', '\t\n', '  x  ', '\xa0x\u2003', 'x' * 50, 'x' * 51, ' ' + 'x' * 50 + ' ', 'x' * 200, 'x' * 201,
+        '\x00', 'a\x00b', '\ud800', 'a\udfffb', '\U0001f600', [], ['x'], {}, {'x': 'y'},
+    ]
+
+    def setUp(self):
+        self.compiled = compile_item_key()
+
+    def assertSameKey(self, item):
+        self.assertEqual(self.compiled(item), serializer_item_key(item), repr(item))
+
+    def test_compiled(self):
+        # если у сериализатора появятся правила, которые compile_item_key не повторяет, проверка станет медленной
+        self.assertIsNotNone(self.compiled)
+
+    def test_edge_values(self):
+        for field in KEY_FIELDS:
+            for value in self.edge_values:
+                with self.subTest(field=field, value=value):
+                    self.assertSameKey({**self.valid, field: value})
+
+    def test_missing_and_extra_keys(self):
+        self.assertSameKey(self.valid)
+        self.assertSameKey({})
+        self.assertSameKey({**self.valid, 'id': 'not a number', 'extra': None})
+        for field in KEY_FIELDS:
+            with self.subTest(field=field):
+                self.assertSameKey({key: value for key, value in self.valid.items() if key != field})
+
+    def test_random_combinations(self):
+        generator = random.Random(15)
+        values = self.edge_values + list(self.valid.values())
+        for _ in range(2000):
+            item = {field: generator.choice(values) for field in KEY_FIELDS if generator.random() > 0.05}
+            self.assertSameKey(item)
+
+
+class StorageModesTests(CatalogTestCase):
+    """
+    Одни и те же изменения при хранении составов в ManyToMany и интервалами (CATALOG_STORAGE)
+    должны давать одинаковые составы всех версий справочников
+    """
+    identifiers = ['A', 'B']
+
+    def run_in_storage(self, storage: str, operations) -> list:
+        """
+        Выполнение operations(record) при указанном способе хранения с откатом всех изменений.
+        record() запоминает составы всех версий, результатом является список запомненных состояний.
+        """
+        states = []
+
+        def record():
+            states.append([
+                (catalog.identifier, catalog.version, sorted(catalog.get_items().values_list('identifier', flat=True)))
+                for catalog in Catalog.objects.order_by('id')
+            ])
+
+        with override_settings(CATALOG_STORAGE=storage), transaction.atomic():
+            catalog_cache.clear()
+            operations(record)
+            transaction.set_rollback(True)
+        catalog_cache.clear()
+        return states
+
+    def assertSameInStorages(self, operations):
+        self.assertEqual(self.run_in_storage('m2m', operations), self.run_in_storage('intervals', operations))
+
+    @staticmethod
+    def create_items(parent_identifier: str, names) -> list:
+        return [CatalogItem.objects.create(identifier=name, parent_identifier=parent_identifier, code='c', value=name)
+                for name in names]
+
+    def test_interval_operations(self):
+        def operations(record):
+            today = date.today()
+            self.create_items('A', ['a1', 'a2', 'a3'])
+            first = Catalog.objects.create(identifier='A', version='1', date=today - timedelta(days=3))
+            second = first.clone('2', on_date=today - timedelta(days=2))
+            a4, = self.create_items('A', ['a4'])
+            third = second.clone('3', on_date=today - timedelta(days=1))
+            record()
+            # удаление из средней версии делит интервал на части до и после нее
+            second.remove_items(CatalogItem.objects.filter(identifier='a1').values_list('id', flat=True))
+            record()
+            # добавление в среднюю версию не затрагивает последующие
+            second.add_items([a4.id])
+            record()
+            # новая версия из версии, которая не является последней созданной
+            first.clone('4', on_date=today)
+            record()
+            # удаление средней версии переносит границы интервалов на следующую
+            second.delete()
+            record()
+            # перенос версии в другой справочник через save и через QuerySet.update
+            third.identifier = 'B'
+            third.save()
+            record()
+            Catalog.objects.filter(identifier='A', version='4').update(identifier='B')
+            record()
+            CatalogItem.objects.filter(identifier='a2').delete()
+            record()
+
+        self.assertSameInStorages(operations)
+
+    def test_random_operations(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.assertSameInStorages(lambda record, seed=seed: self.random_operations(record, seed))
+
+    def random_operations(self, record, seed: int, steps: int = 60):
+        generator = random.Random(seed)
+        today = date.today()
+        for step in range(steps):
+            operation = generator.choice(['version', 'clone', 'item', 'bulk', 'add', 'remove',
+                                          'delete_item', 'delete_version', 'rename'])
+            catalogs = list(Catalog.objects.order_by('id'))
+            item_ids = list(CatalogItem.objects.order_by('id').values_list('id', flat=True))
+            if operation == 'version':
+                Catalog.objects.create(identifier=generator.choice(self.identifiers), version=f'v{step}',
+                                       date=today + timedelta(days=generator.randint(-30, 5)))
+            elif operation == 'clone' and catalogs:
+                generator.choice(catalogs).clone(f'v{step}', on_date=today + timedelta(days=generator.randint(-30, 5)))
+            elif operation == 'item':
+                self.create_items(generator.choice(self.identifiers), [f'i{step}'])
+            elif operation == 'bulk':
+                CatalogItem.bulk_create_linked(
+                    CatalogItem(identifier=f'i{step}-{number}', parent_identifier=generator.choice(self.identifiers),
+                                code='c', value='v')
+                    for number in range(generator.randint(1, 5))
+                )
+            elif operation == 'add' and catalogs and item_ids:
+                generator.choice(catalogs).add_items(generator.sample(item_ids, min(3, len(item_ids))))
+            elif operation == 'remove' and catalogs and item_ids:
+                generator.choice(catalogs).remove_items(generator.sample(item_ids, min(3, len(item_ids))))
+            elif operation == 'delete_item' and item_ids:
+                CatalogItem.objects.filter(pk=generator.choice(item_ids)).delete()
+            elif operation == 'delete_version' and catalogs:
+                generator.choice(catalogs).delete()
+            elif operation == 'rename' and catalogs:
+                catalog = generator.choice(catalogs)
+                catalog.identifier = 'B' if catalog.identifier == 'A' else 'A'
+                if not Catalog.objects.filter(identifier=catalog.identifier, version=catalog.version).exists():
+                    catalog.save()
+            record()
+
+    @override_settings(CATALOG_STORAGE='m2m')
+    def test_many_to_many_access(self):
+        catalog = Catalog.objects.create(identifier='A', version='1')
+        item, = self.create_items('A', ['a1'])
+        self.assertEqual(list(catalog.items.all()), [item])
+        self.assertEqual(list(item.catalog_set.all()), [catalog])
+        with override_settings(CATALOG_STORAGE='intervals'):
+            # чтение через связь ManyToMany вернуло бы пустой набор, так как она не используется
+            with self.assertRaises(RuntimeError):
+                catalog.items.all()
+            with self.assertRaises(RuntimeError):
+                item.catalog_set.all()
+            self.assertIs(Catalog.items.through, Catalog._meta.get_field('items').remote_field.through)
+
+
+class DerivedDataTests(CatalogTestCase):
+    """
+    Производные данные справочников (хеш содержимого, количество элементов, указатели на текущие версии, кеш)
+    после каждого способа записи должны совпадать с пересчитанными заново
+    """
+    def setUp(self):
+        super().setUp()
+        # кеш не должен перепроверяться по времени, чтобы проверялся именно его сброс при изменениях
+        self.addCleanup(setattr, catalog_cache, 'max_age', catalog_cache.max_age)
+        catalog_cache.max_age = float('inf')
+        self.today = date.today()
+        self.create_items('A', 5)
+        self.create_items('B', 3)
+        self.first = Catalog.objects.create(identifier='A', version='1', date=self.today - timedelta(days=10))
+        self.second = Catalog.objects.create(identifier='A', version='2', date=self.today - timedelta(days=5))
+        self.other = Catalog.objects.create(identifier='B', version='1', date=self.today - timedelta(days=3))
+        self.assertConsistent()
+
+    @staticmethod
+    def create_items(parent_identifier: str, count: int, prefix: str = 'i') -> list:
+        return [
+            CatalogItem.objects.create(identifier=f'{prefix}{number}', parent_identifier=parent_identifier,
+                                       code=f'c{number}', value=f'v{number}')
+            for number in range(count)
+        ]
+
+    def assertConsistent(self):
+        """
+        Проверка производных данных всех версий и прогрев кеша перед следующим изменением
+        """
+        identifiers = set(Catalog.objects.values_list('identifier', flat=True))
+        for catalog in Catalog.objects.all():
+            items = catalog.get_items()
+            self.assertEqual(catalog.digest, to_hex(items_hash(items)), f'{catalog.identifier} {catalog.version}')
+            self.assertEqual(catalog.item_count, items.count(), f'{catalog.identifier} {catalog.version}')
+        self.assertFalse(CurrentCatalog.objects.exclude(identifier__in=identifiers).exists())
+        for identifier in identifiers:
+            current = Catalog.objects.filter(identifier=identifier, date__lte=self.today).order_by('-date').first()
+            pointer = CurrentCatalog.objects.filter(identifier=identifier).first()
+            self.assertIsNotNone(pointer, identifier)
+            self.assertEqual(pointer.catalog_id, current.id if current else None, identifier)
+            snapshot = catalog_cache.resolve(identifier)
+            if current is None:
+                self.assertIsNone(snapshot, identifier)
+                continue
+            self.assertEqual(snapshot.fields, (current.id, current.identifier, current.version, current.date,
+                                               current.modified, current.digest), identifier)
+            # индекс проверяется через общий для обеих реализаций интерфейс (в памяти и в файле)
+            index = catalog_cache.get_index(identifier)
+            keys = set(current.get_items().values_list(*KEY_FIELDS))
+            self.assertEqual(len(index), len(keys), identifier)
+            self.assertTrue(all(index.check(dict(zip(KEY_FIELDS, key))) for key in keys), identifier)
+
+    def test_create_version(self):
+        third = Catalog.objects.create(identifier='A', version='3', date=self.today)
+        self.assertEqual(third.item_count, 5)
+        self.assertConsistent()
+
+    def test_create_first_version(self):
+        self.create_items('C', 4)
+        Catalog.objects.create(identifier='C', version='1', date=self.today)
+        self.assertConsistent()
+
+    def test_clone_older_version(self):
+        self.first.remove_items(self.first.get_items().values_list('id', flat=True)[:2])
+        self.assertConsistent()
+        self.first.clone('3', on_date=self.today)
+        self.assertConsistent()
+
+    def test_future_version(self):
+        future = self.second.clone('3', on_date=self.today + timedelta(days=5))
+        self.assertConsistent()
+        Catalog.objects.filter(pk=future.pk).update(date=self.today)
+        self.assertConsistent()
+        future.date = self.today + timedelta(days=1)
+        future.save()
+        self.assertConsistent()
+
+    def test_save_items(self):
+        item, = self.create_items('A', 1, prefix='new')
+        self.assertConsistent()
+        item.value = 'changed'
+        item.save()
+        self.assertConsistent()
+        item.delete()
+        self.assertConsistent()
+
+    def test_bulk_create_items(self):
+        CatalogItem.objects.bulk_create([
+            CatalogItem(identifier=f'bulk{number}', parent_identifier='AB'[number % 2], code='c', value=str(number))
+            for number in range(6)
+        ])
+        self.assertConsistent()
+        CatalogItem.bulk_create_linked(
+            (CatalogItem(identifier=f'linked{number}', parent_identifier='B', code='c', value=str(number))
+             for number in range(5)),
+            batch_size=2,
+        )
+        self.assertConsistent()
+
+    def test_bulk_create_catalogs(self):
+        self.create_items('C', 2)
+        Catalog.objects.bulk_create([
+            Catalog(identifier='A', version='3', date=self.today),
+            Catalog(identifier='C', version='1', date=self.today - timedelta(days=1)),
+            Catalog(identifier='C', version='2', date=self.today + timedelta(days=1)),
+        ])
+        self.assertConsistent()
+
+    def test_update_items(self):
+        # элементы входят в несколько версий справочника A
+        CatalogItem.objects.filter(parent_identifier='A', code__in=['c1', 'c2']).update(value='changed')
+        self.assertConsistent()
+        CatalogItem.objects.filter(code='c0').update(code='changed', parent_identifier='B')
+        self.assertConsistent()
+
+    def test_update_catalogs(self):
+        Catalog.objects.filter(pk=self.second.pk).update(identifier='B', version='2')
+        self.assertConsistent()
+        Catalog.objects.filter(identifier='B').update(name='renamed')
+        self.assertConsistent()
+        self.second.identifier = 'C'
+        self.second.save()
+        self.assertConsistent()
+
+    def test_update_derived_fields_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            Catalog.objects.filter(pk=self.first.pk).update(digest=self.first.digest, item_count=5)
+        self.assertEqual(len(queries), 1)
+
+    def test_delete(self):
+        CatalogItem.objects.filter(code='c3').delete()
+        self.assertConsistent()
+        self.second.delete()
+        self.assertConsistent()
+        Catalog.objects.filter(identifier='A').delete()
+        self.assertConsistent()
+
+    def test_add_and_remove_items(self):
+        items_b = list(CatalogItem.objects.filter(parent_identifier='B').values_list('id', flat=True))
+        self.first.add_items(items_b)
+        self.assertConsistent()
+        # повторное добавление и удаление отсутствующих элементов ничего не меняют
+        self.first.add_items(items_b)
+        self.second.remove_items(items_b)
+        self.assertConsistent()
+        self.first.remove_items(items_b[:2])
+        self.assertConsistent()
+
+    def test_many_to_many(self):
+        if interval_storage():
+            self.skipTest('catalog items are stored as intervals')
+        item = CatalogItem.objects.filter(parent_identifier='B').first()
+        self.second.items.add(item)
+        self.assertConsistent()
+        self.second.items.remove(item, *CatalogItem.objects.filter(code='c1'))
+        self.assertConsistent()
+        self.second.items.set(CatalogItem.objects.filter(code__in=['c0', 'c2']))
+        self.assertConsistent()
+        self.second.items.clear()
+        self.assertConsistent()
+        # изменения со стороны элемента
+        item.catalog_set.add(self.first, self.second)
+        self.assertConsistent()
+        item.catalog_set.remove(self.first)
+        self.assertConsistent()
+        item.catalog_set.clear()
+        self.assertConsistent()
+
+    def test_admin(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        fields = {'name': '', 'short_name': '', 'description': ''}
+        response = self.client.post('/admin/api/catalog/add/', {
+            'identifier': 'A', 'version': '3', 'date': self.today.isoformat(), **fields,
+        })
+        self.assertEqual(response.status_code, 302)
+        third = Catalog.objects.get(identifier='A', version='3')
+        self.assertEqual(third.item_count, 5)
+        self.assertConsistent()
+        data = {'identifier': 'A', 'version': '3', 'date': self.today.isoformat(), **fields}
+        if not interval_storage():
+            data['items'] = list(third.get_items().values_list('id', flat=True)[:2])
+        response = self.client.post(f'/admin/api/catalog/{third.pk}/change/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertConsistent()
+
+
+@override_settings(CATALOG_STORAGE='intervals')
+class IntervalDerivedDataTests(DerivedDataTests):
+    """
+    Те же проверки при хранении составов интервалами
+    """
+
+
+class ParallelValidationTests(CatalogTestCase):
+    """
+    Валидация в пуле процессов должна давать те же результаты, что и в основном процессе
+    """
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = override_settings(VALIDATION_INDEX_DIR=directory.name,
+                                     VALIDATION_PARALLEL={'WORKERS': 2, 'THRESHOLD': 0})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.addCleanup(parallel.reset_executor)
+        Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(number), parent_identifier='A', code='c', value=f'v{number}')
+            for number in range(3000)
+        )
+        CatalogItem.bulk_create_linked([CatalogItem(identifier='inf', parent_identifier='A', code='c', value='inf')])
+
+    def test_same_results(self):
+        items = [{'identifier': str(number), 'parent_identifier': 'A', 'code': 'c',
+                  'value': f'v{number}' if number % 3 else 'other'} for number in range(3000)]
+        # значения, которые JSON не передает без искажений, и объекты неверной структуры в разных частях
+        items[1] = {'identifier': 2 ** 70, 'parent_identifier': 'A', 'code': 'c', 'value': 'v1'}
+        items += [
+            {'identifier': 'inf', 'parent_identifier': 'A', 'code': 'c', 'value': float('inf')},
+            {'identifier': 'inf', 'parent_identifier': 'A', 'code': 'c', 'value': float('nan')},
+            {'identifier': 'inf', 'parent_identifier': 'A', 'code': 'c', 'value': None},
+            'junk',
+        ]
+        index = catalog_cache.get_index('A')
+        self.assertIsInstance(index, MappedItemsIndex)
+        self.assertTrue(parallel.is_parallel(index, len(items)))
+        self.assertGreater(len(parallel.split(items)), 1)
+        expected = index.validate(items)
+        self.assertEqual([expected[1]] + expected[-4:], [False, True, False, False, False])
+        self.assertEqual(parallel.validate_items(index, items), expected)
+        self.assertIsNotNone(parallel._executor)
+        self.assertEqual(async_to_sync(parallel.avalidate_items)(index, items), expected)
+
+
+class ConditionalGetTests(CatalogTestCase):
+    """
+    Условные запросы к списку элементов справочника
+    """
+    url = '/api/catalog-items/?catalog_identifier=A'
+
+    def setUp(self):
+        super().setUp()
+        self.catalog = Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(number), parent_identifier='A', code='c', value=f'v{number}')
+            for number in range(15)
+        )
+
+    def test_not_modified_without_items_query(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        table = CatalogItem._meta.db_table
+        self.assertEqual([query['sql'] for query in queries.captured_queries if table in query['sql']], [])
+
+    def test_etag_depends_on_query(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(f'{self.url}&page=1&page_size=10')['ETag'],
+                         self.client.get(f'{self.url}&page_size=10&page=1')['ETag'])
+        for query in ('&page=2', '&ordering=-parent_identifier', '&page_size=5'):
+            with self.subTest(query=query):
+                response = self.client.get(self.url + query, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_version(self):
+        etag = self.client.get(self.url)['ETag']
+        self.catalog.clone('2', on_date=date(2021, 1, 1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_content(self):
+        url = f'{self.url}&catalog_version=1'
+        etag = self.client.get(url)['ETag']
+        CatalogItem.objects.filter(identifier='3').update(value='changed')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class AsyncValidationTests(CatalogTestCase):
+    """
+    Асинхронная валидация должна отвечать так же, как синхронная
+    """
+    def setUp(self):
+        super().setUp()
+        Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.bulk_create_linked([CatalogItem(identifier='1', parent_identifier='A', code='c', value='v')])
+
+    def test_same_responses(self):
+        bodies = [
+            '[{"identifier": "1", "parent_identifier": "A", "code": "c", "value": "v"}, {"identifier": "2"}, 1]',
+            '[]',
+            '{"identifier": "1"}',
+            '[{"identifier": "1", "parent_identifier": "A", "code": "c", "value": NaN}]',
+            '[Infinity]',
+            '[-Infinity]',
+            '[{"identifier": ',
+            '',
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                responses = [
+                    self.client.post(f'/api{prefix}/catalog-items/validation/?catalog_identifier=A', body,
+                                     content_type='application/json')
+                    for prefix in ('', '/async')
+                ]
+                self.assertEqual(responses[1].status_code, responses[0].status_code)
+                self.assertEqual(responses[1].json(), responses[0].json())
+
+
+class CatalogDiffTests(CatalogTestCase):
+    """
+    Разница между версиями справочника
+    """
+    def setUp(self):
+        super().setUp()
+        self.first = Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        self.items = {
+            name: CatalogItem.objects.create(identifier=name, parent_identifier='A', code='c', value=name)
+            for name in ('a1', 'a2', 'a3')
+        }
+        self.second = self.first.clone('2', on_date=date(2021, 1, 1))
+
+    def get_diff(self, old: str, new: str):
+        return self.client.get(f'/api/catalogs/A/diff/?from={old}&to={new}')
+
+    @staticmethod
+    def serialize(*items) -> list:
+        return [{'id': item.id, 'identifier': item.identifier, 'parent_identifier': item.parent_identifier,
+                 'code': item.code, 'value': item.value} for item in items]
+
+    def test_added_removed_and_changed(self):
+        # новые элементы попадают в текущую версию 2
+        added = CatalogItem.objects.create(identifier='a4', parent_identifier='A', code='c', value='a4')
+        changed = CatalogItem.objects.create(identifier='a2', parent_identifier='A', code='c', value='changed')
+        self.second.remove_items([self.items['a1'].id, self.items['a2'].id])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        response = self.get_diff('1', '2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'identifier': 'A',
+            'from': {'version': '1', 'digest': self.first.digest},
+            'to': {'version': '2', 'digest': self.second.digest},
+            'added': self.serialize(added, changed),
+            'removed': self.serialize(self.items['a1'], self.items['a2']),
+        })
+        reverse = self.get_diff('2', '1').json()
+        self.assertEqual((reverse['added'], reverse['removed']),
+                         (self.serialize(self.items['a1'], self.items['a2']), self.serialize(added, changed)))
+
+    def test_same_version(self):
+        for old, new in (('1', '1'), ('1', '2')):
+            with self.subTest(old=old, new=new):
+                data = self.get_diff(old, new).json()
+                self.assertEqual(data['from']['digest'], data['to']['digest'])
+                self.assertEqual((data['added'], data['removed']), ([], []))
+
+    def test_unknown_version(self):
+        for old, new in (('1', '3'), ('3', '1')):
+            with self.subTest(old=old, new=new):
+                self.assertEqual(self.get_diff(old, new).status_code, 404)
+        self.assertEqual(self.client.get('/api/catalogs/B/diff/?from=1&to=1').status_code, 404)
+        self.assertEqual(self.client.get('/api/catalogs/A/diff/?from=1').json(), {'error': 'parameter "to" is required'})
+
+
+class CursorPaginationTests(CatalogTestCase):
+    """
+    Постраничный вывод по курсору (pagination=cursor)
+    """
+    # ограничение обхода страниц на случай зацикливания курсора
+    max_pages = 50
+
+    def setUp(self):
+        super().setUp()
+        for number in range(4):
+            # у версий повторяются даты, а у элементов - значения поля сортировки parent_identifier
+            Catalog.objects.create(identifier=f'c{number % 2}', version=str(number), date=date(2020, 1, 1 + number // 2))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(number), parent_identifier=f'p{number % 3}', code='c', value='v')
+            for number in range(20)
+        )
+
+    def walk(self, url: str) -> list:
+        ids, pages = [], 0
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            ids.extend(result['id'] for result in data['results'])
+            url, pages = data['next'], pages + 1
+            self.assertLess(pages, self.max_pages, 'pagination does not end')
+        self.assertGreater(pages, 1)
+        return ids
+
+    def test_all_pages(self):
+        cases = [
+            ('/api/catalogs/?pagination=cursor&page_size=3', Catalog.objects.order_by('-date', 'id')),
+            ('/api/catalogs/?pagination=cursor&page_size=3&ordering=identifier',
+             Catalog.objects.order_by('identifier', 'id')),
+            ('/api/catalog-items/?pagination=cursor&page_size=3', CatalogItem.objects.order_by('parent_identifier', 'id')),
+            ('/api/catalog-items/?pagination=cursor&page_size=7&ordering=-parent_identifier',
+             CatalogItem.objects.order_by('-parent_identifier', 'id')),
+        ]
+        for url, queryset in cases:
+            with self.subTest(url=url):
+                self.assertEqual(self.walk(url), list(queryset.values_list('id', flat=True)))
+
+    def test_previous_pages(self):
+        url = '/api/catalog-items/?pagination=cursor&page_size=6'
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append(data['results'])
+            url = data['next']
+            self.assertLess(len(pages), self.max_pages, 'pagination does not end')
+        url = data['previous']
+        for page in reversed(pages[:-1]):
+            data = self.client.get(url).json()
+            self.assertEqual(data['results'], page)
+            url = data['previous']
+        self.assertIsNone(url)
+
+    def test_invalid_cursor(self):
+        def encode(payload) -> str:
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for cursor in ('garbage', encode([1]), encode({'v': ['p1']}), encode({'v': ['p1'], 'r': False}),
+                       encode({'v': ['p1', 'not a number'], 'r': False})):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/catalog-items/?pagination=cursor&cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_queries(self):
+        url = '/api/catalog-items/?pagination=cursor&page_size=2'
+        with CaptureQueriesContext(connection) as first:
+            data = self.client.get(url).json()
+        for _ in range(self.max_pages):
+            if not data['next']:
+                break
+            url = data['next']
+            data = self.client.get(url).json()
+        self.assertIsNone(data['next'], 'pagination does not end')
+        with CaptureQueriesContext(connection) as last:
+            self.client.get(url)
+        self.assertEqual(len(last), len(first))
+        for query in first.captured_queries + last.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'].upper())
+
+
+class BatchValidationTests(CatalogTestCase):
+    """
+    Пакетная валидация элементов разных справочников
+    """
+    url = '/api/catalog-items/validation/batch/'
+
+    def setUp(self):
+        super().setUp()
+        Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.objects.create(identifier='a1', parent_identifier='A', code='c', value='old')
+        Catalog.objects.create(identifier='A', version='2', date=date(2021, 1, 1))
+        CatalogItem.objects.create(identifier='a2', parent_identifier='A', code='c', value='new')
+        Catalog.objects.create(identifier='B', version='1', date=date(2020, 1, 1))
+        CatalogItem.objects.create(identifier='b1', parent_identifier='B', code='c', value='b')
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_mixed_batch(self):
+        old = {'identifier': 'a1', 'parent_identifier': 'A', 'code': 'c', 'value': 'old'}
+        new = {'identifier': 'a2', 'parent_identifier': 'A', 'code': 'c', 'value': 'new'}
+        other = {'identifier': 'b1', 'parent_identifier': 'B', 'code': 'c', 'value': 'b'}
+        items = [
+            (dict(new, catalog_identifier='A'), True),
+            (dict(old, catalog_identifier='A'), True),
+            (dict(new, catalog_identifier='A', catalog_version='1'), False),
+            (dict(old, catalog_identifier='A', catalog_version='1'), True),
+            (dict(new, catalog_identifier='A', catalog_date='2020-06-01'), False),
+            (dict(new, catalog_identifier='A', catalog_date='2021-06-01'), True),
+            (dict(other, catalog_identifier='B'), True),
+            (dict(other, catalog_identifier='A'), False),
+            (dict(new, catalog_identifier='A', value='changed'), False),
+            # неизвестные справочник и версия, объекты без справочника и с некорректной датой
+            (dict(new, catalog_identifier='Z'), False),
+            (dict(new, catalog_identifier='A', catalog_version='3'), False),
+            (dict(new, catalog_identifier='A', catalog_date='2019-01-01'), False),
+            (new, False),
+            (dict(new, catalog_identifier='A', catalog_date='yesterday'), False),
+            ('junk', False),
+            (None, False),
+        ]
+        data = [item for item, _ in items]
+        response = self.post(data)
+        self.assertEqual(response.status_code, 200)
+        expected = [valid for _, valid in items]
+        self.assertEqual(response.json(), {
+            'short_results': expected,
+            'results': [list(pair) for pair in zip(data, expected)],
+        })
+
+    def test_invalid_body(self):
+        for data in ({'catalog_identifier': 'A'}, 'junk', 1, None):
+            with self.subTest(data=data):
+                self.assertEqual(self.post(data).json(), {'error': 'invalid data'})
+        self.assertEqual(self.post([]).json(), {'short_results': [], 'results': []})
+
+    @override_settings(VALIDATION_BATCH_MAX_SIZE=2)
+    def test_too_many_objects(self):
+        self.assertEqual(self.post([{}] * 3).json(), {'error': 'too many objects, maximum is 2'})
+        self.assertEqual(self.post([{}] * 2).json()['short_results'], [False, False])
+
+
+class NDJSONValidationTests(CatalogTestCase):
+    """
+    Потоковая валидация тела запроса в формате NDJSON
+    """
+    url = '/api/catalog-items/validation/?catalog_identifier=A'
+
+    def setUp(self):
+        super().setUp()
+        Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.objects.create(identifier='a1', parent_identifier='A', code='c', value='v')
+
+    def post(self, body: str) -> list:
+        # тестовый клиент не передает Content-Type для пустого тела, поэтому заголовок задается явно
+        response = self.client.post(self.url, body, content_type='application/x-ndjson',
+                                    CONTENT_TYPE='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content == '' or content.endswith('\n'))
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_valid_lines(self):
+        valid = {'identifier': 'a1', 'parent_identifier': 'A', 'code': 'c', 'value': 'v'}
+        invalid = dict(valid, value='other')
+        body = ''.join(json.dumps(item) + '\n' for item in (valid, invalid, valid))
+        self.assertEqual(self.post(body), [[valid, True], [invalid, False], [valid, True]])
+        # последняя строка может быть без перевода строки, а объекты совпадают с обычной валидацией
+        response = self.client.post(self.url, json.dumps([valid, invalid]), content_type='application/json')
+        self.assertEqual(self.post(body.rstrip('\n')), response.json()['results'] + [[valid, True]])
+
+    def test_malformed_and_blank_lines(self):
+        valid = {'identifier': 'a1', 'parent_identifier': 'A', 'code': 'c', 'value': 'v'}
+        lines = ['', json.dumps(valid), '   ', '{"identifier": ', '{"value": NaN}', '[1, 2]', '\r', '"a1"', '']
+        self.assertEqual(self.post('\n'.join(lines)),
+                         [[valid, True], [None, False], [None, False], [[1, 2], False], ['a1', False]])
+
+    def test_empty_body(self):
+        for body in ('', '\n', '\n \n'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body), [])
+
+
+class DateFilterTests(CatalogTestCase):
+    """
+    Выбор версий справочников, актуальных на дату (параметр date)
+    """
+    def setUp(self):
+        super().setUp()
+        for identifier in ('A', 'B'):
+            Catalog.objects.create(identifier=identifier, version='1', date=date(2020, 1, 1))
+            CatalogItem.objects.create(identifier='1', parent_identifier=identifier, code='c', value='first')
+            Catalog.objects.create(identifier=identifier, version='2', date=date(2021, 1, 1))
+            CatalogItem.objects.create(identifier='2', parent_identifier=identifier, code='c', value='second')
+        # у справочника C одна версия между версиями A и B
+        Catalog.objects.create(identifier='C', version='1', date=date(2020, 6, 1))
+
+    def get_versions(self, on_date: str) -> list:
+        results = self.client.get(f'/api/catalogs/?date={on_date}&ordering=identifier').json()['results']
+        return [(result['identifier'], result['version']) for result in results]
+
+    def get_values(self, on_date: str) -> list:
+        results = self.client.get(f'/api/catalog-items/?catalog_identifier=A&date={on_date}').json()['results']
+        return sorted(result['value'] for result in results)
+
+    def test_catalogs(self):
+        cases = [
+            ('2019-12-31', []),
+            ('2020-01-01', [('A', '1'), ('B', '1')]),
+            ('2020-08-01', [('A', '1'), ('B', '1'), ('C', '1')]),
+            ('2021-01-01', [('A', '2'), ('B', '2'), ('C', '1')]),
+            ('2030-01-01', [('A', '2'), ('B', '2'), ('C', '1')]),
+        ]
+        for on_date, versions in cases:
+            with self.subTest(date=on_date):
+                self.assertEqual(self.get_versions(on_date), versions)
+
+    def test_catalog_items(self):
+        cases = [
+            ('2019-12-31', []),
+            ('2020-01-01', ['first']),
+            ('2020-12-31', ['first']),
+            ('2021-01-01', ['first', 'second']),
+            ('2030-01-01', ['first', 'second']),
+        ]
+        for on_date, values in cases:
+            with self.subTest(date=on_date):
+                self.assertEqual(self.get_values(on_date), values)
+        # конкретная версия важнее даты
+        results = self.client.get('/api/catalog-items/?catalog_identifier=A&catalog_version=2&date=2020-01-01').json()
+        self.assertEqual(len(results['results']), 2)
+
+    def test_query_count(self):
+        def count_queries(request, *args) -> int:
+            catalog_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                request(*args)
+            return len(queries)
+
+        for request in (self.get_versions, self.get_values):
+            with self.subTest(request=request.__name__):
+                counts = {on_date: count_queries(request, on_date)
+                          for on_date in ('2020-01-01', '2020-08-01', '2030-01-01')}
+                # количество запросов не зависит ни от даты, ни от количества справочников и версий
+                for identifier in 'DEFG':
+                    for version in range(3):
+                        Catalog.objects.create(identifier=identifier, version=str(version),
+                                               date=date(2020, 1, 1 + version))
+                counts['more versions'] = count_queries(request, '2030-01-01')
+                self.assertEqual(len(set(counts.values())), 1, counts)
+                Catalog.objects.filter(identifier__in='DEFG').delete()
+
+
+class SharedCacheTests(CatalogTestCase):
+    """
+    Кеши разных процессов, согласованные через общий кеш (CATALOG_CACHE['SHARED_CACHE']).
+    Кеш процесса, выполняющего изменения, - это catalog_cache, который сбрасывают сигналы,
+    а кеш другого процесса - отдельный объект CatalogSnapshotCache с тем же общим кешем.
+    """
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.addCleanup(setattr, catalog_cache, 'shared', catalog_cache.shared)
+        catalog_cache.shared = SharedCache('default')
+        # записи не перепроверяются по базе по времени, так что изменения видны только через общий кеш
+        self.addCleanup(setattr, catalog_cache, 'max_age', catalog_cache.max_age)
+        catalog_cache.max_age = float('inf')
+        self.other = CatalogSnapshotCache(max_age=float('inf'), shared_cache='default')
+        self.catalog = Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        self.item = CatalogItem.objects.create(identifier='a1', parent_identifier='A', code='c', value='v')
+        Catalog.objects.create(identifier='B', version='1', date=date(2020, 1, 1))
+
+    def test_snapshots_loaded_once(self):
+        catalog_cache.resolve('A')
+        self.assertEqual(len(catalog_cache.get_index('A')), 1)
+        # другой процесс получает версию и индекс из общего кеша без запросов к базе
+        digest = Catalog.objects.get(pk=self.catalog.pk).digest
+        with self.assertNumQueries(0):
+            self.assertEqual(self.other.resolve('A').digest, digest)
+            self.assertEqual(len(self.other.get_index('A')), 1)
+
+    def test_write_invalidates_other_process(self):
+        for cache in (catalog_cache, self.other):
+            cache.get_index('A')
+            cache.resolve('B')
+        old = self.other.resolve('A')
+        self.item.value = 'changed'
+        self.item.save()
+        snapshot = self.other.resolve('A')
+        self.assertNotEqual(snapshot.digest, old.digest)
+        self.assertEqual(snapshot.digest, Catalog.objects.get(pk=self.catalog.pk).digest)
+        item = {'identifier': 'a1', 'parent_identifier': 'A', 'code': 'c'}
+        self.assertEqual(self.other.get_index('A').validate([dict(item, value='v'), dict(item, value='changed')]),
+                         [False, True])
+
+    def test_new_item_invalidates_only_its_catalog(self):
+        for cache in (catalog_cache, self.other):
+            cache.get_index('A')
+            cache.resolve('B')
+        CatalogItem.objects.create(identifier='a2', parent_identifier='A', code='c', value='v')
+        self.assertEqual(len(self.other.get_index('A')), 2)
+        # снимки других справочников остаются в кеше процесса
+        with self.assertNumQueries(0):
+            self.other.resolve('B')
+
+    def test_new_version_invalidates_other_process(self):
+        self.assertEqual(self.other.resolve('A').version, '1')
+        self.catalog.clone('2', on_date=date(2021, 1, 1))
+        self.assertEqual(self.other.resolve('A').version, '2')
+        self.assertEqual(self.other.resolve('A', version='2').version, '2')
+
+    def test_clear_invalidates_other_process(self):
+        self.other.resolve('B')
+        catalog_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.other.resolve('B')
+        self.assertEqual(len(queries), 1)
+
+
+class MappedItemsIndexTests(CatalogTestCase):
+    """
+    Индекс валидации в файле (VALIDATION_INDEX_DIR)
+    """
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.catalog = Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(number), parent_identifier='A', code='c', value=f'v{number}')
+            for number in range(100)
+        )
+        self.catalog.refresh_from_db()
+        self.items = [{'identifier': str(number), 'parent_identifier': 'A', 'code': 'c', 'value': f'v{number}'}
+                      for number in range(100)]
+
+    def open(self, digest: str) -> MappedItemsIndex:
+        index = MappedItemsIndex.load(self.directory, digest)
+        self.assertIsNotNone(index)
+        self.addCleanup(index.close)
+        return index
+
+    def test_build_and_reopen(self):
+        self.assertIsNone(MappedItemsIndex.load(self.directory, self.catalog.digest))
+        digest = MappedItemsIndex.build(self.directory, self.catalog.get_items())
+        self.assertEqual(digest, self.catalog.digest)
+        self.assertEqual(os.listdir(self.directory), [f'{digest}.idx'])
+        index = self.open(digest)
+        self.assertEqual((index.digest, len(index)), (digest, 100))
+        # результаты совпадают с индексом в памяти, в том числе для объектов неверной структуры
+        items = self.items + [dict(self.items[0], value='other'), dict(self.items[1], code=' c '),
+                              {'identifier': '1'}, 'junk', None, dict(self.items[2], identifier=2)]
+        expected = CatalogItemsIndex.from_queryset(self.catalog.get_items()).validate(items)
+        self.assertEqual(index.validate(items), expected)
+        self.assertEqual(expected[100:], [False, True, False, False, False, True])
+        # повторно открытый файл дает те же результаты
+        self.assertEqual(self.open(digest).validate(items), expected)
+
+    def test_invalid_files(self):
+        digest = MappedItemsIndex.build(self.directory, self.catalog.get_items())
+        path = index_path(self.directory, digest)
+        with open(path, 'r+b') as file:
+            file.truncate(os.path.getsize(path) - 8)
+        with self.assertRaises(ValueError):
+            MappedItemsIndex(path)
+        with open(path, 'wb') as file:
+            file.write(b'not an index')
+        with self.assertRaises(ValueError):
+            MappedItemsIndex(path)
+
+    def test_bloom_filter_negatives(self):
+        index = self.open(MappedItemsIndex.build(self.directory, self.catalog.get_items()))
+        missing = [dict(item, value='missing') for item in self.items] * 10
+        with mock.patch('api.index_file.bisect.bisect_left', wraps=bisect.bisect_left) as search:
+            self.assertEqual(index.validate(missing), [False] * len(missing))
+        # отсутствующие объекты почти всегда отсеиваются фильтром Блума без поиска в массиве отпечатков
+        self.assertLess(search.call_count, len(missing) * 0.05)
+        with mock.patch('api.index_file.bisect.bisect_left', wraps=bisect.bisect_left) as search:
+            self.assertEqual(index.validate(self.items), [True] * len(self.items))
+        self.assertEqual(search.call_count, len(self.items))
+
+    def test_rebuild_after_new_version(self):
+        with override_settings(VALIDATION_INDEX_DIR=self.directory):
+            first = catalog_cache.get_index('A')
+            self.assertIsInstance(first, MappedItemsIndex)
+            second = self.catalog.clone('2', on_date=date(2021, 1, 1))
+            # копия с тем же составом использует тот же файл
+            self.assertEqual(catalog_cache.get_index('A').path, first.path)
+            second.remove_items(second.get_items().filter(identifier='0').values_list('id', flat=True))
+            CatalogItem.objects.create(identifier='new', parent_identifier='A', code='c', value='v')
+            current = catalog_cache.get_index('A')
+            self.assertNotEqual(current.path, first.path)
+            self.assertEqual(current.digest, Catalog.objects.get(pk=second.pk).digest)
+            new = {'identifier': 'new', 'parent_identifier': 'A', 'code': 'c', 'value': 'v'}
+            self.assertEqual(current.validate([self.items[0], self.items[1], new]), [False, True, True])
+            self.assertEqual(catalog_cache.get_index('A', version='1').validate([self.items[0], new]), [True, False])
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([os.path.basename(first.path),
+                                                                     os.path.basename(current.path)]))
+
+
+class MappedIndexDerivedDataTests(DerivedDataTests):
+    """
+    Проверки производных данных с индексами валидации в файлах
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = override_settings(VALIDATION_INDEX_DIR=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        super().setUp()
+
+    def assertConsistent(self):
+        super().assertConsistent()
+        for identifier in set(Catalog.objects.values_list('identifier', flat=True)):
+            if catalog_cache.resolve(identifier) is not None:
+                self.assertIsInstance(catalog_cache.get_index(identifier), MappedItemsIndex)
+
+
+class CurrentCatalogTests(CatalogTestCase):
+    """
+    Пересчет устаревших указателей на текущие версии справочников
+    """
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        self.first = Catalog.objects.create(identifier='A', version='1', date=self.today - timedelta(days=10))
+        self.second = Catalog.objects.create(identifier='A', version='2', date=self.today)
+        self.other = Catalog.objects.create(identifier='B', version='1', date=self.today - timedelta(days=10))
+        Catalog.objects.create(identifier='B', version='2', date=self.today + timedelta(days=5))
+        # указатель на A в том виде, в каком его рассчитали вчера, до вступления в силу версии 2
+        CurrentCatalog.objects.filter(identifier='A').update(catalog=self.first, valid_until=self.today)
+
+    def get_pointers(self) -> dict:
+        return {pointer.identifier: (pointer.catalog_id, pointer.valid_until)
+                for pointer in CurrentCatalog.objects.all()}
+
+    def test_refresh_stale(self):
+        self.assertEqual(CurrentCatalog.refresh_stale(on_date=self.today - timedelta(days=1)), 0)
+        # действующий указатель не пересчитывается, даже если он не совпадает с таблицей справочников
+        CurrentCatalog.objects.filter(identifier='B').update(catalog=None)
+        self.assertEqual(CurrentCatalog.refresh_stale(), 1)
+        self.assertEqual(self.get_pointers(), {
+            'A': (self.second.id, None),
+            'B': (None, self.today + timedelta(days=5)),
+        })
+        self.assertEqual(CurrentCatalog.refresh_stale(), 0)
+
+    def test_get_current(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(CurrentCatalog.get_current('B'), self.other)
+        self.assertEqual(len(queries), 1)
+        # устаревший указатель пересчитывается при чтении
+        self.assertEqual(CurrentCatalog.get_current('A'), self.second)
+        self.assertEqual(self.get_pointers()['A'], (self.second.id, None))
+        self.assertEqual(async_to_sync(CurrentCatalog.aget_current)('A'), self.second)
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('refresh_current_catalogs', stdout=output)
+        self.assertIn('1 current catalog pointers refreshed', output.getvalue())
+        self.assertEqual(self.get_pointers()['A'], (self.second.id, None))
+        CurrentCatalog.objects.filter(identifier='B').update(catalog=None)
+        call_command('refresh_current_catalogs', '--all', stdout=output)
+        self.assertEqual(self.get_pointers()['B'], (self.other.id, self.today + timedelta(days=5)))
+
+
+METRICS_MIDDLEWARE = 'api.middleware.RequestMetricsMiddleware'
+
+
+def metrics_settings(enabled: bool, sample_rate: float = 1.0) -> override_settings:
+    """
+    Настройки сбора метрик независимо от переменных окружения, с которыми запущены тесты
+    """
+    middleware = [name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE]
+    return override_settings(
+        REQUEST_METRICS={'ENABLED': enabled, 'SAMPLE_RATE': sample_rate},
+        MIDDLEWARE=[METRICS_MIDDLEWARE, *middleware] if enabled else middleware,
+    )
+
+
+class RequestMetricsTests(CatalogTestCase):
+    """
+    Сбор метрик запросов, заголовок Server-Timing и эндпоинт /api/_metrics
+    """
+    server_timing = re.compile(r'db;dur=\d+\.\d{2};desc="(\d+) queries", serialization;dur=\d+\.\d{2}, '
+                               r'total;dur=\d+\.\d{2}')
+    sample = re.compile(r'[a-z_]+(\{([a-z_]+="(?:[^"\\]|\\.)*",?)*\})? [0-9.e+-]+')
+
+    def setUp(self):
+        super().setUp()
+        metrics_registry.clear()
+        self.addCleanup(metrics_registry.clear)
+        # счетчики обращений к кешу не должны зависеть от настроек кеша, с которыми запущены тесты
+        for name, value in (('max_versions', 64), ('max_age', float('inf'))):
+            self.addCleanup(setattr, catalog_cache, name, getattr(catalog_cache, name))
+            setattr(catalog_cache, name, value)
+        # обертка SQL запросов добавляется при создании подключения, а тестовое подключение уже создано
+        if record_query not in connection.execute_wrappers:
+            instrument_connection(None, connection)
+            self.addCleanup(connection.execute_wrappers.remove, record_query)
+        Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.objects.create(identifier='a1', parent_identifier='A', code='c', value='v')
+
+    @metrics_settings(enabled=True)
+    def test_server_timing(self):
+        for url in ('/api/catalog-items/?catalog_identifier=A', '/api/async/catalog-items/?catalog_identifier=A'):
+            with self.subTest(url=url):
+                catalog_cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                match = self.server_timing.fullmatch(response['Server-Timing'])
+                self.assertIsNotNone(match, response['Server-Timing'])
+                self.assertEqual(int(match.group(1)), len(queries))
+
+    @metrics_settings(enabled=True)
+    def test_metrics_endpoint(self):
+        for _ in range(3):
+            self.client.get('/api/catalog-items/?catalog_identifier=A')
+        self.client.get('/api/catalog-items/0/')
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertNotIn('Server-Timing', response)
+        lines = response.content.decode().splitlines()
+        for line in lines:
+            if not line.startswith('# HELP ') and not line.startswith('# TYPE '):
+                self.assertRegex(line, self.sample)
+        values = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+        labels = 'view="api:catalog-item-list",method="GET",status="200"'
+        self.assertEqual(values[f'api_request_duration_seconds_count{{{labels}}}'], '3')
+        self.assertEqual(values[f'api_request_duration_seconds_bucket{{{labels},le="+Inf"}}'], '3')
+        self.assertEqual(values[f'api_request_db_queries_count{{{labels}}}'], '3')
+        buckets = [int(value) for key, value in values.items()
+                   if key.startswith(f'api_request_db_queries_bucket{{{labels},')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertGreater(int(values[f'api_request_response_bytes_total{{{labels}}}']), 0)
+        self.assertIn('api_request_duration_seconds_count{view="api:catalog-item-detail",method="GET",status="404"}',
+                      values)
+        # сам эндпоинт метрик не учитывается, а обращения к кешу учитываются
+        self.assertFalse(any('view="api:metrics"' in key for key in values))
+        self.assertEqual(values['api_cache_requests_total{cache="snapshot",layer="local",result="miss"}'], '1')
+        self.assertIn('api_cache_requests_total{cache="snapshot",layer="local",result="hit"}', values)
+
+    @metrics_settings(enabled=True, sample_rate=0)
+    def test_not_sampled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/catalog-items/?catalog_identifier=A'))
+        self.assertNotIn('api_request_duration_seconds_count', self.client.get('/api/_metrics').content.decode())
+
+    @metrics_settings(enabled=False)
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/catalog-items/?catalog_identifier=A'))
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 404)
+
+
+class ExportTests(CatalogTestCase):
+    """
+    Потоковая выгрузка элементов справочника
+    """
+    # значения, требующие экранирования в CSV и JSON
+    values = ['plain', 'запятая, "кавычки"', 'перевод\nстроки', 'табуляция\tвнутри', 'emoji \U0001f600', '\\', ';']
+
+    def setUp(self):
+        super().setUp()
+        self.first = Catalog.objects.create(identifier='A', version='1', date=date(2020, 1, 1))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=str(number), parent_identifier='A', code=f'c{number}',
+                        value=self.values[number % len(self.values)])
+            for number in range(30)
+        )
+        second = self.first.clone('2', on_date=date(2021, 1, 1))
+        second.remove_items(second.get_items().filter(code__in=['c0', 'c1']).values_list('id', flat=True))
+        CatalogItem.objects.create(identifier='new', parent_identifier='A', code='c', value='new')
+        CatalogItem.objects.create(identifier='other', parent_identifier='B', code='c', value='other')
+
+    def export(self, query: str, export_format: str) -> list:
+        response = self.client.get(f'/api/catalog-items/export/?{query}&export_format={export_format}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        if export_format == 'ndjson':
+            return [json.loads(line) for line in content.splitlines()]
+        return [dict(row, id=int(row['id'])) for row in csv.DictReader(io.StringIO(content, newline=''))]
+
+    def list_items(self, query: str) -> list:
+        data = self.client.get(f'/api/catalog-items/?{query}&page_size=1000').json()
+        self.assertIsNone(data['next'])
+        return sorted(data['results'], key=lambda item: item['id'])
+
+    def test_same_as_list(self):
+        for query in ('catalog_identifier=A', 'catalog_identifier=A&catalog_version=1',
+                      'catalog_identifier=A&date=2020-06-01', 'catalog_identifier=Z', 'parent=B'):
+            expected = self.list_items(query)
+            for export_format in ('ndjson', 'csv'):
+                with self.subTest(query=query, export_format=export_format):
+                    self.assertEqual(self.export(query, export_format), expected)
+
+    def test_import_round_trip(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        expected = [{key: value for key, value in item.items() if key != 'id'}
+                    for item in self.list_items('catalog_identifier=A')]
+        for export_format, extension in (('ndjson', 'jsonl'), ('csv', 'csv')):
+            with self.subTest(export_format=export_format):
+                response = self.client.get(f'/api/catalog-items/export/?catalog_identifier=A'
+                                           f'&export_format={export_format}')
+                path = os.path.join(directory.name, f'export.{extension}')
+                with open(path, 'wb') as file:
+                    file.writelines(response.streaming_content)
+                # выгруженные элементы загружаются заново в текущую версию
+                current = CatalogItem.objects.filter(CatalogItem.in_catalog(catalog_cache.resolve('A')))
+                CatalogItem.objects.filter(pk__in=list(current.values_list('id', flat=True))).delete()
+                call_command('import_items', path, stdout=io.StringIO())
+                items = [{key: value for key, value in item.items() if key != 'id'}
+                         for item in self.list_items('catalog_identifier=A')]
+                self.assertEqual(items, expected)
+
+    def test_invalid_format(self):
+        response = self.client.get('/api/catalog-items/export/?catalog_identifier=A&export_format=xml')
+        self.assertEqual(response.json(), {'error': 'parameter "export_format" must be "ndjson" or "csv"'})
+
+
+class BulkCreateTests(CatalogTestCase):
+    """
+    Массовая загрузка элементов и их добавление в текущие версии справочников
+    """
+    url = '/api/catalog-items/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        self.old = Catalog.objects.create(identifier='A', version='1', date=today - timedelta(days=10))
+        self.current = Catalog.objects.create(identifier='A', version='2', date=today - timedelta(days=5))
+        self.future = Catalog.objects.create(identifier='A', version='3', date=today + timedelta(days=5))
+        self.other = Catalog.objects.create(identifier='B', version='1', date=today - timedelta(days=5))
+        self.items = [{'identifier': f'i{number}', 'parent_identifier': 'AB'[number % 2], 'code': 'c', 'value': 'v'}
+                      for number in range(6)]
+        self.user = User.objects.create(username='user')
+        self.admin = User.objects.create(username='admin', is_staff=True)
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    @staticmethod
+    def identifiers(catalog: Catalog) -> list:
+        return sorted(catalog.get_items().values_list('identifier', flat=True))
+
+    def test_permissions(self):
+        self.assertEqual(self.post(self.items).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.post(self.items).status_code, 403)
+        self.assertFalse(CatalogItem.objects.exists())
+        self.client.force_login(self.admin)
+        response = self.post(self.items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 6)
+
+    def test_linked_to_current_versions(self):
+        self.client.force_login(self.admin)
+        self.post(self.items + [{'identifier': 'c', 'parent_identifier': 'C', 'code': 'c', 'value': 'v'}])
+        self.assertEqual(self.identifiers(self.current), ['i0', 'i2', 'i4'])
+        self.assertEqual(self.identifiers(self.other), ['i1', 'i3', 'i5'])
+        self.assertEqual(self.identifiers(self.old), [])
+        self.assertEqual(self.identifiers(self.future), [])
+        # элемент справочника без версий создается, но ни в одну версию не попадает
+        self.assertTrue(CatalogItem.objects.filter(identifier='c').exists())
+        for catalog in (self.old, self.current, self.future, self.other):
+            catalog.refresh_from_db()
+            self.assertEqual(catalog.item_count, len(self.identifiers(catalog)))
+        self.assertEqual(catalog_cache.get_index('A').validate(self.items[:2]), [True, False])
+
+    def test_invalid_data(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.post({'identifier': 'i'}).json(), {'error': 'invalid data'})
+        response = self.post(self.items + [{'identifier': 'x', 'parent_identifier': '', 'code': 'c'}])
+        self.assertEqual(response.json()['error'], 'invalid data')
+        self.assertEqual(list(response.json()['details']), ['6'])
+        self.assertFalse(CatalogItem.objects.exists())
+
+    def test_current_version_resolved_once(self):
+        items = (CatalogItem(identifier=f'i{number}', parent_identifier='ABC'[number % 3], code='c', value='v')
+                 for number in range(30))
+        with mock.patch.object(Catalog, 'get_by_version', wraps=Catalog.get_by_version) as get_by_version:
+            self.assertEqual(CatalogItem.bulk_create_linked(items, batch_size=4), 30)
+        self.assertEqual(sorted(call.args[0] for call in get_by_version.call_args_list), ['A', 'B', 'C'])
+        self.assertEqual(len(self.identifiers(self.current)), 10)
+
+
+class ModelSerializerViewMixin:
+    """
+    Представление, отдающее те же данные через ModelSerializer и JSONRenderer из DRF, без быстрого пути
+    """
+    fast_json = False
+    renderer_classes = [JSONRenderer]
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def get_validators(self, request, *args, **kwargs):
+        # условные запросы не влияют на содержимое ответа
+        return None
+
+
+class FastReadTests(CatalogTestCase):
+    """
+    Быстрые сериализаторы и FastJSONRenderer должны отдавать те же байты, что и ModelSerializer с JSONRenderer
+    """
+    views = {
+        'catalogs': type('CatalogList', (ModelSerializerViewMixin, views.CatalogList),
+                         {'serializer_class': CatalogSerializer}),
+        'catalog': type('CatalogDetail', (ModelSerializerViewMixin, views.CatalogDetail),
+                        {'serializer_class': CatalogSerializer}),
+        'items': type('CatalogItemList', (ModelSerializerViewMixin, views.CatalogItemList),
+                      {'serializer_class': CatalogItemSerializer}),
+        'item': type('CatalogItemDetail', (ModelSerializerViewMixin, views.CatalogItemDetail),
+                     {'serializer_class': CatalogItemSerializer}),
+    }
+
+    def setUp(self):
+        super().setUp()
+        # строки, которые рендереры экранируют по-разному, если не приводить их к одному виду
+        values = ['plain', 'кириллица', 'quote " and \\ backslash', 'line\u2028separator\u2029', 'emoji \U0001f600',
+                  'control \x01\x1f', '<script>&amp;</script>']
+        for number, value in enumerate(values):
+            Catalog.objects.create(identifier=f'c{number % 3}', version=str(number), name=value, short_name=value[:3],
+                                   description=value, date=date(2020, 1, 1) + timedelta(days=number * 40))
+        CatalogItem.bulk_create_linked(
+            CatalogItem(identifier=value, parent_identifier=f'c{number % 3}', code=str(number), value=value)
+            for number, value in enumerate(values * 3)
+        )
+        self.catalog_id = Catalog.objects.values_list('id', flat=True).first()
+        self.item_id = CatalogItem.objects.values_list('id', flat=True).last()
+
+    def assertSameContent(self, view: str, url: str, **kwargs):
+        fast = self.client.get(url)
+        self.assertEqual(fast.status_code, 200, url)
+        request = APIRequestFactory().get(url)
+        response = self.views[view].as_view()(request, **kwargs)
+        response.render()
+        self.assertEqual(fast.content, response.content, url)
+        return fast
+
+    def test_lists(self):
+        for url in ('/api/catalogs/', '/api/catalogs/?page=2&page_size=3', '/api/catalogs/?date=2020-06-01&ordering=identifier',
+                    '/api/catalogs/?pagination=cursor&page_size=3&ordering=-version'):
+            with self.subTest(url=url):
+                self.assertSameContent('catalogs', url)
+        for url in ('/api/catalog-items/?page_size=100', '/api/catalog-items/?catalog_identifier=c1',
+                    '/api/catalog-items/?catalog_identifier=c0&catalog_version=0&ordering=-parent_identifier',
+                    '/api/catalog-items/?pagination=cursor&page_size=4'):
+            with self.subTest(url=url):
+                self.assertSameContent('items', url)
+
+    def test_async_lists(self):
+        for view, url in (('catalogs', '/api/catalogs/?ordering=identifier'),
+                          ('items', '/api/catalog-items/?catalog_identifier=c2')):
+            with self.subTest(url=url):
+                response = self.assertSameContent(view, url)
+                self.assertEqual(self.client.get(url.replace('/api/', '/api/async/')).content, response.content)
+
+    def test_details(self):
+        for catalog_id in Catalog.objects.values_list('id', flat=True):
+            self.assertSameContent('catalog', f'/api/catalogs/{catalog_id}/', pk=catalog_id)
+        for item_id in CatalogItem.objects.values_list('id', flat=True):
+            self.assertSameContent('item', f'/api/catalog-items/{item_id}/', pk=item_id)
@@ -1,14 +1,28 @@
 from django.urls import path
-from api import views
+from api import views, async_views
 
 
 app_name = 'api'
 
 urlpatterns = [
     path('', views.api_root, name='root'),
+    path('_metrics', views.request_metrics, name='metrics'),
     path('catalogs/', views.CatalogList.as_view(), name='catalog-list'),
     path('catalogs/<int:pk>/', views.CatalogDetail.as_view(), name='catalog-detail'),
+    path('catalogs/<str:identifier>/diff/', views.CatalogDiff.as_view(), name='catalog-diff'),
     path('catalog-items/', views.CatalogItemList.as_view(), name='catalog-item-list'),
     path('catalog-items/<int:pk>/', views.CatalogItemDetail.as_view(), name='catalog-item-detail'),
-    path('catalog-items/validation/', views.CatalogItemsValidation.as_view(), name='catalog-item-validation')
+    path('catalog-items/validation/', views.CatalogItemsValidation.as_view(), name='catalog-item-validation'),
+    path('catalog-items/validation/batch/', views.CatalogItemsBatchValidation.as_view(),
+         name='catalog-item-batch-validation'),
+    path('catalog-items/export/', views.CatalogItemsExport.as_view(), name='catalog-item-export'),
+    path('catalog-items/bulk/', views.CatalogItemsBulkCreate.as_view(), name='catalog-item-bulk'),
+    # асинхронные варианты эндпоинтов чтения и валидации для работы через ASGI
+    path('async/catalogs/', async_views.AsyncCatalogList.as_view(), name='async-catalog-list'),
+    path('async/catalogs/<int:pk>/', async_views.AsyncCatalogDetail.as_view(), name='async-catalog-detail'),
+    path('async/catalog-items/', async_views.AsyncCatalogItemList.as_view(), name='async-catalog-item-list'),
+    path('async/catalog-items/<int:pk>/', async_views.AsyncCatalogItemDetail.as_view(),
+         name='async-catalog-item-detail'),
+    path('async/catalog-items/validation/', async_views.AsyncCatalogItemsValidation.as_view(),
+         name='async-catalog-item-validation'),
 ]
\ No newline at end of file
@@ -0,0 +1,213 @@
+import re
+import sys
+from collections import defaultdict
+from datetime import date
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from django.core.validators import MaxLengthValidator, ProhibitNullCharactersValidator
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from api.serializers import CatalogItemSerializer
+
+# поля, по совокупности которых элемент из запроса считается совпадающим с элементом справочника
+KEY_FIELDS = ('identifier', 'parent_identifier', 'code', 'value')
+
+ItemKey = Tuple[str, str, str, str]
+
+
+def serializer_item_key(item) -> Optional[ItemKey]:
+    """
+    Функция для получения ключа объекта, поданного на валидацию, через CatalogItemSerializer.
+    Используется для объектов, которые не являются словарями, и для сравнения с compile_item_key.
+    :param item: объект из тела запроса
+    :return: кортеж значений полей KEY_FIELDS или None, если объект некорректен
+    """
+    serialized_item = CatalogItemSerializer(data=item)
+    if not serialized_item.is_valid():
+        return None
+    data = serialized_item.validated_data
+    return tuple(data[field] for field in KEY_FIELDS)
+
+
+# символы, запрещенные валидаторами строковых полей DRF: нулевой символ и суррогатные пары
+FORBIDDEN_CHARACTERS = re.compile('[\x00\ud800-\udfff]')
+# валидаторы, которые повторяет compile_item_key
+COMPILED_VALIDATORS = (MaxLengthValidator, ProhibitNullCharactersValidator, ProhibitSurrogateCharactersValidator)
+
+
+def compile_item_key(serializer_class=CatalogItemSerializer) -> Optional[Callable[[dict], Optional[ItemKey]]]:
+    """
+    Построение быстрой функции получения ключа по правилам полей сериализатора.
+    Правила (обязательность, запрет пустых значений и null, допустимые типы, обрезка пробелов,
+    максимальная длина, запрещенные символы) извлекаются из полей один раз, после чего
+    словарь из запроса проверяется без создания сериализатора и полей DRF,
+    с теми же решениями о корректности, что и у serializer_item_key.
+    :param serializer_class: сериализатор элемента справочника
+    :return: функция или None, если у сериализатора есть правила, которые она не повторяет
+    """
+    serializer = serializer_class()
+    if serializer.validators or type(serializer).validate is not serializers.Serializer.validate:
+        return None
+    rules = []
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if (type(field) is not serializers.CharField or hasattr(serializer, f'validate_{name}')
+                or not field.required or field.allow_blank or field.allow_null or not field.trim_whitespace
+                or field.min_length is not None or field.source != name
+                or not all(isinstance(validator, COMPILED_VALIDATORS) for validator in field.validators)):
+            return None
+        rules.append((name, field.max_length or sys.maxsize))
+    if not set(KEY_FIELDS) <= {name for name, _ in rules}:
+        return None
+    positions = [[name for name, _ in rules].index(field) for field in KEY_FIELDS]
+    search_forbidden = FORBIDDEN_CHARACTERS.search
+
+    def compiled_item_key(item: dict) -> Optional[ItemKey]:
+        values = []
+        for name, max_length in rules:
+            value = item.get(name)
+            # отсутствующее поле, null и булевы значения недопустимы, числа приводятся к строке
+            if type(value) is not str:
+                if value is None or isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    return None
+                value = str(value)
+            value = value.strip()
+            if not value or len(value) > max_length or search_forbidden(value):
+                return None
+            values.append(value)
+        return tuple(values[position] for position in positions)
+
+    return compiled_item_key
+
+
+@lru_cache(maxsize=None)
+def get_compiled_item_key() -> Callable[[dict], Optional[ItemKey]]:
+    return compile_item_key() or serializer_item_key
+
+
+def item_key(item) -> Optional[ItemKey]:
+    """
+    Функция для получения ключа объекта, поданного на валидацию.
+    Словари проверяются быстрой функцией из compile_item_key, остальные объекты,
+    как и раньше, сериализатором, чтобы сохранить правила приведения и обрезки строк.
+    :param item: объект из тела запроса
+    :return: кортеж значений полей KEY_FIELDS или None, если объект некорректен
+    """
+    if type(item) is dict:
+        return get_compiled_item_key()(item)
+    return serializer_item_key(item)
+
+
+class CatalogItemsIndex:
+    """
+    Хешированный индекс элементов одной версии справочника.
+    Строится один раз по набору элементов, после чего проверка
+    каждого объекта выполняется за O(1) вместо перебора всего справочника.
+    """
+    __slots__ = ('keys',)
+
+    def __init__(self, keys: Iterable[ItemKey]):
+        self.keys = frozenset(keys)
+
+    @classmethod
+    def from_queryset(cls, queryset: QuerySet) -> 'CatalogItemsIndex':
+        """
+        Построение индекса по queryset элементов справочника.
+        Из базы выбираются только нужные поля в виде кортежей, без создания объектов моделей.
+        :param queryset: queryset элементов справочника
+        :return: объект CatalogItemsIndex
+        """
+        return cls(queryset.values_list(*KEY_FIELDS))
+
+    @classmethod
+    async def afrom_queryset(cls, queryset: QuerySet) -> 'CatalogItemsIndex':
+        """
+        Асинхронный вариант метода from_queryset
+        """
+        return cls([key async for key in queryset.values_list(*KEY_FIELDS)])
+
+    def __contains__(self, key) -> bool:
+        return key in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def validate(self, items: Iterable) -> List[bool]:
+        """
+        Валидация объектов из запроса.
+        :param items: объекты, поданные на валидацию
+        :return: список булевых значений на местах, соответствующих объектам
+        """
+        return [self.check(item) for item in items]
+
+    def check(self, item) -> bool:
+        """
+        Проверка одного объекта из запроса
+        :param item: объект, поданный на валидацию
+        :return: True, если объект совпадает с элементом справочника
+        """
+        key = item_key(item)
+        # некорректный объект не может совпадать с элементом справочника
+        return key is not None and key in self.keys
+
+
+def batch_group(item) -> Optional[Tuple[str, Optional[str], Optional[date]]]:
+    """
+    Функция для получения версии справочника, по которой проверяется объект пакетной валидации.
+    :param item: объект из тела запроса с полями catalog_identifier и необязательными catalog_version
+    или catalog_date (дата в формате YYYY-MM-DD, учитывается только без catalog_version)
+    :return: тройка (identifier, version, on_date) или None, если справочник не указан
+    либо версия или дата указаны некорректно
+    """
+    if not isinstance(item, dict):
+        return None
+    identifier = item.get('catalog_identifier', None)
+    if not identifier or not isinstance(identifier, str):
+        return None
+    version = item.get('catalog_version', None)
+    if version is not None and not isinstance(version, str):
+        return None
+    if version:
+        return identifier, version, None
+    on_date = item.get('catalog_date', None) or None
+    if on_date is not None:
+        if not isinstance(on_date, str):
+            return None
+        try:
+            on_date = date.fromisoformat(on_date)
+        except ValueError:
+            return None
+    return identifier, None, on_date
+
+
+def validate_batch(items: Sequence, get_index: Callable[..., CatalogItemsIndex],
+                   validate: Optional[Callable[[CatalogItemsIndex, Sequence], List[bool]]] = None) -> List[bool]:
+    """
+    Пакетная валидация объектов, относящихся к разным справочникам.
+    Объекты группируются по версиям справочников, индекс каждой версии запрашивается один раз,
+    а группы обрабатываются по очереди, так что одновременно в памяти находится только
+    один индекс (не считая кеша, размер которого ограничен настройкой CATALOG_CACHE).
+    :param items: объекты, поданные на валидацию
+    :param get_index: функция получения индекса по (identifier, version, on_date), например catalog_cache.get_index
+    :param validate: функция проверки объектов группы по индексу, по умолчанию метод validate индекса
+    :return: список булевых значений на местах, соответствующих объектам
+    """
+    # номера объектов для каждой версии справочника, в порядке первого упоминания
+    groups = defaultdict(list)
+    for position, item in enumerate(items):
+        group = batch_group(item)
+        if group is not None:
+            groups[group].append(position)
+
+    results = [False] * len(items)
+    for (identifier, version, on_date), positions in groups.items():
+        index = get_index(identifier, version=version, on_date=on_date)
+        group = [items[position] for position in positions]
+        group_results = validate(index, group) if validate is not None else index.validate(group)
+        for position, result in zip(positions, group_results):
+            results[position] = result
+    return results
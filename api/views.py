@@ -1,13 +1,31 @@
+import csv
+import datetime
+import hashlib
+import json
+import time
+from collections.abc import Iterator
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, urlencode
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from rest_framework import generics, filters
+from rest_framework import generics, filters, permissions, status
 from rest_framework.views import APIView
 
-from api.filters import RelevantDateFilterBackend, ExactCatalogFilterBackend
+from api.cache import catalog_cache
+from api.filters import RelevantDateFilterBackend, ExactCatalogFilterBackend, get_catalog_date
+from api.metrics import registry as metrics_registry
 from api.models import Catalog, CatalogItem
-from api.serializers import CatalogSerializer, CatalogItemSerializer
+from api.pagination import CatalogPagination
+from api.parallel import validate_items
+from api.parsers import NDJSONParser
+from api.serializers import CatalogItemSerializer, CatalogFastSerializer, CatalogItemFastSerializer
+from api.validation import validate_batch
 
 
 def redirect_view(request):
@@ -28,7 +46,13 @@ def api_root(request, format=None):
     previous: ссылка на предыдущую страницу или null\n
     results: списко с результатами\n
     Навигация может осуществляться вручную путем добавления параметра page:\n
-    GET /api/catalogs/?page=2
+    GET /api/catalogs/?page=2\n
+    Размер страницы задается параметром page_size:\n
+    GET /api/catalogs/?page_size=100\n
+    Для больших списков можно использовать вывод по курсору с параметром pagination=cursor:\n
+    GET /api/catalog-items/?pagination=cursor\n
+    В этом случае в ответе нет поля count, а ссылки next и previous содержат параметр cursor.
+    Любая страница при этом выбирается так же быстро, как и первая.
     """
     # Главная страница с навигацией
     return Response({
@@ -36,10 +60,63 @@ def api_root(request, format=None):
         'Список справочников': reverse('api:catalog-list', request=request, format=format),
         'Список элементов': reverse('api:catalog-item-list', request=request, format=format),
         'Валидация элементов': reverse('api:catalog-item-validation', request=request, format=format),
+        'Пакетная валидация элементов': reverse('api:catalog-item-batch-validation', request=request, format=format),
+        'Массовая загрузка элементов': reverse('api:catalog-item-bulk', request=request, format=format),
+        'Выгрузка элементов': reverse('api:catalog-item-export', request=request, format=format),
     })
 
 
-class CatalogList(generics.ListAPIView):
+def request_metrics(request):
+    """
+    Метрики запросов в текстовом формате Prometheus (api/metrics.py).
+    Доступны, только если сбор метрик включен настройкой REQUEST_METRICS['ENABLED'].
+    """
+    if not settings.REQUEST_METRICS['ENABLED']:
+        raise Http404
+    return HttpResponse(metrics_registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class FastReadMixin:
+    """
+    Примесь для представлений только для чтения с быстрой сериализацией.
+    Из базы выбираются только поля сериализатора в виде словарей (queryset.values),
+    которые отдаются быстрым сериализатором и рендерером FastJSONRenderer без изменений.
+    """
+    fast_json = True
+
+    def get_queryset(self):
+        return super().get_queryset().values(*self.get_serializer_class().get_fields())
+
+
+class ConditionalGetMixin:
+    """
+    Примесь для условных GET запросов (ETag, Last-Modified, Cache-Control).
+    Представление возвращает в get_validators ключ содержимого, время изменения и значение Cache-Control,
+    либо None, если для запроса условная обработка не применяется.
+    При совпадении If-None-Match или If-Modified-Since ответ 304 отдается до выборки данных.
+    ETag зависит и от формата ответа, так как JSON и HTML версии отличаются.
+    """
+    def get_validators(self, request, *args, **kwargs) -> Optional[Tuple[str, datetime.datetime, str]]:
+        return None
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        key, last_modified, cache_control = validators
+        etag = quote_etag(hashlib.sha256(f'{key}:{request.accepted_renderer.format}'.encode()).hexdigest()[:32])
+        last_modified = last_modified.replace(microsecond=0)
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+            response['Cache-Control'] = cache_control
+        return response
+
+
+class CatalogList(FastReadMixin, generics.ListAPIView):
     """
     Список справочников. Read-Only.\n
     Возможна сортировка по полям date, identifier, version. Например:\n
@@ -49,44 +126,202 @@ class CatalogList(generics.ListAPIView):
     GET /api/catalogs/?date=2021-06-24 - дата представлена в ISO формате YYYY-MM-DD.
     """
     queryset = Catalog.objects.all()
-    serializer_class = CatalogSerializer
+    serializer_class = CatalogFastSerializer
     # свой фильтр для получения списка справочников, актуальных на указанную дату
     filter_backends = [RelevantDateFilterBackend, filters.OrderingFilter]
     ordering_fields = ['date', 'identifier', 'version']
     ordering = ['-date']
+    pagination_class = CatalogPagination
 
 
-class CatalogDetail(generics.RetrieveAPIView):
+class CatalogDetail(ConditionalGetMixin, FastReadMixin, generics.RetrieveAPIView):
     """
-    Конкретный справочник. Read-Only.
+    Конкретный справочник. Read-Only.\n
+    Поддерживаются условные запросы с заголовками If-None-Match и If-Modified-Since.
     """
     queryset = Catalog.objects.all()
-    serializer_class = CatalogSerializer
+    serializer_class = CatalogFastSerializer
 
+    def get_validators(self, request, *args, **kwargs):
+        # ключом служит содержимое справочника, время изменения берется из поля modified
+        catalog = Catalog.objects.filter(pk=kwargs['pk']).values(*self.serializer_class.get_fields(), 'modified')
+        catalog = catalog.first()
+        if catalog is None:
+            return None
+        modified = catalog.pop('modified')
+        return repr(sorted(catalog.items())), modified, f'public, max-age={settings.CATALOG_HTTP_MAX_AGE}'
 
-class CatalogItemList(generics.ListAPIView):
+
+class CatalogDiff(APIView):
+    """
+    Разница между двумя версиями справочника. Read-Only.\n
+    Версии задаются параметрами from и to:\n
+    GET /api/catalogs/1222/diff/?from=1.2&to=1.3\n
+    В ответе будут хеши содержимого обеих версий, список элементов "added", которые есть в версии to,
+    но отсутствуют в версии from, и список элементов "removed" - наоборот.
+    Если хеши версий совпадают, то списки пустые.
+    """
+    fast_json = True
+
+    def get(self, request, identifier: str, format=None):
+        versions = {}
+        for param in ('from', 'to'):
+            version = request.query_params.get(param, None)
+            if not version:
+                return Response({'error': f'parameter "{param}" is required'})
+            versions[param] = catalog_cache.resolve(identifier, version=version)
+            if versions[param] is None:
+                return Response({'error': f'catalog "{identifier}" version "{version}" does not exist'},
+                                status=status.HTTP_404_NOT_FOUND)
+        old, new = versions['from'], versions['to']
+        fields = CatalogItemFastSerializer.get_fields()
+        if old.digest == new.digest:
+            added = removed = []
+        else:
+            # разность множеств элементов считается базой
+            added = self.difference(new, old).order_by('id').values(*fields)
+            removed = self.difference(old, new).order_by('id').values(*fields)
+        return Response({
+            'identifier': identifier,
+            'from': {'version': old.version, 'digest': old.digest},
+            'to': {'version': new.version, 'digest': new.digest},
+            'added': CatalogItemFastSerializer(added, many=True).data,
+            'removed': CatalogItemFastSerializer(removed, many=True).data,
+        })
+
+    @staticmethod
+    def difference(catalog, other):
+        """
+        Элементы версии catalog, которых нет в версии other
+        """
+        other_items = CatalogItem.objects.filter(CatalogItem.in_catalog(other)).values('id')
+        return CatalogItem.objects.filter(CatalogItem.in_catalog(catalog)).exclude(id__in=other_items)
+
+
+class CatalogItemList(ConditionalGetMixin, FastReadMixin, generics.ListAPIView):
     """
     Список элементов справочников. Read-Only.\n
     Возможна сортировка по полю parent_identifier. Например:\n
     GET /api/catalog-items/?ordering=-parent_identifier - в  обратном алфавитном порядке.\n
     Для получения элементов заданного справочника текущей или указанной версии:\n
     GET /api/catalog-items/?catalog_identifier=1222 - выдаст элементы актуального на сегодня справочника с идентификатором 1222,\n
-    GET /api/catalog-items/?catalog_identifier=1222&catalog_version=1.3 - выдаст элементы справочника с идентификатором 1222 версии 1.3.\n
+    GET /api/catalog-items/?catalog_identifier=1222&catalog_version=1.3 - выдаст элементы справочника с идентификатором 1222 версии 1.3,\n
+    GET /api/catalog-items/?catalog_identifier=1222&date=2020-01-01 - выдаст элементы версии справочника с идентификатором 1222,
+    актуальной на 1 января 2020 года.\n
+    Для запросов с catalog_identifier поддерживаются условные запросы с заголовками If-None-Match и If-Modified-Since,
+    ETag вычисляется по хранящемуся хешу содержимого выбранной версии справочника.
+    Если настроен общий кеш (CATALOG_CACHE['SHARED_CACHE']), то страницы элементов справочника хранятся в нем.
     """
     queryset = CatalogItem.objects.all()
-    serializer_class = CatalogItemSerializer
+    serializer_class = CatalogItemFastSerializer
     # свой фильтр для получения элементов заданного справочника текущей или указанной версии
     filter_backends = [ExactCatalogFilterBackend, filters.OrderingFilter]
     ordering_fields = ['parent_identifier']
     ordering = ['parent_identifier']
+    pagination_class = CatalogPagination
+
+    def get_validators(self, request, *args, **kwargs):
+        identifier = request.query_params.get('catalog_identifier', None)
+        if not identifier:
+            return None
+        version = request.query_params.get('catalog_version', None)
+        try:
+            on_date = get_catalog_date(request.query_params)
+        except ValueError:
+            return None
+        # справочник берется из кеша, так что при совпадении ETag запросов к базе не будет
+        catalog = catalog_cache.resolve(identifier, version=version, on_date=on_date)
+        if catalog is None:
+            return None
+        # снимок версии нужен и для поиска страницы в общем кеше
+        self.catalog = catalog
+        # страница и сортировка задаются параметрами запроса, поэтому они входят в ключ вместе с версией,
+        # а параметры сортируются, чтобы их порядок в адресе не менял ETag
+        key = f'{catalog.id}:{catalog.digest}:{urlencode(sorted(request.query_params.lists()), doseq=True)}'
+        if version is None:
+            # текущая версия (как и версия на дату) может смениться в любой момент при добавлении версий,
+            # поэтому ответ нужно каждый раз перепроверять,
+            # а время изменения не может быть раньше начала действия версии
+            last_modified = max(catalog.modified, datetime.datetime.combine(
+                catalog.date, datetime.time(), tzinfo=datetime.timezone.utc
+            ))
+            return key, last_modified, 'no-cache'
+        return key, catalog.modified, f'public, max-age={settings.CATALOG_HTTP_MAX_AGE}'
 
+    def list(self, request, *args, **kwargs):
+        catalog = getattr(self, 'catalog', None)
+        if catalog is None:
+            return super().list(request, *args, **kwargs)
+        # страница зависит от всех параметров запроса, а ссылки на соседние страницы - еще и от адреса сервера
+        key = request.build_absolute_uri()
+        data = catalog_cache.get_page(catalog, key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        catalog_cache.set_page(catalog, key, response.data)
+        return response
 
-class CatalogItemDetail(generics.RetrieveAPIView):
+
+class CatalogItemDetail(FastReadMixin, generics.RetrieveAPIView):
     """
     Конкретный элемент справочника. Read-Only.
     """
     queryset = CatalogItem.objects.all()
-    serializer_class = CatalogItemSerializer
+    serializer_class = CatalogItemFastSerializer
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer, который возвращает записанную строку вместо ее сохранения
+    """
+    def write(self, value):
+        return value
+
+
+class CatalogItemsExport(APIView):
+    """
+    Потоковая выгрузка всех элементов справочника без постраничного вывода.\n
+    Выбор справочника и версии производится также, как и на странице
+    <a href="/api/catalog-items/">со списком элементов</a>, параметрами catalog_identifier и catalog_version или date:\n
+    GET /api/catalog-items/export/?catalog_identifier=1222&catalog_version=1.3\n
+    Формат задается параметром export_format: ndjson (по умолчанию, один JSON объект на строку) или csv:\n
+    GET /api/catalog-items/export/?catalog_identifier=1222&export_format=csv
+    """
+    # поля выгрузки в том же порядке, что и в CatalogItemSerializer
+    fields = ('id', 'identifier', 'parent_identifier', 'code', 'value')
+    # количество строк, получаемых из базы за один раз
+    chunk_size = 2000
+
+    def get(self, request, format=None):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return Response({'error': 'parameter "export_format" must be "ndjson" or "csv"'})
+        queryset = ExactCatalogFilterBackend().filter_queryset(request, CatalogItem.objects.all(), self)
+        # строки получаются из базы курсором по частям в виде словарей, без создания объектов моделей
+        rows = queryset.order_by('id').values(*self.fields).iterator(chunk_size=self.chunk_size)
+        if export_format == 'csv':
+            content, content_type = self.stream_csv(rows), 'text/csv; charset=utf-8'
+        else:
+            content, content_type = self.stream_ndjson(rows), 'application/x-ndjson; charset=utf-8'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        filename = '-'.join(filter(None, (
+            'catalog-items',
+            request.query_params.get('catalog_identifier'),
+            request.query_params.get('catalog_version') or request.query_params.get('date'),
+        )))
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+        return response
+
+    @staticmethod
+    def stream_ndjson(rows):
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def stream_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.fields)
+        for row in rows:
+            yield writer.writerow([row[field] for field in self.fields])
 
 
 class CatalogItemsValidation(APIView):
@@ -96,54 +331,115 @@ class CatalogItemsValidation(APIView):
     То есть комбинацией параметров catalog_identifier и catalog_version.\n
     Для валидации необходимо совершить POST запрос как минимум с параметром catalog_identifier:\n
     POST /api/catalog-items/validation/?catalog_identifier=1222\n
+    Для проверки по версии, актуальной на дату, вместо catalog_version указывается параметр date:\n
+    POST /api/catalog-items/validation/?catalog_identifier=1222&date=2020-01-01\n
     И в теле запроса должен содержаться JSON список с объектами, которые подлежат валидации.\n
     При некорректных данных запроса в ответ будет состоять из JSON объекта с полем "error" и описание проблемы.\n
     При корректном запросе в ответе будет JSON объект с полем "short_results", в котором будет список булевых значений
     true или false на месте, соответствующему объекту в запросе.\n
     Вторым полем будет "results". Это список из пар: объект, подаваемый на валидацию и булево значение, соответствующее ему.\n
-    Если в параметрах будет указан несуществующий справочник, то все объекты будут оценены, как не прошедшие валидацию, то есть значением false.
+    Если в параметрах будет указан несуществующий справочник, то все объекты будут оценены, как не прошедшие валидацию, то есть значением false.\n
+    Для больших объемов данных тело запроса можно передать в формате NDJSON (один JSON объект на строку)
+    с заголовком Content-Type: application/x-ndjson. Тогда объекты разбираются и проверяются по мере чтения запроса,
+    а ответ передается потоком в том же формате: на каждую непустую строку запроса строка с парой
+    [объект, булево значение]. Строки с некорректным JSON (в том числе с NaN и Infinity) дают пару [null, false].
     """
+    parser_classes = [*APIView.parser_classes, NDJSONParser]
+
     def post(self, request, format=None):
         # проверяем наличие обязательного параметра
         identifier = request.query_params.get('catalog_identifier', None)
         if not identifier:
             return Response({'error': 'parameter "catalog_identifier" is required'})
-        # с помощью уже написанного фильтра получаем элементы указанного в параметрах справочника
-        queryset = CatalogItem.objects.all()
-        filter = ExactCatalogFilterBackend()
-        catalogs_items = filter.filter_queryset(request, queryset, None)
-        # сериализуем полученные элементы и сохраняем в виде словарей
-        serialized_catalogs_items = [CatalogItemSerializer(item).data for item in catalogs_items]
-        # убираем из элементов поле "id"
-        for item in serialized_catalogs_items:
-            if item.get('id', False):
-                del item['id']
+        version = request.query_params.get('catalog_version', None)
+        try:
+            on_date = get_catalog_date(request.query_params)
+        except ValueError:
+            return Response({'error': 'parameter "date" must be in YYYY-MM-DD format'})
+        # получаем из кеша хешированный индекс элементов указанного в параметрах справочника
+        # по полям identifier, parent_identifier, code, value, при промахе он строится по базе.
+        # Индекс версии на дату кешируется так же, как и индекс текущей версии
+        index = catalog_cache.get_index(identifier, version=version, on_date=on_date)
+        # тело в формате NDJSON разбирается лениво, результаты отдаются по мере проверки объектов.
+        # Пустое тело DRF не передает парсеру, для NDJSON это пустой набор объектов
+        data = request.data
+        if not isinstance(data, Iterator) and request.content_type.startswith(NDJSONParser.media_type):
+            data = iter(())
+        if isinstance(data, Iterator):
+            return StreamingHttpResponse(self.stream_ndjson(index, data),
+                                         content_type='application/x-ndjson; charset=utf-8')
         # если в теле запроса не список, то явно некорректные данные
         if not isinstance(request.data, list):
             return Response({'error': 'invalid data'})
-        # сериализуем полученные в запросе объекты
-        serialized_input_items = []
-        for item in request.data:
-            serialized_item = CatalogItemSerializer(data=item)
-            if serialized_item.is_valid():
-                serialized_input_items.append(dict(serialized_item.validated_data))
-            else:
-                serialized_input_items.append(None)
-        # заполняем список с результатами
-        validation_short_data = []
-        for item in serialized_input_items:
-            # если словарь из запроса совпадаем со словарем из выбранного справочника,
-            # то добавляем на это место True
-            if item in serialized_catalogs_items:
-                validation_short_data.append(True)
-            else:
-                validation_short_data.append(False)
+        # заполняем список с результатами, каждый объект проверяется поиском в индексе,
+        # большие запросы проверяются по частям в пуле процессов (настройка VALIDATION_PARALLEL)
+        validation_short_data = validate_items(index, request.data)
         return Response({
             'short_results': validation_short_data,
             # для полных результатов склеиваем данные запроса со списком результатов
             'results': zip(request.data, validation_short_data)
         })
 
+    @staticmethod
+    def stream_ndjson(index, items):
+        for item in items:
+            yield json.dumps([item, index.check(item)], ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class CatalogItemsBatchValidation(APIView):
+    """
+    Пакетная валидация элементов разных справочников одним запросом.\n
+    POST /api/catalog-items/validation/batch/\n
+    В теле запроса должен содержаться JSON список с объектами, каждый из которых помимо полей элемента
+    содержит поле catalog_identifier и необязательные поля catalog_version или catalog_date:\n
+    [{"catalog_identifier": "1222", "catalog_version": "1.0", "identifier": "...", ...}, ...]\n
+    Без catalog_version объект проверяется по версии справочника, актуальной на дату catalog_date
+    (в формате YYYY-MM-DD), а без обоих полей - по текущей версии.
+    Каждая упомянутая версия справочника загружается один раз на весь запрос.\n
+    Ответ имеет тот же формат, что и у обычной валидации: поля "short_results" и "results" в порядке объектов запроса.
+    Объекты без catalog_identifier, с некорректной catalog_date и объекты несуществующих справочников
+    не проходят валидацию.
+    Количество объектов в запросе ограничено настройкой VALIDATION_BATCH_MAX_SIZE.
+    """
+    def post(self, request, format=None):
+        # если в теле запроса не список, то явно некорректные данные
+        if not isinstance(request.data, list):
+            return Response({'error': 'invalid data'})
+        if len(request.data) > settings.VALIDATION_BATCH_MAX_SIZE:
+            return Response({'error': f'too many objects, maximum is {settings.VALIDATION_BATCH_MAX_SIZE}'})
+        validation_short_data = validate_batch(request.data, catalog_cache.get_index, validate_items)
+        return Response({
+            'short_results': validation_short_data,
+            'results': zip(request.data, validation_short_data)
+        })
 
 
+class CatalogItemsBulkCreate(APIView):
+    """
+    Массовая загрузка элементов справочников. Доступна только администраторам.\n
+    В теле POST запроса должен содержаться JSON список с объектами элементов:\n
+    POST /api/catalog-items/bulk/\n
+    Каждый элемент, как и при обычном создании, добавляется в текущую версию справочника
+    с идентификатором, равным его родительскому идентификатору.\n
+    Если хотя бы один объект некорректен, то ничего не создается, а в ответе будет JSON объект
+    с полем "error" и списком ошибок по каждому объекту в поле "details".\n
+    При успешной загрузке в ответе будет количество созданных элементов "created",
+    время загрузки в секундах "seconds" и скорость загрузки "rows_per_second".
+    """
+    permission_classes = [permissions.IsAdminUser]
 
+    def post(self, request, format=None):
+        # если в теле запроса не список, то явно некорректные данные
+        if not isinstance(request.data, list):
+            return Response({'error': 'invalid data'})
+        serializer = CatalogItemSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response({'error': 'invalid data', 'details': serializer.errors})
+        start = time.perf_counter()
+        created = CatalogItem.bulk_create_linked(CatalogItem(**data) for data in serializer.validated_data)
+        elapsed = time.perf_counter() - start
+        return Response({
+            'created': created,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(created / elapsed) if elapsed else created,
+        })